@@ -0,0 +1,145 @@
+"""
+Offline benchmark for the matchmaking engine (matchmaking.py). It needs no Discord connection, database or Riot API key.
+
+For each roster size it generates a seeded synthetic population, with ranks drawn from a distribution resembling the League of
+Legends ranked ladder (mapped to tiers through TIER_GROUPS, the same way the bot does) and random role preference strings,
+then runs the same partitioner /matchmake uses and records:
+- wall time of the run, and peak memory (as seen by tracemalloc) of a second run with the same seed. Tracing slows NumPy and
+  Python code down several times over, so the run that is timed isn't traced.
+- the objective value, split into its tier-difference, role-priority and lobby-spread components
+- the worst tier gap between two lane opponents in any lobby
+
+Results are written as JSON so runs from different versions of the bot can be compared. Example:
+
+    python benchmark.py --sizes 10 20 50 100 200 --repeats 3 --output benchmark_results.json
+"""
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+import matchmaking
+from rank_distribution import random_ranks
+
+
+DEFAULT_TIER_GROUPS = 'UNRANKED,IRON,BRONZE,SILVER:GOLD,PLATINUM:EMERALD:DIAMOND:MASTER:GRANDMASTER:CHALLENGER'
+
+
+def synthetic_roster(size, tier_mapping, rng):
+    # Builds a Roster of `size` players with random ranks and role preference strings
+    ranks = random_ranks(size, rng)
+    role_preferences = [''.join(str(rng.randint(1, 5)) for _ in matchmaking.ROLES) for _ in range(size)]
+    return matchmaking.Roster(
+        discord_ids=[str(100000 + i) for i in range(size)],
+        usernames=[f"Player{i + 1}" for i in range(size)],
+        tiers=[tier_mapping.get(rank, len(tier_mapping) + 1) for rank in ranks],
+        priorities=[matchmaking.parse_role_preference(preference) for preference in role_preferences]
+    )
+
+
+def run_once(roster, tier_weight, role_preference_weight, time_budget, seed):
+    # Runs the partitioner on a roster and returns the measurements for that run
+    def partition():
+        return matchmaking.partition_players(
+            roster.tiers, roster.priorities, tier_weight, role_preference_weight, time_budget, random.Random(seed)
+        )
+
+    start = time.perf_counter()
+    lobbies, objective = partition()
+    wall_time = time.perf_counter() - start
+
+    tracemalloc.start()
+    partition()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tier_diff = role_priority = worst_gap = spread = 0.0
+    for red, blue, score in lobbies:
+        lobby_tier_diff, lobby_role_priority, lobby_worst_gap = matchmaking.lineup_components(roster.tiers, roster.priorities, red, blue)
+        tier_diff += lobby_tier_diff
+        role_priority += lobby_role_priority
+        worst_gap = max(worst_gap, lobby_worst_gap)
+        spread += matchmaking.lobby_spread(roster.tiers[list(red + blue)])
+
+    return {
+        "wall_time_s": wall_time,
+        "peak_memory_bytes": peak_memory,
+        "objective": objective,
+        "tier_diff": tier_diff,
+        "role_priority": role_priority,
+        "lobby_spread": spread,
+        "worst_role_tier_gap": worst_gap,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the matchmaking engine on synthetic rosters.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 20, 50, 100, 200], help="roster sizes (multiples of 10)")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per roster size, each with a different roster")
+    parser.add_argument("--seed", type=int, default=2024, help="base seed for roster generation and the engine")
+    parser.add_argument("--time-budget", type=float, default=float(os.getenv('MATCHMAKING_TIME_BUDGET', 1.0)), help="annealing budget in seconds")
+    parser.add_argument("--tier-weight", type=float, default=float(os.getenv('TIER_WEIGHT', 0.7)))
+    parser.add_argument("--role-preference-weight", type=float, default=float(os.getenv('ROLE_PREFERENCE_WEIGHT', 0.3)))
+    parser.add_argument("--tier-groups", default=os.getenv('TIER_GROUPS', DEFAULT_TIER_GROUPS))
+    parser.add_argument("--output", default="benchmark_results.json", help="path of the JSON results file")
+    args = parser.parse_args()
+
+    tier_mapping = matchmaking.parse_tier_groups(args.tier_groups)
+    results = []
+
+    for size in args.sizes:
+        if size <= 0 or size % matchmaking.LOBBY_SIZE != 0:
+            parser.error(f"roster sizes must be positive multiples of {matchmaking.LOBBY_SIZE} (got {size})")
+
+        for repeat in range(args.repeats):
+            seed = args.seed + size * 1000 + repeat
+            roster = synthetic_roster(size, tier_mapping, random.Random(seed))
+            result = {"players": size, "lobbies": size // matchmaking.LOBBY_SIZE, "repeat": repeat, "seed": seed}
+            result.update(run_once(roster, args.tier_weight, args.role_preference_weight, args.time_budget, seed))
+            results.append(result)
+
+            print(
+                f"{size:>4} players (run {repeat + 1}/{args.repeats}): {result['wall_time_s'] * 1000:8.1f} ms, "
+                f"peak {result['peak_memory_bytes'] / 1024 / 1024:6.1f} MiB, objective {result['objective']:8.2f} "
+                f"(tier diff {result['tier_diff']:.0f}, role priority {result['role_priority']:.0f}, spread {result['lobby_spread']:.1f}), "
+                f"worst lane gap {result['worst_role_tier_gap']:.0f}"
+            )
+
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "settings": {
+            "time_budget_s": args.time_budget,
+            "tier_weight": args.tier_weight,
+            "role_preference_weight": args.role_preference_weight,
+            "tier_groups": args.tier_groups,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
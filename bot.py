@@ -1,20 +1,24 @@
-import aiohttp
 import aiosqlite # Using this package instead of sqlite for asynchronous processing support
 import asyncio
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import database # Shared SQLite connections (see database.py)
 import discord
 from discord import AllowedMentions, app_commands
 from discord.ext import commands, tasks
 from discord.utils import get
 from dotenv import load_dotenv, find_dotenv
-import itertools
 import json
 import logging
+import matchmaking # Vectorized matchmaking engine (see matchmaking.py)
+import matchmaking_jobs # Process pool that runs the matchmaking engine (see matchmaking_jobs.py)
+import migrations # Versioned database schema migrations (see migrations.py)
+import numpy as np
 from openpyxl import load_workbook
 import os
 import platform
-import random
+import player_cache # In-memory cache of players' most-read columns (see player_cache.py)
+import riot_api # Riot API rate limiting (see riot_api.py)
 import traceback
 
 
@@ -36,63 +40,108 @@ RIOT_API_KEY = os.getenv('RIOT_API_KEY')
 # Paths for spreadsheet and SQLite database on the bot host's device
 SPREADSHEET_PATH = os.path.abspath(os.getenv('SPREADSHEET_PATH'))
 DB_PATH = os.getenv('DB_PATH')
+DB_READERS = int(os.getenv('DB_READERS', 4))  # Database connections kept open for queries, besides the one used for writes
+PLAYER_CACHE_SIZE = int(os.getenv('PLAYER_CACHE_SIZE', 10000))  # Players whose most-read columns are kept in memory
+PLAYER_CACHE_FLUSH_SECONDS = float(os.getenv('PLAYER_CACHE_FLUSH_SECONDS', 5))  # How often changes made through the player cache are written to the database
 
 WELCOME_CHANNEL_ID = os.getenv('WELCOME_CHANNEL_ID')
 
 TIER_WEIGHT = float(os.getenv('TIER_WEIGHT', 0.7))  # Default value of 0.7 if not specified in .env
 ROLE_PREFERENCE_WEIGHT = float(os.getenv('ROLE_PREFERENCE_WEIGHT', 0.3))  # Default value of 0.3 if not specified in .env
 TIER_GROUPS = os.getenv('TIER_GROUPS', 'UNRANKED,IRON,BRONZE,SILVER:GOLD,PLATINUM:EMERALD:DIAMOND:MASTER:GRANDMASTER:CHALLENGER') # Setting default tier configuration if left blank in .env
+RIOT_APP_RATE_LIMIT = os.getenv('RIOT_APP_RATE_LIMIT', riot_api.DEFAULT_APP_RATE_LIMIT)  # Application rate limit of the Riot API key, until Riot's headers say otherwise
+RIOT_CONNECTIONS_PER_HOST = int(os.getenv('RIOT_CONNECTIONS_PER_HOST', 10))  # Open connections kept to each Riot API host
+RIOT_NOT_FOUND_TTL_SECONDS = float(os.getenv('RIOT_NOT_FOUND_TTL_SECONDS', 60))  # How long a Riot ID or summoner that wasn't found is remembered
+RIOT_REGIONAL_URL = os.getenv('RIOT_REGIONAL_URL', 'https://americas.api.riotgames.com')  # Base URL of Riot account lookups
+RIOT_PLATFORM_URL = os.getenv('RIOT_PLATFORM_URL', 'https://na1.api.riotgames.com')  # Base URL of summoner and rank lookups
+MATCHMAKING_TIME_BUDGET = float(os.getenv('MATCHMAKING_TIME_BUDGET', 1.0))  # Seconds /matchmake may spend rebalancing players across lobbies
+MATCHMAKING_REFINE_BUDGET = float(os.getenv('MATCHMAKING_REFINE_BUDGET', 0.5))  # Seconds /matchmake spends refining lobbies prepared during check-in
+MATCHMAKING_DEADLINE = float(os.getenv('MATCHMAKING_DEADLINE', 2.5))  # Seconds after /matchmake is used by which teams are always posted
+MATCHMAKING_BACKGROUND_BUDGET = float(os.getenv('MATCHMAKING_BACKGROUND_BUDGET', 20))  # Seconds spent looking for a better lineup after teams are posted
+MATCHMAKING_ALTERNATIVES = int(os.getenv('MATCHMAKING_ALTERNATIVES', 5))  # Lineups admins can cycle through for each lobby, counting the posted one
+REPEAT_PAIRING_WEIGHT = float(os.getenv('REPEAT_PAIRING_WEIGHT', 1.0))  # Penalty per time two players were recently teammates/opponents (0 turns it off)
+REPEAT_PAIRING_HOURS = float(os.getenv('REPEAT_PAIRING_HOURS', 12))  # How far back matches count as recent for REPEAT_PAIRING_WEIGHT
+RANK_CACHE_TTL_MINUTES = float(os.getenv('RANK_CACHE_TTL_MINUTES', 60))  # How long a stored rank is shown by /stats without refreshing it
+RANK_REFRESH_INTERVAL_MINUTES = float(os.getenv('RANK_REFRESH_INTERVAL_MINUTES', 60))  # How often every linked player's rank is refreshed (0 turns this off)
+RANK_REFRESH_CONCURRENCY = int(os.getenv('RANK_REFRESH_CONCURRENCY', 4))  # Players whose rank is looked up at the same time during a refresh
 
 
 # # Adjust event loop policy for Windows
 if platform.system() == "Windows":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     
-# Semaphore to limit the number of concurrent API requests to Riot (added to address connection errors pulling player rank with /stats)
-api_semaphore = asyncio.Semaphore(5)  # Limit concurrent requests to 5
+# Client for every Riot API request: one pooled HTTP session, with requests scheduled within Riot's rate limits and interactive
+# requests sent ahead of background ones (see riot_api.py). Identical lookups made at the same time share one request, and
+# lookups Riot answered 404 for are answered from memory for RIOT_NOT_FOUND_TTL_SECONDS. Its session is started in on_ready.
+riot_client = riot_api.RiotClient(
+    RIOT_API_KEY, RIOT_APP_RATE_LIMIT, RIOT_CONNECTIONS_PER_HOST, RIOT_NOT_FOUND_TTL_SECONDS, RIOT_REGIONAL_URL, RIOT_PLATFORM_URL
+)
+
+# Process pool that runs CPU-bound matchmaking jobs, so balancing a large event doesn't block the bot's event loop
+matchmaking_pool = matchmaking_jobs.MatchmakingPool(TIER_WEIGHT, ROLE_PREFERENCE_WEIGHT, MATCHMAKING_ALTERNATIVES)
+
+# Strong references to fire-and-forget tasks, since asyncio only keeps weak references to running tasks
+background_tasks = set()
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+# SQLite connections, opened in on_ready: commands borrow the writer connection with db.writer() and a reader with db.reader()
+db = database.Database(DB_PATH, DB_READERS)
 
-session = None
+# Players' usernames, Riot IDs, ranks and role priorities, read from memory and written back every PLAYER_CACHE_FLUSH_SECONDS
+# (see player_cache.py). Code changing those columns in the database directly must call cached_players.forget() afterwards.
+cached_players = player_cache.PlayerCache(db, PLAYER_CACHE_SIZE)
 
+@tasks.loop(seconds=PLAYER_CACHE_FLUSH_SECONDS)
+async def flush_player_cache():
+    try:
+        await cached_players.flush()
+    except Exception as e:
+        print(f"An error occurred while writing the player cache to the database: {e}")
 
-# SQLite connection
-async def get_db_connection():
-    return await aiosqlite.connect(DB_PATH)
+# RankUpdatedAt for a rank fetched now, in the format of SQLite's CURRENT_TIMESTAMP
+def rank_timestamp():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
-# creating db tables if they don't already exist
+# creating db tables if they don't already exist, and bringing the schema of an existing database up to date (see migrations.py)
 async def initialize_database():
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS "PlayerStats" (
-                "DiscordID" TEXT NOT NULL UNIQUE,
-                "DiscordUsername" TEXT NOT NULL,
-                "PlayerRiotID" TEXT UNIQUE,
-                "Participation" NUMERIC DEFAULT 0,
-                "Wins" INTEGER DEFAULT 0,
-                "MVPs" INTEGER DEFAULT 0,
-                "ToxicityPoints" NUMERIC DEFAULT 0,
-                "GamesPlayed" INTEGER DEFAULT 0,
-                "WinRate" REAL,
-                "TotalPoints" NUMERIC DEFAULT 0,
-                "PlayerTier" INTEGER DEFAULT 0,
-                "PlayerRank" TEXT DEFAULT 'UNRANKED',
-                "RolePreference" TEXT DEFAULT '55555',
-                PRIMARY KEY("DiscordID")
-)
-        ''')
-        await conn.commit()
+    async with db.writer() as conn:
+        await migrations.migrate(conn)
+        await sync_player_tiers(conn)
+
+# Sets every player's PlayerTier from their PlayerRank, since TIER_GROUPS may have changed since the bot last ran
+async def sync_player_tiers(conn):
+    ranks = {rank for rank, in await conn.execute_fetchall("SELECT DISTINCT PlayerRank FROM PlayerStats")}
+    await conn.executemany(
+        "UPDATE PlayerStats SET PlayerTier = ? WHERE PlayerRank IS ? AND PlayerTier IS NOT ?",
+        [(rank_to_tier(rank), rank, rank_to_tier(rank)) for rank in ranks]
+    )
+    await conn.commit()
 
 # On bot ready event
 @client.event
 async def on_ready():
-    global session
-    # Initialize aiohttp session when the bot starts (simplified)
-    connector = aiohttp.TCPConnector(
-        ttl_dns_cache=300,  # Cache DNS resolution for 5 minutes
-        ssl=False           # Disable SSL verification (use with caution)
-    )
-    session = aiohttp.ClientSession(connector=connector)
+    # Start the Riot API client's HTTP session (only once, since on_ready can fire again after a reconnect)
+    await riot_client.start()
+
+    # Start the matchmaking process pool (also only once)
+    matchmaking_pool.start()
     
+    await db.open()
     await initialize_database()
+    if not cached_players.players:
+        await cached_players.load()
+    if not flush_player_cache.is_running():
+        flush_player_cache.start()
+    await pairing_history.load()
+    await load_active_matches()
+    if RANK_REFRESH_INTERVAL_MINUTES > 0 and not refresh_ranks.is_running():
+        refresh_ranks.start()
     await tree.sync(guild=discord.Object(GUILD))
     print(f'Logged in as {client.user}')
     
@@ -120,6 +169,9 @@ async def on_ready():
         new_position = max(bot_role.position - 1, 1)
         await player_role.edit(position=new_position)
         await volunteer_role.edit(position=new_position)
+
+    # Prepare provisional lobbies for anyone who was already checked in before the bot (re)started
+    await pre_matchmaker.rebuild([member for member in guild.members if player_role in member.roles])
         
 @client.event
 async def on_member_join(member):
@@ -144,43 +196,6 @@ async def on_member_join(member):
     else:
         print(f"Could not find a welcome channel for guild {member.guild.name}.")
         
-# Safe API call function with retries for better error handling
-async def safe_api_call(url, headers):
-    max_retries = 3
-    retry_delay = 1  # Delay between retries in seconds
-
-    for attempt in range(max_retries):
-        try:
-            async with api_semaphore:  # Limit concurrent access to the API
-                # Using a timeout context inside the aiohttp request
-                timeout = aiohttp.ClientTimeout(total=5)  # Set a 5-second total timeout for the request
-                async with session.get(url, headers=headers, timeout=timeout) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    elif response.status == 429:  # Rate limit hit
-                        retry_after = response.headers.get("Retry-After", 1)
-                        print(f"Rate limit reached. Retrying after {retry_after} seconds.")
-                        await asyncio.sleep(int(retry_after))  # Wait for specified time
-                    else:
-                        print(f"Error fetching data: {response.status}, response: {await response.text()}")
-                        return None
-        except aiohttp.ClientConnectorError as e:
-            print(f"Connection error on attempt {attempt + 1}/{max_retries}: {e}")
-        except asyncio.TimeoutError as e:
-            print(f"Timeout error on attempt {attempt + 1}/{max_retries}: {e}")
-        except Exception as e:
-            print(f"An unexpected error occurred on attempt {attempt + 1}/{max_retries}: {e}")
-            print(traceback.format_exc())  # Print the full traceback for more details
-
-        # Retry if there are remaining attempts
-        if attempt < max_retries - 1:
-            print(f"Retrying API call in {retry_delay} seconds... (Attempt {attempt + 2}/{max_retries})")
-            await asyncio.sleep(retry_delay)
-
-    print("All attempts to connect to the Riot API have failed.")
-    return None
-
-
 """
 update_excel() is a function to update the Excel file / spreadsheet for offline database manipulation.
 This implementation (as of 2024-10-25) allows the bot host to update the database by simply altering the
@@ -236,91 +251,330 @@ def update_excel(discord_id, player_data):
         
 
 
-# Updated get_encrypted_summoner_id function
-async def get_encrypted_summoner_id(riot_id):
-    """
-    Fetches the encrypted summoner ID from the Riot API using Riot ID.
-    Args:
-    - riot_id: The player's Riot ID in 'username#tagline' format.
-    Returns:
-    - Encrypted summoner ID (summonerId) if successful, otherwise None.
-    """
+# Looks up a Riot ID's PUUID with account-v1. Returns None if the Riot ID is invalid or can't be found.
+async def fetch_puuid(riot_id, priority=riot_api.INTERACTIVE):
     # Riot ID is expected to be in the format 'username#tagline'
     if '#' not in riot_id:
         return None
 
     username, tagline = riot_id.split('#', 1)
-    url = f"https://americas.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{username}/{tagline}"
-    headers = {
-        "X-Riot-Token": RIOT_API_KEY
-    }
+    try:
+        data = await riot_client.account_by_riot_id(username, tagline, priority)
+    except riot_api.RiotAPIError as e:
+        print(e)
+        return None
+    return data.get('puuid', None) if data else None
 
-    # Fetch PUUID using the safe API call function
-    data = await safe_api_call(url, headers)
-    if data:
-        puuid = data.get('puuid', None)
-        if puuid:
-            # Use the PUUID to fetch the encrypted summoner ID
-            summoner_url = f"https://na1.api.riotgames.com/lol/summoner/v4/summoners/by-puuid/{puuid}"
-            summoner_data = await safe_api_call(summoner_url, headers)
-            if summoner_data:
-                return summoner_data.get('id', None)  # The summonerId is referred to as `id` in this response
+# Looks up the encrypted summoner ID for a PUUID with summoner-v4. Returns None if it can't be found.
+async def fetch_summoner_id(puuid, priority=riot_api.INTERACTIVE):
+    try:
+        summoner_data = await riot_client.summoner_by_puuid(puuid, priority)
+    except riot_api.RiotAPIError as e:
+        print(e)
+        return None
+    return summoner_data.get('id', None) if summoner_data else None  # The summonerId is referred to as `id` in this response
+
+# Stores a player's resolved Riot identity in the RiotIdentities table (summoner_id may be None until it is looked up)
+async def cache_riot_identity(conn, discord_id, riot_id, puuid, summoner_id=None):
+    await conn.execute(
+        "INSERT INTO RiotIdentities (DiscordID, RiotID, PUUID, SummonerID, ResolvedAt) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP) "
+        "ON CONFLICT(DiscordID) DO UPDATE SET RiotID = excluded.RiotID, PUUID = excluded.PUUID, "
+        "SummonerID = excluded.SummonerID, ResolvedAt = excluded.ResolvedAt",
+        (discord_id, riot_id, puuid, summoner_id)
+    )
+    await conn.commit()
 
-    return None
+"""
+get_encrypted_summoner_id() resolves a player's Riot ID to the encrypted summoner ID used by league-v4. Resolving takes two
+sequential Riot API calls (account-v1 for the PUUID, then summoner-v4), but the mapping almost never changes, so the result is
+kept in the RiotIdentities table. /link stores the PUUID it gets back when verifying a Riot ID, and the summoner ID is added
+the first time it's needed. A cached identity is only resolved again when the player's Riot ID no longer matches it, or when
+refresh is set because Riot answered 404 for the cached summoner ID.
+"""
+async def get_encrypted_summoner_id(discord_id, riot_id, refresh=False, priority=riot_api.INTERACTIVE):
+    """
+    Args:
+    - discord_id: The player's Discord ID.
+    - riot_id: The player's Riot ID in 'username#tagline' format, as stored in PlayerStats.
+    - refresh: Ignore the cached identity and resolve the Riot ID again.
+    - priority: riot_api.INTERACTIVE or riot_api.BACKGROUND, for any Riot API requests this needs.
+    Returns:
+    - Encrypted summoner ID (summonerId) if successful, otherwise None.
+    """
+    puuid = None
+    if not refresh:
+        async with db.reader() as conn:
+            async with conn.execute("SELECT RiotID, PUUID, SummonerID FROM RiotIdentities WHERE DiscordID = ?", (discord_id,)) as cursor:
+                cached = await cursor.fetchone()
+        if cached and cached[0] == riot_id:
+            _, puuid, summoner_id = cached
+            if summoner_id:
+                return summoner_id
+
+    # Resolve whatever isn't cached: the PUUID (unless /link already stored it), then the summoner ID
+    if puuid is None:
+        puuid = await fetch_puuid(riot_id, priority)
+        if puuid is None:
+            return None
+    summoner_id = await fetch_summoner_id(puuid, priority)
+    async with db.writer() as conn:
+        await cache_riot_identity(conn, discord_id, riot_id, puuid, summoner_id)
+    return summoner_id
 
 
 """
-    Fetches the player's rank from Riot API and updates it in the database.
+    Fetches the player's rank from Riot API.
     Args:
-    - conn: The aiosqlite connection object.
-    - discord_id: The player's Discord ID.
     - encrypted_summoner_id: The player's encrypted summoner ID.
-    - max_retries was added because sometimes the bot failed to connect to the Riot API and properly pull player rank etc (which was leading to rank showing as N/A in /stats.)
-      Now, the bot automatically retries the connection several times if this occurs.
+    - priority: riot_api.INTERACTIVE (someone is waiting for the rank) or riot_api.BACKGROUND.
+    - Retries were added because sometimes the bot failed to connect to the Riot API and properly pull player rank etc (which was leading to rank showing as N/A in /stats.)
+      Now, the bot automatically retries the connection several times if this occurs (see riot_api.RiotClient).
+    Returns:
+    - The player's solo/duo rank, "UNRANKED", "N/A" if the Riot API couldn't be reached, or None if Riot doesn't know the
+      summoner ID (see get_encrypted_summoner_id).
 """
 
-async def update_player_rank(conn, discord_id, encrypted_summoner_id):
-    await asyncio.sleep(3)  # Initial delay before making the API call
+async def request_player_rank(encrypted_summoner_id, priority=riot_api.INTERACTIVE):
+    try:
+        data = await riot_client.league_entries(encrypted_summoner_id, priority)
+    except riot_api.RiotAPIError as e:
+        print(e)
+        return "N/A"  # Return "N/A" if all attempts fail
 
-    url = f"https://na1.api.riotgames.com/lol/league/v4/entries/by-summoner/{encrypted_summoner_id}"
-    headers = {
-        "X-Riot-Token": RIOT_API_KEY
-    }
+    if data is None:
+        # The summoner ID is no longer valid, so the caller should resolve the player's Riot ID again
+        return None
+    for entry in data:
+        if entry.get("queueType") == "RANKED_SOLO_5x5":
+            return entry.get('tier', 'N/A')
+    return "UNRANKED"
+
+# Fetches the player's rank with request_player_rank() and stores it in the database. Returns the same values as
+# request_player_rank().
+async def update_player_rank(discord_id, encrypted_summoner_id, priority=riot_api.INTERACTIVE):
+    rank = await request_player_rank(encrypted_summoner_id, priority)
+    if rank not in (None, "N/A"):
+        cached_players.write(discord_id, {"PlayerRank": rank, "PlayerTier": rank_to_tier(rank), "RankUpdatedAt": rank_timestamp()})
+    return rank
+        
 
-    max_retries = 3
 
-    for attempt in range(max_retries):
+# Fetches a player's rank from Riot and stores it, using the cached summoner ID unless Riot no longer recognizes it
+async def fetch_player_rank(discord_id, riot_id, priority=riot_api.INTERACTIVE):
+    player_rank = None
+    for refresh in (False, True):
+        encrypted_summoner_id = await get_encrypted_summoner_id(discord_id, riot_id, refresh=refresh, priority=priority)
+        if not encrypted_summoner_id:
+            break
+        player_rank = await update_player_rank(discord_id, encrypted_summoner_id, priority)
+        if player_rank is not None:
+            break
+    return player_rank or "N/A"
+
+rank_refreshes = set()  # Discord IDs whose rank is being refreshed in the background
+
+async def refresh_player_rank(discord_id, riot_id):
+    try:
+        player_rank = await fetch_player_rank(discord_id, riot_id, riot_api.BACKGROUND)
+        if player_rank != "N/A":
+            pre_matchmaker.rank_changed(discord_id, player_rank)
+    except Exception as e:
+        print(f"An error occurred while refreshing the rank of {discord_id}: {e}")
+    finally:
+        rank_refreshes.discard(discord_id)
+
+# Starts a background refresh of a player's rank if it is older than RANK_CACHE_TTL_MINUTES (rank_updated_at is the stored
+# RankUpdatedAt, None if it was never fetched) and isn't already being refreshed
+def refresh_rank_if_stale(discord_id, riot_id, rank_updated_at):
+    if rank_updated_at is not None:
+        updated_at = datetime.fromisoformat(rank_updated_at).replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) - updated_at <= timedelta(minutes=RANK_CACHE_TTL_MINUTES):
+            return
+    if riot_id and discord_id not in rank_refreshes:
+        rank_refreshes.add(discord_id)
+        run_in_background(refresh_player_rank(discord_id, riot_id))
+
+"""
+get_player_rank() is the rank cache used by /stats. PlayerRank is served straight from the database while it is younger than
+RANK_CACHE_TTL_MINUTES (RankUpdatedAt records when it was fetched). Once it is older, the stored rank is still served right
+away but a refresh is started in the background (stale-while-revalidate), so the next lookup shows the new rank. Riot is only
+waited on for players whose rank has never been fetched.
+If Riot can't be reached (e.g. the Riot API's circuit breaker is open), whatever rank is stored is served instead.
+Returns:
+- (rank, updated_at): updated_at is when the rank was fetched (a UTC datetime, None if it couldn't be), and is only given
+  for ranks served from the database, so callers can show how old they are.
+"""
+async def get_player_rank(discord_id, riot_id, stored_rank, rank_updated_at):
+    if rank_updated_at is None:
+        player_rank = await fetch_player_rank(discord_id, riot_id)
+        if player_rank == "N/A" and stored_rank:
+            player_rank = stored_rank
+        return player_rank, None
+
+    refresh_rank_if_stale(discord_id, riot_id, rank_updated_at)
+    return stored_rank, datetime.fromisoformat(rank_updated_at).replace(tzinfo=timezone.utc)
+
+
+"""
+refresh_ranks() is a background job (started in on_ready) that keeps PlayerRank up to date for every linked player, since ranks
+were otherwise only refreshed when someone used /stats and /matchmake could be working from ranks weeks out of date. Every
+RANK_REFRESH_INTERVAL_MINUTES it refreshes each rank older than RANK_CACHE_TTL_MINUTES, checked-in players (Player role) first,
+then the oldest ranks first. Ranks are looked up RANK_REFRESH_CONCURRENCY players at a time with background priority (so
+/stats and /link requests go first), and handed to the player cache in chunks of RANK_REFRESH_CHUNK_SIZE players, which writes them to the database in batches.
+"""
+RANK_REFRESH_CHUNK_SIZE = 50
+
+@tasks.loop(minutes=RANK_REFRESH_INTERVAL_MINUTES)
+async def refresh_ranks():
+    try:
+        await refresh_all_ranks()
+    except Exception as e:
+        print(f"An error occurred while refreshing ranks: {e}")
+
+async def refresh_all_ranks():
+    start = datetime.now(timezone.utc)
+    refreshed = failed = 0
+
+    guild = client.get_guild(int(GUILD))
+    player_role = get(guild.roles, name='Player') if guild else None
+    checked_in = {str(member.id) for member in player_role.members} if player_role else set()
+
+    # Ranks fetched since the last flush need to be in the database to be left out
+    await cached_players.flush()
+    async with db.reader() as conn:
+        async with conn.execute(
+            "SELECT DiscordID, PlayerRiotID, RankUpdatedAt FROM PlayerStats WHERE PlayerRiotID IS NOT NULL "
+            "AND (RankUpdatedAt IS NULL OR RankUpdatedAt < datetime('now', ?))",
+            (f'-{RANK_CACHE_TTL_MINUTES} minutes',)
+        ) as cursor:
+            players = [(str(discord_id), riot_id, updated_at) for discord_id, riot_id, updated_at in await cursor.fetchall()
+                       if str(discord_id) not in rank_refreshes]
+
+    # Checked-in players first, then ranks that were never fetched, then the oldest ones
+    players.sort(key=lambda player: (player[0] not in checked_in, player[2] is not None, player[2] or ''))
+    semaphore = asyncio.Semaphore(RANK_REFRESH_CONCURRENCY)
+
+    async def look_up(discord_id, riot_id):
+        async with semaphore:
+            for refresh in (False, True):
+                encrypted_summoner_id = await get_encrypted_summoner_id(
+                    discord_id, riot_id, refresh=refresh, priority=riot_api.BACKGROUND
+                )
+                if not encrypted_summoner_id:
+                    return None
+                rank = await request_player_rank(encrypted_summoner_id, riot_api.BACKGROUND)
+                if rank is not None:
+                    return None if rank == "N/A" else rank
+            return None
+
+    for base in range(0, len(players), RANK_REFRESH_CHUNK_SIZE):
+        chunk = [(discord_id, riot_id) for discord_id, riot_id, _ in players[base:base + RANK_REFRESH_CHUNK_SIZE]]
+        rank_refreshes.update(discord_id for discord_id, _ in chunk)
         try:
-            async with api_semaphore:
-                async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        for entry in data:
-                            if entry.get("queueType") == "RANKED_SOLO_5x5":
-                                rank = entry.get('tier', 'N/A')
-                                await conn.execute(
-                                    "UPDATE PlayerStats SET PlayerRank = ? WHERE DiscordID = ?",
-                                    (rank, discord_id)
-                                )
-                                await conn.commit()
-                                return rank
-                        return "UNRANKED"
-                    else:
-                        print(f"Error fetching player rank: {response.status}, response: {await response.text()}")
-        except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, aiohttp.ClientPayloadError) as e:
-            print(f"An error occurred while connecting to the Riot API (attempt {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                print(f"Retrying in 5 seconds (attempt {attempt + 1}/{max_retries})...")
-                await asyncio.sleep(5)  # Wait for 5 seconds before retrying
-
-    print("All attempts to connect to the Riot API have failed.")
-    return "N/A"  # Return "N/A" if all attempts fail
-        
+            ranks = await asyncio.gather(*(look_up(discord_id, riot_id) for discord_id, riot_id in chunk), return_exceptions=True)
+            updates = [(rank, discord_id) for (discord_id, _), rank in zip(chunk, ranks) if isinstance(rank, str)]
+            for rank, discord_id in updates:
+                cached_players.write(discord_id, {"PlayerRank": rank, "PlayerTier": rank_to_tier(rank), "RankUpdatedAt": rank_timestamp()})
+        finally:
+            rank_refreshes.difference_update(discord_id for discord_id, _ in chunk)
+        refreshed += len(updates)
+        failed += len(chunk) - len(updates)
+        for rank, discord_id in updates:
+            pre_matchmaker.rank_changed(discord_id, rank)
+
+    report = {
+        "refreshed": refreshed,
+        "failed": failed,
+        "seconds": (datetime.now(timezone.utc) - start).total_seconds()
+    }
+    print(f"Rank refresh finished: {report['refreshed']} ranks refreshed, {report['failed']} failed, in {report['seconds']:.1f} seconds.")
+    return report
+
+
+"""
+Admin command showing the state of the Riot API client (see riot_api.py): for each Riot host, whether its circuit breaker is
+closed (requests go through), open (requests fail straight away, and /stats falls back to stored ranks) or half-open (the next
+request is a probe), along with its request counters and how many requests are waiting for the rate limiter.
+"""
+@tree.command(
+    name='riotstatus',
+    description='Show whether the bot can currently reach the Riot API.',
+    guild=discord.Object(GUILD)
+)
+@commands.has_permissions(administrator=True)
+async def riot_status(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+    try:
+        embed = discord.Embed(title="Riot API Status", color=0xffc629)
+        hosts = riot_client.status()
+        if not hosts:
+            embed.description = "No Riot API requests have been made since the bot started."
+        for host, status in hosts.items():
+            state = status["state"]
+            if status["retry_in"]:
+                state += f" (next probe in {status['retry_in']:.0f} seconds)"
+            embed.add_field(
+                name=host,
+                value=(
+                    f"**Circuit:** {state}\n"
+                    f"**Failures in a row:** {status['consecutive_failures']}\n"
+                    f"**Answered / failed / rejected:** {status['successes']} / {status['failures']} / {status['rejected']}\n"
+                    f"**Times opened:** {status['times_opened']}\n"
+                    f"**Waiting for rate limit:** {len(riot_client.rate_limiter.queues.get(host, []))}"
+                ),
+                inline=False
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    except Exception as e:
+        print(f"An error occurred while showing the Riot API status: {e}")
+        await interaction.response.send_message("An unexpected error occurred while getting the Riot API status.", ephemeral=True)
+
+
+# Admin command showing how well the player cache (see player_cache.py) is doing: how many players it holds, how many lookups
+# it answered from memory, how many players it evicted, and how many changes are waiting to be written to the database.
+@tree.command(
+    name='cachestatus',
+    description="Show the player cache's hit rate and pending writes.",
+    guild=discord.Object(GUILD)
+)
+@commands.has_permissions(administrator=True)
+async def cache_status(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+    try:
+        status = cached_players.status()
+        embed = discord.Embed(title="Player Cache Status", color=0xffc629)
+        embed.add_field(name="Players cached", value=f"{status['players']:,} of {status['capacity']:,}", inline=False)
+        embed.add_field(
+            name="Lookups",
+            value=(
+                f"**Hits / misses:** {status['hits']:,} / {status['misses']:,}"
+                + (f" ({status['hit_rate']:.0%} hit rate)" if status['hit_rate'] is not None else "")
+                + f"\n**Evictions:** {status['evictions']:,}"
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name="Writes",
+            value=(
+                f"**Players waiting to be written:** {status['dirty']:,}\n"
+                f"**Flushes:** {status['flushes']:,} ({status['rows_flushed']:,} players written)"
+            ),
+            inline=False
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    except Exception as e:
+        print(f"An error occurred while showing the player cache status: {e}")
+        await interaction.response.send_message("An unexpected error occurred while getting the player cache status.", ephemeral=True)
 
 
 """
 Command to display stats for a given user which simultaneously syncs the user's stats from the database to a spreadsheet (specified in .env) for easy viewing.0
-This command pulls and displays some stats from the database, but also makes an API call through update_player_rank() to get the user's updated League of Legends rank.
+This command pulls and displays some stats from the database, along with the user's League of Legends rank from the rank cache (see get_player_rank()),
+which calls update_player_rank() to get the user's updated rank when the stored one is missing or out of date.
 
 Note that the rank displayed in this command (and used for tier assignment i.e. matchmaking purposes) is solo/duo queue rank.
 
@@ -344,83 +598,85 @@ async def stats(interaction: discord.Interaction, player: discord.Member):
         # Update the player's Discord username in the database if needed
         await update_username(player)
 
-        # Connect to the database
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Fetch stats from the database
+        # Fetch stats from the database, once the player's changes in the player cache are written to it
+        await cached_players.flush()
+        async with db.reader() as conn:
             async with conn.execute("SELECT * FROM PlayerStats WHERE DiscordID=?", (str(player.id),)) as cursor:
                 player_stats = await cursor.fetchone()
 
-            # If player exists in the database, proceed
-            if player_stats:
-                riot_id = player_stats[2]  # The Riot ID column from the database
+        # If player exists in the database, proceed
+        if player_stats:
+            riot_id = player_stats[2]  # The Riot ID column from the database
 
-                # Update encrypted summoner ID and rank in the database
-                if riot_id:
-                    encrypted_summoner_id = await get_encrypted_summoner_id(riot_id)
-                    player_rank = await update_player_rank(conn, str(player.id), encrypted_summoner_id) if encrypted_summoner_id else "N/A"
-                else:
-                    player_rank = "N/A"
+            # Get the player's rank from the rank cache (see get_player_rank)
+            player_rank, rank_updated_at = "N/A", None
+            if riot_id:
+                player_rank, rank_updated_at = await get_player_rank(str(player.id), riot_id, player_stats[11], player_stats[13])
 
-                # Create an embed to display player stats
-                embed = discord.Embed(
-                    title=f"{player.display_name}'s Stats",
-                    color=0xffc629  # Hex color #ffc629
-                )
-                embed.set_thumbnail(url=player.avatar.url if player.avatar else None)
-
-                # Add player stats to the embed
-                embed.add_field(name="Riot ID", value=riot_id or "N/A", inline=False)
-                embed.add_field(name="Player Rank", value=player_rank, inline=False)
-                embed.add_field(name="Participation Points", value=player_stats[3], inline=True)
-                embed.add_field(name="Games Played", value=player_stats[7], inline=True)
-                embed.add_field(name="Wins", value=player_stats[4], inline=True)
-                embed.add_field(name="MVPs", value=player_stats[5], inline=True)
-                embed.add_field(name="Win Rate", value=f"{player_stats[8] * 100:.0f}%" if player_stats[8] is not None else "N/A", inline=True)
-
-                # Send the embed as a follow-up response
-                await interaction.followup.send(embed=embed, ephemeral=True)
-
-                # Prepare player data dictionary to pass to update_excel
-                player_data = {
-                    "DiscordID": player_stats[0],
-                    "DiscordUsername": player_stats[1],
-                    "PlayerRiotID": player_stats[2],
-                    "Participation": player_stats[3],
-                    "Wins": player_stats[4],
-                    "MVPs": player_stats[5],
-                    "ToxicityPoints": player_stats[6],
-                    "GamesPlayed": player_stats[7],
-                    "WinRate": player_stats[8],
-                    "PlayerTier": player_stats[10],
-                    "PlayerRank": player_rank,
-                    "RolePreference": player_stats[12]
-                }
+            # Create an embed to display player stats
+            embed = discord.Embed(
+                title=f"{player.display_name}'s Stats",
+                color=0xffc629  # Hex color #ffc629
+            )
+            embed.set_thumbnail(url=player.avatar.url if player.avatar else None)
+
+            # Add player stats to the embed
+            embed.add_field(name="Riot ID", value=riot_id or "N/A", inline=False)
+            embed.add_field(
+                name="Player Rank",
+                value=f"{player_rank} (updated <t:{int(rank_updated_at.timestamp())}:R>)" if rank_updated_at else player_rank,
+                inline=False
+            )
+            embed.add_field(name="Participation Points", value=player_stats[3], inline=True)
+            embed.add_field(name="Games Played", value=player_stats[7], inline=True)
+            embed.add_field(name="Wins", value=player_stats[4], inline=True)
+            embed.add_field(name="MVPs", value=player_stats[5], inline=True)
+            embed.add_field(name="Win Rate", value=f"{player_stats[8] * 100:.0f}%" if player_stats[8] is not None else "N/A", inline=True)
+
+            # Send the embed as a follow-up response
+            await interaction.followup.send(embed=embed, ephemeral=True)
+
+            # Prepare player data dictionary to pass to update_excel
+            player_data = {
+                "DiscordID": str(player_stats[0]),
+                "DiscordUsername": player_stats[1],
+                "PlayerRiotID": player_stats[2],
+                "Participation": player_stats[3],
+                "Wins": player_stats[4],
+                "MVPs": player_stats[5],
+                "ToxicityPoints": player_stats[6],
+                "GamesPlayed": player_stats[7],
+                "WinRate": player_stats[8],
+                "PlayerTier": player_stats[10],
+                "PlayerRank": player_rank,
+                "RolePreference": player_stats[12]
+            }
 
                 
-                # Load the workbook and sheet
-                workbook = load_workbook(SPREADSHEET_PATH)
-                sheet = workbook.active  # Using the active sheet as the default
-
-                # Check if the player exists in the sheet and if updates are needed
-                found = False
-                needs_update = False
-                for row in sheet.iter_rows(min_row=2):  # Assuming the first row is headers
-                    if str(row[0].value) == player_data["DiscordID"]:
-                        # Compare each cell to see if an update is needed
-                        for key, cell in zip(player_data.keys(), row):
-                            if cell.value != player_data[key]:
-                                needs_update = True
-                                break
-                        found = True
-                        break
+            # Load the workbook and sheet
+            workbook = load_workbook(SPREADSHEET_PATH)
+            sheet = workbook.active  # Using the active sheet as the default
+
+            # Check if the player exists in the sheet and if updates are needed
+            found = False
+            needs_update = False
+            for row in sheet.iter_rows(min_row=2):  # Assuming the first row is headers
+                if str(row[0].value) == player_data["DiscordID"]:
+                    # Compare each cell to see if an update is needed
+                    for key, cell in zip(player_data.keys(), row):
+                        if cell.value != player_data[key]:
+                            needs_update = True
+                            break
+                    found = True
+                    break
 
-                # If player is not found or an update is needed, update the Excel sheet
-                if not found or needs_update:
-                    await asyncio.to_thread(update_excel, str(player.id), player_data)
-                    await interaction.followup.send(f"Player stats for {player.display_name} have been updated in the Excel sheet.", ephemeral=True)
+            # If player is not found or an update is needed, update the Excel sheet
+            if not found or needs_update:
+                await asyncio.to_thread(update_excel, str(player.id), player_data)
+                await interaction.followup.send(f"Player stats for {player.display_name} have been updated in the Excel sheet.", ephemeral=True)
 
-            else:
-                await interaction.followup.send(f"No stats found for {player.display_name}", ephemeral=True)
+        else:
+            await interaction.followup.send(f"No stats found for {player.display_name}", ephemeral=True)
 
     except Exception as e:
         # Log the error or handle it appropriately
@@ -451,71 +707,69 @@ async def link(interaction: discord.Interaction, riot_id: str):
     tagline = tagline.strip()
 
     # Verify that the Riot ID exists using the Riot API
-    api_key = os.getenv("RIOT_API_KEY")
-    headers = {"X-Riot-Token": api_key}
-    url = f"https://americas.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{summoner_name}/{tagline}"
-
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    # Riot ID exists, proceed to link it
-                    data = await response.json()  # Get the response data
-
-                    # Debugging: Print the data to see what comes back from the API
-                    print(f"Riot API response: {data}")
-
-                    async with aiosqlite.connect(DB_PATH) as conn:
-                        try:
-                            # Check if the user already exists in the database
-                            async with conn.execute("SELECT * FROM PlayerStats WHERE DiscordID = ?", (str(member.id),)) as cursor:
-                                result = await cursor.fetchone()
-
-                            if result:
-                                # Update the existing record with the new Riot ID
-                                await conn.execute(
-                                    "UPDATE PlayerStats SET PlayerRiotID = ? WHERE DiscordID = ?",
-                                    (riot_id, str(member.id))
-                                )
-                            else:
-                                # Insert a new record if the user doesn't exist in the database
-                                await conn.execute(
-                                    "INSERT INTO PlayerStats (DiscordID, DiscordUsername, PlayerRiotID) VALUES (?, ?, ?)",
-                                    (str(member.id), member.display_name, riot_id)
-                                )
-
-                            await conn.commit()
+        data = await riot_client.account_by_riot_id(summoner_name, tagline)
+        if data:
+            # Riot ID exists, proceed to link it
+            # Debugging: Print the data to see what comes back from the API
+            print(f"Riot API response: {data}")
+
+            async with db.writer() as conn:
+                try:
+                    # Check if the user already exists in the database
+                    async with conn.execute("SELECT * FROM PlayerStats WHERE DiscordID = ?", (str(member.id),)) as cursor:
+                        result = await cursor.fetchone()
+
+                    if result:
+                        # Update the existing record with the new Riot ID
+                        await conn.execute(
+                            "UPDATE PlayerStats SET PlayerRiotID = ? WHERE DiscordID = ?",
+                            (riot_id, str(member.id))
+                        )
+                    else:
+                        # Insert a new record if the user doesn't exist in the database
+                        await conn.execute(
+                            "INSERT INTO PlayerStats (DiscordID, DiscordUsername, PlayerRiotID, PlayerTier) VALUES (?, ?, ?, ?)",
+                            (str(member.id), member.display_name, riot_id, rank_to_tier('UNRANKED'))
+                        )
+
+                    await conn.commit()
+                    # Reload the player from the database next time, keeping any changes not written to it yet
+                    cached_players.forget(str(member.id))
+
+                    # Keep the PUUID from the response so /stats doesn't have to look it up again
+                    if data.get('puuid'):
+                        await cache_riot_identity(conn, str(member.id), riot_id, data['puuid'])
 
-                            await interaction.response.send_message(
-                                f"Your Riot ID '{riot_id}' has been successfully linked to your Discord account.",
-                                ephemeral=True
-                            )
-                        except aiosqlite.IntegrityError as e:
-                            # Handle UNIQUE constraint violation (i.e., Riot ID already linked)
-                            if 'UNIQUE constraint failed: PlayerStats.PlayerRiotID' in str(e):
-                                # Riot ID is already linked to another user
-                                async with conn.execute("""
-                                    SELECT DiscordID, DiscordUsername FROM PlayerStats WHERE PlayerRiotID = ?
-                                """, (riot_id,)) as cursor:
-                                    existing_user_data = await cursor.fetchone()
-
-                                if existing_user_data:
-                                    existing_user_id, existing_username = existing_user_data
-                                    await interaction.response.send_message(
-                                        f"Error: This Riot ID is already linked to another Discord user: <@{existing_user_id}>. "
-                                        "If this is a mistake, please contact an administrator.",
-                                        ephemeral=True
-                                    )
-                            else:
-                                raise e  # Reraise the error if it's not related to UNIQUE constraint
-                else:
-                    # Riot ID does not exist or other error
-                    error_msg = await response.text()
-                    print(f"Riot API error response: {error_msg}")
                     await interaction.response.send_message(
-                        f"The Riot ID '{riot_id}' could not be found. Please double-check and try again.",
+                        f"Your Riot ID '{riot_id}' has been successfully linked to your Discord account.",
                         ephemeral=True
                     )
+                except aiosqlite.IntegrityError as e:
+                    # Handle UNIQUE constraint violation (i.e., Riot ID already linked)
+                    if 'UNIQUE constraint failed: PlayerStats.PlayerRiotID' in str(e):
+                        # Riot ID is already linked to another user
+                        async with conn.execute("""
+                            SELECT DiscordID, DiscordUsername FROM PlayerStats WHERE PlayerRiotID = ?
+                        """, (riot_id,)) as cursor:
+                            existing_user_data = await cursor.fetchone()
+
+                        if existing_user_data:
+                            existing_user_id, existing_username = existing_user_data
+                            await interaction.response.send_message(
+                                f"Error: This Riot ID is already linked to another Discord user: <@{existing_user_id}>. "
+                                "If this is a mistake, please contact an administrator.",
+                                ephemeral=True
+                            )
+                    else:
+                        raise e  # Reraise the error if it's not related to UNIQUE constraint
+        else:
+            # Riot ID does not exist
+            print(f"Riot ID not found: {riot_id}")
+            await interaction.response.send_message(
+                f"The Riot ID '{riot_id}' could not be found. Please double-check and try again.",
+                ephemeral=True
+            )
     except Exception as e:
         print(f"An error occurred while connecting to the Riot API: {e}")
         await interaction.response.send_message(
@@ -556,14 +810,16 @@ async def confirm(interaction: discord.Interaction):
     try:
         if player_to_unlink:
             # Check if the user exists in the database
-            async with aiosqlite.connect(DB_PATH) as conn:
+            async with db.writer() as conn:
                 async with conn.execute("SELECT * FROM PlayerStats WHERE DiscordID = ?", (str(player_to_unlink.id),)) as cursor:
                     player_stats = await cursor.fetchone()
 
                 if player_stats:
                     # Delete user from the database
                     await conn.execute("DELETE FROM PlayerStats WHERE DiscordID = ?", (str(player_to_unlink.id),))
+                    await conn.execute("DELETE FROM RiotIdentities WHERE DiscordID = ?", (str(player_to_unlink.id),))
                     await conn.commit()
+                    cached_players.forget(str(player_to_unlink.id), drop_writes=True)
                     await interaction.response.send_message(f"{player_to_unlink.display_name}'s Riot ID and statistics have been successfully unlinked and removed from the database.", ephemeral=True)
                     player_to_unlink = None
                 else:
@@ -610,7 +866,7 @@ async def resetdb(interaction: discord.Interaction):
         response = await client.wait_for('interaction', timeout=10.0, check=check)
 
         # If the confirmation is received, proceed with resetting the database
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with db.writer() as conn:
             await conn.execute("""
                 UPDATE PlayerStats
                 SET
@@ -681,16 +937,9 @@ class RolePreferenceDropdown(discord.ui.Select):
         # Update the selected value in the parent view's `values` dictionary
         self.parent_view.values[self.role] = int(self.values[0])
 
-        # Concatenate the role preferences into a single string
-        role_pref_string = ''.join(str(self.parent_view.values[role]) for role in ["Top", "Jungle", "Mid", "Bot", "Support"])
-
-        # Update the database with the new role preferences
-        async with aiosqlite.connect(DB_PATH) as conn:
-            await conn.execute(
-                "UPDATE PlayerStats SET RolePreference = ? WHERE DiscordID = ?",
-                (role_pref_string, str(self.parent_view.member_id))
-            )
-            await conn.commit()
+        # Update the player's role preferences (one column per role, see migrations.ROLE_PRIORITY_COLUMNS) through the player cache
+        priorities = [self.parent_view.values[role] for role in ["Top", "Jungle", "Mid", "Bot", "Support"]]
+        cached_players.write(str(self.parent_view.member_id), dict(zip(migrations.ROLE_PRIORITY_COLUMNS, priorities)))
 
         # Acknowledge interaction
         await interaction.response.defer()  # Acknowledge the interaction without updating the message
@@ -713,23 +962,14 @@ async def rolepreference(interaction: discord.Interaction):
         return
 
     # Check if the user is in the database and retrieve their current preferences
-    async with aiosqlite.connect(DB_PATH) as conn:
-        async with conn.execute("SELECT RolePreference FROM PlayerStats WHERE DiscordID = ?", (str(member.id),)) as cursor:
-            user_data = await cursor.fetchone()
+    user_data = await cached_players.get(str(member.id))
 
-        if not user_data:
-            await interaction.response.send_message("You need to link your Riot ID using /link before setting role preferences.", ephemeral=True)
-            return
+    if not user_data:
+        await interaction.response.send_message("You need to link your Riot ID using /link before setting role preferences.", ephemeral=True)
+        return
 
     # Convert the existing role preferences into a dictionary
-    role_pref_string = user_data[0]
-    initial_values = {
-        "Top": int(role_pref_string[0]),
-        "Jungle": int(role_pref_string[1]),
-        "Mid": int(role_pref_string[2]),
-        "Bot": int(role_pref_string[3]),
-        "Support": int(role_pref_string[4])
-    }
+    initial_values = dict(zip(["Top", "Jungle", "Mid", "Bot", "Support"], (user_data[column] for column in migrations.ROLE_PRIORITY_COLUMNS)))
 
     # Create the view with initial values and send initial response
     view = RolePreferenceView(member.id, initial_values)
@@ -741,30 +981,30 @@ async def rolepreference(interaction: discord.Interaction):
 
 
 
-#Player class.
+#Player class. A Player is a lightweight view of one entry in a matchmaking.Roster, which keeps the tier and role priorities of
+#every player being matched together in a single array, so creating a Player doesn't copy any of the player's data.
 class Player:
-    def __init__(self, tier, username, discord_id, top_priority, jungle_priority, mid_priority, bot_priority, support_priority):
-        self.tier = tier
-        self.username = username
-        self.discord_id = discord_id
-        self.top_priority = top_priority
-        self.jungle_priority = jungle_priority
-        self.mid_priority = mid_priority
-        self.bot_priority = bot_priority
-        self.support_priority = support_priority
-        self.random_factor = random.uniform(0.9, 1.1)  # Random factor to slightly vary the player's weight for matchmaking
-        
-    def calculate_weight(self, tier_weight, role_preference_weight):
-        # Calculate weight based on tier, role preference, and a random factor
-        base_weight = self.tier * tier_weight + (
-            self.top_priority +
-            self.jungle_priority +
-            self.mid_priority +
-            self.bot_priority +
-            self.support_priority
-        ) * role_preference_weight
-        
-        return base_weight * self.random_factor  # Add randomness to the final weight
+    __slots__ = ('roster', 'index')
+
+    def __init__(self, roster, index):
+        self.roster = roster
+        self.index = index
+
+    @property
+    def tier(self):
+        return int(self.roster.tiers[self.index])
+
+    @property
+    def username(self):
+        return self.roster.usernames[self.index]
+
+    @property
+    def discord_id(self):
+        return self.roster.discord_ids[self.index]
+
+    def priority(self, role):
+        # The player's priority (1-5) for a role, which is one of matchmaking.ROLES
+        return int(self.roster.priorities[self.index, matchmaking.ROLES.index(role)])
         
 
 #Team class.
@@ -776,10 +1016,24 @@ class Team:
         self.bot_laner = bot_laner
         self.support = support
 
+    def __iter__(self):
+        # Iterating over a team yields its players in role order (top, jungle, mid, bot, support)
+        return iter((self.top_laner, self.jungle, self.mid_laner, self.bot_laner, self.support))
+
     def __str__(self):
-        return f"Top Laner: {self.top_laner.username} priority: {self.top_laner.top_priority} (Tier {self.top_laner.tier})\nJungle: {self.jungle.username} priority:{self.jungle.jungle_priority} \
-              (Tier {self.jungle.tier})\nMid Laner: {self.mid_laner.username} priority: {self.mid_laner.mid_priority} (Tier {self.mid_laner.tier})\nBot Laner: {self.bot_laner.username} \
-                  priority: {self.bot_laner.bot_priority} (Tier {self.bot_laner.tier})\nSupport: {self.support.username} priority: {self.support.support_priority} (Tier {self.support.tier})"
+        labels = ("Top Laner", "Jungle", "Mid Laner", "Bot Laner", "Support")
+        return "\n".join(
+            f"{label}: {player.username} priority: {player.priority(role)} (Tier {player.tier})"
+            for label, role, player in zip(labels, matchmaking.ROLES, self)
+        )
+
+
+#Lobby class holding the red and blue teams generated for one group of 10 players by /matchmake.
+class Lobby:
+    def __init__(self, red_team, blue_team, score):
+        self.red_team = red_team
+        self.blue_team = blue_team
+        self.score = score  # Matchmaking objective value for this lobby (lower is better)
 
 
 #Check-in button class for checking in to tournaments.
@@ -810,6 +1064,7 @@ class CheckinButtons(discord.ui.View):
         await member.add_roles(player)
         await interaction.response.edit_message(view = self)
         await interaction.followup.send('You have checked in!', ephemeral = True)
+        await pre_matchmaker.player_joined(member)
         return "Checked in"        
 
     """
@@ -829,6 +1084,7 @@ class CheckinButtons(discord.ui.View):
 
         if player in member.roles:
             await member.remove_roles(player)
+            pre_matchmaker.player_left(member)
             await interaction.response.edit_message(view = self)
             await interaction.followup.send('Sorry to see you go.', ephemeral = True)
             return "Role Removed"
@@ -859,6 +1115,7 @@ class volunteerButtons(discord.ui.View):
 
         if player in member.roles:
             await member.remove_roles(player)
+            pre_matchmaker.player_left(member)
         if volunteer in member.roles:
             await interaction.response.edit_message(view = self)
             await interaction.followup.send('You have already volunteered to sit out, if you wish to rejoin click rejoin.', ephemeral=True)
@@ -889,6 +1146,7 @@ class volunteerButtons(discord.ui.View):
             await member.add_roles(player)
             await interaction.response.edit_message(view = self)
             await interaction.followup.send('Welcome back in!', ephemeral = True)
+            await pre_matchmaker.player_joined(member)
             return "Role Removed"
         await interaction.response.edit_message(view = self)
         await interaction.followup.send('You have not volunteered to sit out, please volunteer to sit out first.', ephemeral = True)
@@ -898,67 +1156,105 @@ class volunteerButtons(discord.ui.View):
 # Function to update Discord username in the database if it's been changed.
 async def update_username(player: discord.Member):
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Fetch the player's current data from the database
-            async with conn.execute("SELECT DiscordUsername FROM PlayerStats WHERE DiscordID=?", (str(player.id),)) as cursor:
-                player_stats = await cursor.fetchone()
+        # Fetch the player's current data from the player cache
+        player_stats = await cached_players.get(str(player.id))
 
-            # If player exists in the database and the username is outdated, update it
-            if player_stats:
-                stored_username = player_stats[0]
-                current_username = player.display_name
+        # If player exists in the database and the username is outdated, update it
+        if player_stats:
+            stored_username = player_stats["DiscordUsername"]
+            current_username = player.display_name
 
-                if stored_username != current_username:
-                    await conn.execute(
-                        "UPDATE PlayerStats SET DiscordUsername = ? WHERE DiscordID = ?",
-                        (current_username, str(player.id))
-                    )
-                    await conn.commit()
-                    print(f"Updated username in database for {player.id} from '{stored_username}' to '{current_username}'.")
+            if stored_username != current_username:
+                cached_players.write(str(player.id), {"DiscordUsername": current_username})
+                print(f"Updated username in database for {player.id} from '{stored_username}' to '{current_username}'.")
 
     except Exception as e:
         # Log the error or handle it appropriately
         print(f"An error occurred while updating username: {e}")
 
 
-async def update_points(members):
-    async with aiosqlite.connect(DB_PATH) as conn:
-        not_found_users = []
-        updated_users = []
+"""
+apply_stat_changes() is the batched way to change players' stats (used by /points): it applies a whole group of players'
+changes in one transaction. Players getting the same change are updated together with a single set-based statement, and the
+new values are computed by SQLite (e.g. Wins = Wins + 1), so two commands changing the same player at once can't overwrite each
+other's changes. WinRate is recomputed in the same transaction for every player whose Wins or GamesPlayed changed.
+Args:
+- changes: {Discord ID: {column: amount to add}}, where each column is one of STAT_COLUMNS.
+- all_or_nothing: if any of the players isn't in the database, change nobody's stats.
+Returns:
+- {"updated": set of Discord IDs whose stats were changed, "not_found": set of Discord IDs missing from the database}
+"""
+STAT_COLUMNS = ("Participation", "Wins", "MVPs", "ToxicityPoints", "GamesPlayed")
+SQL_VARIABLES_PER_STATEMENT = 500  # Discord IDs per IN (...) list, well below SQLite's limit on variables in one statement
+
+def in_chunks(values, size=SQL_VARIABLES_PER_STATEMENT):
+    values = list(values)
+    for base in range(0, len(values), size):
+        yield values[base:base + size]
+
+async def apply_stat_changes(changes, all_or_nothing=False):
+    # Players getting exactly the same change share one UPDATE
+    groups = defaultdict(list)
+    for discord_id, change in changes.items():
+        change = tuple(sorted((column, amount) for column, amount in change.items() if amount))
+        if any(column not in STAT_COLUMNS for column, amount in change):
+            raise ValueError(f"Unknown stat column in {change}")
+        if change:
+            groups[change].append(discord_id)
+
+    async with db.writer() as conn:
+        found = set()
+        for chunk in in_chunks(changes):
+            placeholders = ', '.join('?' for _ in chunk)
+            async with conn.execute(f"SELECT DiscordID FROM PlayerStats WHERE DiscordID IN ({placeholders})", chunk) as cursor:
+                found.update(str(discord_id) for discord_id, in await cursor.fetchall())
+        not_found = set(changes) - found
+        if all_or_nothing and not_found:
+            return {"updated": set(), "not_found": not_found}
+
+        updated, win_rate_changed = set(), set()
+        for change, discord_ids in groups.items():
+            discord_ids = [discord_id for discord_id in discord_ids if discord_id in found]
+            assignments = ', '.join(f"{column} = {column} + ?" for column, amount in change)
+            amounts = [amount for column, amount in change]
+            for chunk in in_chunks(discord_ids):
+                placeholders = ', '.join('?' for _ in chunk)
+                await conn.execute(f"UPDATE PlayerStats SET {assignments} WHERE DiscordID IN ({placeholders})", amounts + chunk)
+            updated.update(discord_ids)
+            if any(column in ("Wins", "GamesPlayed") for column, amount in change):
+                win_rate_changed.update(discord_ids)
+
+        # WinRate is the share of games won (0-1), like /stats expects
+        for chunk in in_chunks(win_rate_changed):
+            placeholders = ', '.join('?' for _ in chunk)
+            await conn.execute(
+                "UPDATE PlayerStats SET WinRate = CASE WHEN GamesPlayed > 0 THEN CAST(Wins AS REAL) / GamesPlayed END "
+                f"WHERE DiscordID IN ({placeholders})", chunk
+            )
+        await conn.commit()
 
-        # Iterate through all members with Player or Volunteer roles
-        for member in members:
-            async with conn.execute("SELECT Participation, GamesPlayed FROM PlayerStats WHERE DiscordID = ?", (str(member.id),)) as cursor:
-                result = await cursor.fetchone()
-
-            if result:
-                participation, games_played = result
-
-                # Check if the member has the Player or Volunteer role
-                if any(role.name == "Player" for role in member.roles):
-                    # Update both Participation and GamesPlayed for Players
-                    await conn.execute(
-                        "UPDATE PlayerStats SET Participation = ?, GamesPlayed = ? WHERE DiscordID = ?",
-                        (participation + 1, games_played + 1, str(member.id))
-                    )
-                    updated_users.append(member.display_name)
-                elif any(role.name == "Volunteer" for role in member.roles):
-                    # Update only Participation for Volunteers
-                    await conn.execute(
-                        "UPDATE PlayerStats SET Participation = ? WHERE DiscordID = ?",
-                        (participation + 1, str(member.id))
-                    )
-                    updated_users.append(member.display_name)
-            else:
-                # Add users who are not found in the database to the list
-                not_found_users.append(member.display_name)
+    return {"updated": updated, "not_found": not_found}
 
-        await conn.commit()
 
-    return {"success": updated_users, "not_found": not_found_users}
-    
+# Gives every player (Player role) a participation point and a game played, and every volunteer (Volunteer role) a participation point
+async def update_points(members):
+    changes = {}
+    for member in members:
+        if any(role.name == "Player" for role in member.roles):
+            changes[str(member.id)] = {"Participation": 1, "GamesPlayed": 1}
+        elif any(role.name == "Volunteer" for role in member.roles):
+            changes[str(member.id)] = {"Participation": 1}
+        else:
+            changes[str(member.id)] = {}
+
+    result = await apply_stat_changes(changes)
+    return {
+        "success": [member.display_name for member in members if str(member.id) in result["updated"]],
+        "not_found": [member.display_name for member in members if str(member.id) in result["not_found"]]
+    }
+
 async def update_toxicity(member):
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with db.writer() as conn:
         # Attempt to find the user in the PlayerStats table
         async with conn.execute("SELECT ToxicityPoints FROM PlayerStats WHERE DiscordID = ?", (str(member.id),)) as cursor:
             result = await cursor.fetchone()
@@ -979,47 +1275,6 @@ async def update_toxicity(member):
 
         return False  # User not found
 
-async def check_winners_in_db(winners):
-    not_found_users = []
-    async with aiosqlite.connect(DB_PATH) as conn:
-        for winner in winners:
-            # Check if the player exists in the database
-            async with conn.execute("SELECT Wins, GamesPlayed FROM PlayerStats WHERE DiscordID = ?", (str(winner.id),)) as cursor:
-                result = await cursor.fetchone()
-
-            if not result:
-                # Add to not found list
-                not_found_users.append(winner)
-    
-async def update_wins(winners):
-    async with aiosqlite.connect(DB_PATH) as conn:
-        for winner in winners:
-            # Since we already checked for existence, we can directly update
-            async with conn.execute("SELECT Wins, GamesPlayed FROM PlayerStats WHERE DiscordID = ?", (str(winner.id),)) as cursor:
-                result = await cursor.fetchone()
-                if result:
-                    wins, games_played = result
-                    # Update the Wins and GamesPlayed for the player
-                    await conn.execute(
-                        "UPDATE PlayerStats SET Wins = ?, GamesPlayed = ? WHERE DiscordID = ?",
-                        (wins + 1, games_played + 1, str(winner.id))
-                    )
-                    # Update win rate for the player
-                    await update_win_rate(str(winner.id))
-
-        await conn.commit()
-        
-# code to calculate and update winrate in database
-async def update_win_rate(discord_id):
-    async with await get_db_connection() as conn:
-        async with conn.execute("SELECT Wins, GamesPlayed FROM PlayerStats WHERE DiscordID = ?", (discord_id,)) as cursor:
-            result = await cursor.fetchone()
-    if result:
-        wins, games_played = result
-        win_rate = (wins / games_played) * 100 if games_played > 0 else 0
-        await conn.execute("UPDATE PlayerStats SET WinRate = ? WHERE DiscordID = ?", (win_rate, discord_id))
-        await conn.commit()
-
 #Command to start check-in
 @tree.command(
     name = 'checkin',
@@ -1106,12 +1361,13 @@ async def win(interaction: discord.Interaction, match_number: str, lobby_number:
         # Get the winning team's players
         winning_team = active_matches[match_key][team.lower()]
 
-        # Update wins for each player on the winning team
         await interaction.response.defer(ephemeral=True)
 
-         # This part of the command's code checking for unfound users should basically never be necessary anymore because it was added at a time when this command asked an admin to
-         # specify 5 usernames. However, it's being kept here for error handling in case a team is somehow created with users who are not in the database during /matchmaking testing.
-        not_found_users = await check_winners_in_db(winning_team)
+        # Checking for unfound users should basically never be necessary anymore because it was added at a time when this command asked an admin to specify
+        # 5 usernames. However, it's being kept here for error handling in case a team is somehow created with users who are not in the database during
+        # /matchmaking testing.
+        records = await fetch_player_records([player.discord_id for player in winning_team])
+        not_found_users = [player for player in winning_team if player.discord_id not in records]
 
         if not_found_users:
             missing_users = ", ".join([user.username for user in not_found_users])
@@ -1119,8 +1375,23 @@ async def win(interaction: discord.Interaction, match_number: str, lobby_number:
                 f"Data integrity error; the following players could not be found in the database, so no wins were updated: \n{missing_users}",
                 ephemeral=True
             )
+            return
+
+        # Record the result in the match ledger, which gives the winners their wins (or moves them to the new winners if this lobby's
+        # result is being corrected), and lets future matchmaking avoid putting the same players together again
+        previous_winner = await pairing_history.record_match(match_number, lobby_number, active_matches[match_key], team.lower())
+
+        if previous_winner == team.lower():
+            await interaction.followup.send(
+                f"The {team.lower()} team's win in this match was already recorded, so nothing was changed.",
+                ephemeral=True
+            )
+        elif previous_winner:
+            await interaction.followup.send(
+                f"The result of this match has been corrected: the win has been moved from the {previous_winner} team to the {team.lower()} team.",
+                ephemeral=True
+            )
         else:
-            await update_wins(winning_team)
             await interaction.followup.send(
                 "All players on the winning team have had their 'Wins' updated.",
                 ephemeral=True
@@ -1140,6 +1411,70 @@ async def win(interaction: discord.Interaction, match_number: str, lobby_number:
         )
 
 
+"""
+rebuild_match_totals() recomputes every player's aggregates in PlayerMatchTotals from the match ledger (Matches and
+MatchParticipants) in one pass over it, for when they may have drifted from it (e.g. after the database was edited by hand).
+The triggers that normally maintain them also keep PlayerStats.Wins in step, so any difference in a player's ledger wins is added
+to their Wins as well; wins from before the ledger existed, or taken away by /resetdb, are left as they are.
+Returns:
+- {"players": players in the ledger, "changed": players whose aggregates were wrong, "wins_changed": players whose Wins were changed}
+"""
+async def rebuild_match_totals():
+    # Wins a player is owed (or was given too many of) by their old aggregates
+    owed_wins = (
+        "(SELECT total(Wins) FROM (SELECT MatchWins AS Wins FROM temp.LedgerTotals l WHERE l.DiscordID = PlayerStats.DiscordID "
+        "UNION ALL SELECT -MatchWins FROM main.PlayerMatchTotals t WHERE t.DiscordID = PlayerStats.DiscordID))"
+    )
+    async with db.writer() as conn:
+        await conn.execute("BEGIN")
+        await conn.execute("DROP TABLE IF EXISTS temp.LedgerTotals")
+        await conn.execute(
+            "CREATE TEMP TABLE LedgerTotals (DiscordID INTEGER PRIMARY KEY, MatchesPlayed INTEGER, MatchWins INTEGER, LastPlayedAt TEXT)"
+        )
+        await conn.execute(f"INSERT INTO temp.LedgerTotals {migrations.LEDGER_TOTALS}")
+
+        (players,), = await conn.execute_fetchall("SELECT count(*) FROM temp.LedgerTotals")
+        (changed,), = await conn.execute_fetchall(
+            "SELECT count(DISTINCT DiscordID) FROM ("
+            "SELECT * FROM temp.LedgerTotals EXCEPT SELECT * FROM main.PlayerMatchTotals UNION ALL "
+            "SELECT * FROM (SELECT * FROM main.PlayerMatchTotals EXCEPT SELECT * FROM temp.LedgerTotals))"
+        )
+        cursor = await conn.execute(
+            f"UPDATE PlayerStats SET Wins = Wins + {owed_wins}, "
+            f"WinRate = CASE WHEN GamesPlayed > 0 THEN CAST(Wins + {owed_wins} AS REAL) / GamesPlayed END "
+            f"WHERE {owed_wins} != 0"
+        )
+        wins_changed = cursor.rowcount
+
+        await conn.execute("DELETE FROM PlayerMatchTotals")
+        await conn.execute("INSERT INTO PlayerMatchTotals SELECT * FROM temp.LedgerTotals")
+        await conn.execute("DROP TABLE temp.LedgerTotals")
+        await conn.commit()
+
+    return {"players": players, "changed": changed, "wins_changed": wins_changed}
+
+@tree.command(
+    name='rebuildstats',
+    description="Recompute every player's match results from the recorded matches.",
+    guild=discord.Object(GUILD)
+)
+@commands.has_permissions(administrator=True)
+async def rebuild_stats(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+    try:
+        await interaction.response.defer(ephemeral=True)
+        result = await rebuild_match_totals()
+        await interaction.followup.send(
+            f"Recomputed the match results of {result['players']} players from the recorded matches. "
+            f"{result['changed']} of them were out of date, and {result['wins_changed']} players' wins were corrected.",
+            ephemeral=True
+        )
+    except Exception as e:
+        print(f"An error occurred while rebuilding match results: {e}")
+        await interaction.followup.send("An unexpected error occurred while recomputing match results.", ephemeral=True)
+
        
 # Slash command to remove all users from the Player and Volunteer roles.
 @tree.command(
@@ -1170,6 +1505,9 @@ async def remove(interaction: discord.Interaction):
                 permission_issue = True
                 print(f"Could not remove roles from {user.display_name}. Check role hierarchy.")
 
+        # Nobody is checked in anymore, so the provisional lobbies from pre-matchmaking are discarded
+        pre_matchmaker.reset()
+
         # Prepare the response message
         if permission_issue:
             response_message = (
@@ -1283,19 +1621,393 @@ async def points(interaction: discord.Interaction):
         print(f'An error occurred: {e}')
         await interaction.followup.send("An unexpected error occurred while updating participation points.", ephemeral=True)
 
-# Parse TIER_GROUPS from the .env file
-def parse_tier_groups(tier_groups_string):
-    tier_mapping = {}
-    groups = tier_groups_string.split(':')
-    for tier_index, group in enumerate(groups, start=1):
-        ranks = group.split(',')
-        for rank in ranks:
-            tier_mapping[rank.strip().upper()] = tier_index
-    return tier_mapping
-
-TIER_MAPPING = parse_tier_groups(TIER_GROUPS)
+# Parse TIER_GROUPS from the .env file (see matchmaking.parse_tier_groups)
+TIER_MAPPING = matchmaking.parse_tier_groups(TIER_GROUPS)
 active_matches = {}  # Global dictionary to store match and lobby data after `/matchmake`
 
+# Assign tier dynamically based on rank using TIER_MAPPING (ranks missing from TIER_GROUPS are placed above every group)
+def rank_to_tier(player_rank):
+    return TIER_MAPPING.get((player_rank or 'UNRANKED').upper(), len(TIER_MAPPING) + 1)
+
+
+"""
+Roster loading for /matchmake and pre-matchmaking. Every player's record is fetched with IN (...) lists of up to
+SQL_VARIABLES_PER_STATEMENT Discord IDs, all on one borrowed connection, so loading an event takes one query for any realistic
+number of players instead of one per player.
+"""
+# Returns {Discord ID: (PlayerRank, role priorities, PlayerRiotID, RankUpdatedAt)} for the Discord IDs found in the database,
+# where role priorities is a tuple of 5 ints in matchmaking.ROLES order
+async def fetch_player_records(discord_ids):
+    return {
+        discord_id: (player["PlayerRank"], tuple(player[column] for column in migrations.ROLE_PRIORITY_COLUMNS), player["PlayerRiotID"],
+                     player["RankUpdatedAt"])
+        for discord_id, player in (await cached_players.get_many(discord_ids)).items()
+    }
+
+# Loads the checked-in members as a matchmaking.Roster (in the order given). Returns (roster, missing), where missing lists the
+# members without a database record, who can't be matched; roster is None if anyone is missing.
+async def load_roster(members):
+    records = await fetch_player_records(str(member.id) for member in members)
+    missing = [member for member in members if str(member.id) not in records]
+    if missing:
+        return None, missing
+
+    roster = matchmaking.Roster(
+        discord_ids=[str(member.id) for member in members],
+        usernames=[member.display_name for member in members],
+        tiers=[rank_to_tier(records[str(member.id)][0]) for member in members],
+        priorities=[records[str(member.id)][1] for member in members]
+    )
+    return roster, []
+
+
+"""
+active_matches is also stored in the ActiveLobbies table (one row per player of each lobby posted by /matchmake, together with
+the match /win recorded for it, if any), and reloaded when the bot starts, so lobbies can still be decided or corrected with
+/win after a restart.
+"""
+# Stores the lobbies of a match just put in active_matches ({lobby number: entry}), replacing what was stored for those lobbies
+async def save_active_lobbies(match_number, lobbies):
+    rows = [
+        (str(match_number), str(lobby_number), team, role, player.discord_id, player.username)
+        for lobby_number, entry in lobbies.items() for team in ('red', 'blue') for role, player in zip(matchmaking.ROLES, entry[team])
+    ]
+    async with db.writer() as conn:
+        await conn.executemany(
+            "DELETE FROM ActiveLobbies WHERE MatchNumber = ? AND LobbyNumber = ?",
+            [(str(match_number), str(lobby_number)) for lobby_number in lobbies]
+        )
+        await conn.executemany(
+            "INSERT INTO ActiveLobbies (MatchNumber, LobbyNumber, Team, Role, DiscordID, DiscordUsername) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+        await conn.commit()
+
+# Puts the lobbies stored in ActiveLobbies back in active_matches (keeping any that are already there, e.g. after a reconnect)
+async def load_active_matches():
+    async with db.reader() as conn:
+        rows = await conn.execute_fetchall(
+            "SELECT a.MatchNumber, a.LobbyNumber, a.Team, a.Role, a.DiscordID, a.DiscordUsername, a.MatchID, m.WinningTeam "
+            "FROM ActiveLobbies a LEFT JOIN Matches m ON m.MatchID = a.MatchID"
+        )
+
+    lobbies = {}
+    for match_number, lobby_number, team, role, discord_id, username, match_id, winning_team in rows:
+        lobby = lobbies.setdefault(
+            f"match_{match_number}_lobby_{lobby_number}", {'red': {}, 'blue': {}, 'match_id': match_id, 'winning_team': winning_team}
+        )
+        lobby[team][role] = (discord_id, username)
+
+    # Lobbies are only restored with all 10 players; every player gets a row of one roster, in lobby, team and role order
+    lobbies = {match_key: lobby for match_key, lobby in lobbies.items()
+               if all(set(lobby[team]) == set(matchmaking.ROLES) for team in ('red', 'blue'))}
+    players = [lobby[team][role] for lobby in lobbies.values() for team in ('red', 'blue') for role in matchmaking.ROLES]
+
+    # Tiers and role priorities are only shown in embeds by now, so current ones (or defaults for removed players) will do
+    records = await fetch_player_records(discord_id for discord_id, username in players)
+    roster = matchmaking.Roster(
+        discord_ids=[discord_id for discord_id, username in players],
+        usernames=[username for discord_id, username in players],
+        tiers=[rank_to_tier(records[discord_id][0] if discord_id in records else None) for discord_id, username in players],
+        priorities=[records[discord_id][1] if discord_id in records else (5,) * len(matchmaking.ROLES) for discord_id, username in players]
+    )
+
+    positions = iter(range(len(players)))
+    for match_key, lobby in lobbies.items():
+        entry = {team: Team(*(Player(roster, next(positions)) for role in matchmaking.ROLES)) for team in ('red', 'blue')}
+        if lobby['match_id'] is not None:
+            entry['match_id'], entry['winning_team'] = lobby['match_id'], lobby['winning_team']
+        active_matches.setdefault(match_key, entry)
+    print(f"Loaded {len(lobbies)} lobbies posted by /matchmake.")
+
+
+"""
+Repeat-pairing history: every match decided with /win is stored in the Matches and MatchParticipants tables, and pairing_history
+keeps counts of how often each two players were teammates or opponents in matches from the last REPEAT_PAIRING_HOURS hours
+(loaded from the database when the bot starts, then updated after each /win). Matchmaking adds REPEAT_PAIRING_WEIGHT to the
+objective for every such past pairing that a lineup repeats, so players see new teammates and opponents across a night.
+"""
+class PairingHistory:
+    def __init__(self):
+        self.counts = {}  # (Discord ID, Discord ID) in sorted order -> [times as teammates, times as opponents]
+        self.matches = []  # (played at, red Discord IDs, blue Discord IDs) for every match counted, oldest first
+        self.locks = {}  # (match number, lobby number) -> asyncio.Lock held while /win records that lobby's result
+
+    async def load(self):
+        self.counts.clear()
+        self.matches.clear()
+        async with db.reader() as conn:
+            async with conn.execute(
+                "SELECT m.MatchID, m.PlayedAt, p.DiscordID, p.Team FROM Matches m JOIN MatchParticipants p ON p.MatchID = m.MatchID "
+                "WHERE m.PlayedAt >= datetime('now', ?) ORDER BY m.PlayedAt, m.MatchID",
+                (f'-{REPEAT_PAIRING_HOURS} hours',)
+            ) as cursor:
+                rows = await cursor.fetchall()
+
+        matches = {}
+        for match_id, played_at, discord_id, team in rows:
+            played_at = datetime.fromisoformat(played_at).replace(tzinfo=timezone.utc)
+            matches.setdefault(match_id, (played_at, [], []))[1 if team == 'red' else 2].append(discord_id)
+        for played_at, red, blue in matches.values():
+            self._count(played_at, red, blue)
+        print(f"Loaded the teammates and opponents of {len(self.matches)} recent matches.")
+
+    async def record_match(self, match_number, lobby_number, match, winning_team):
+        """
+        Records a match decided with /win in the match ledger along with its participants (the ledger's triggers give the winners
+        their wins), and counts its teammates and opponents.
+        Args:
+        - match: the lobby's entry in active_matches ({'red': Team, 'blue': Team}).
+        - winning_team: 'red' or 'blue'.
+        Returns:
+        - The winning team previously recorded for the match if /win was already used for it, otherwise None.
+        """
+        # One /win at a time per lobby, so using it twice in quick succession can't insert the match twice
+        async with self.locks.setdefault((match_number, lobby_number), asyncio.Lock()):
+            return await self._record_match(match_number, lobby_number, match, winning_team)
+
+    async def _record_match(self, match_number, lobby_number, match, winning_team):
+        if 'match_id' in match:
+            # /win was used again for the same lobby, e.g. to correct the winner, so the match is already counted. Changing its
+            # WinningTeam moves the win to the other team's players and is logged in MatchCorrections.
+            previous_winner = match.get('winning_team')
+            async with db.writer() as conn:
+                await conn.execute("UPDATE Matches SET WinningTeam = ? WHERE MatchID = ?", (winning_team, match['match_id']))
+                await conn.commit()
+            match['winning_team'] = winning_team
+            return previous_winner
+
+        red = [player.discord_id for player in match['red']]
+        blue = [player.discord_id for player in match['blue']]
+        async with db.writer() as conn:
+            cursor = await conn.execute(
+                "INSERT INTO Matches (MatchNumber, LobbyNumber, WinningTeam) VALUES (?, ?, ?)", (match_number, lobby_number, winning_team)
+            )
+            match_id = cursor.lastrowid
+            await conn.executemany(
+                "INSERT INTO MatchParticipants (MatchID, DiscordID, Team, Role) VALUES (?, ?, ?, ?)",
+                [(match_id, discord_id, team, role)
+                 for team, discord_ids in (('red', red), ('blue', blue)) for role, discord_id in zip(matchmaking.ROLES, discord_ids)]
+            )
+            # So /win can still correct this result after a restart
+            await conn.execute(
+                "UPDATE ActiveLobbies SET MatchID = ? WHERE MatchNumber = ? AND LobbyNumber = ?", (match_id, match_number, lobby_number)
+            )
+            await conn.commit()
+
+        match['match_id'], match['winning_team'] = match_id, winning_team
+        self._count(datetime.now(timezone.utc), red, blue)
+        return None
+
+    def _count(self, played_at, red, blue, step=1):
+        if step > 0:
+            self.matches.append((played_at, red, blue))
+        for team in (red, blue):
+            for i, player in enumerate(team):
+                for other in team[i + 1:]:
+                    self.counts.setdefault(tuple(sorted((player, other))), [0, 0])[0] += step
+        for player in red:
+            for other in blue:
+                self.counts.setdefault(tuple(sorted((player, other))), [0, 0])[1] += step
+
+    def _expire(self):
+        # Drops matches that are no longer recent from the counts
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=REPEAT_PAIRING_HOURS)
+        while self.matches and self.matches[0][0] < cutoff:
+            played_at, red, blue = self.matches.pop(0)
+            self._count(played_at, red, blue, step=-1)
+        self.counts = {pair: count for pair, count in self.counts.items() if any(count)}
+
+    def costs(self, discord_ids):
+        """
+        Builds the repeat-pairing costs matchmaking uses for a set of players (see matchmaking.py).
+        Args:
+        - discord_ids: Discord IDs of the players, in roster order.
+        Returns:
+        - a (2, n, n) array of teammate and opponent costs, or None if none of these players were recently paired.
+        """
+        self._expire()
+        if REPEAT_PAIRING_WEIGHT <= 0 or not self.counts:
+            return None
+
+        index = {discord_id: i for i, discord_id in enumerate(discord_ids)}
+        pairing = np.zeros((2, len(discord_ids), len(discord_ids)))
+        for (player, other), count in self.counts.items():
+            if player in index and other in index:
+                pairing[:, index[player], index[other]] = pairing[:, index[other], index[player]] = count
+        if not pairing.any():
+            return None
+        return pairing * REPEAT_PAIRING_WEIGHT
+
+pairing_history = PairingHistory()
+
+
+"""
+Pre-matchmaking: rather than doing all of the matchmaking work at the moment an admin types /matchmake, the bot keeps a
+provisional set of lobbies for the players who are currently checked in. The check-in and volunteer buttons report every join
+and leave to pre_matchmaker, which repairs the provisional lobbies in the background instead of recomputing them:
+- a new player waits on a "bench" until 10 unplaced players are available, at which point those 10 form a new lobby
+- a player leaving a lobby is replaced by the benched player closest to them in tier, or, if nobody is benched, that lobby is
+  broken up and its remaining players go back to the bench
+- only the lobbies that changed are solved again, followed by a short rebalancing pass across all lobbies
+When /matchmake is used with exactly the players the provisional lobbies cover, it publishes them (after an optional refinement
+of MATCHMAKING_REFINE_BUDGET seconds) instead of starting from scratch.
+"""
+PREMATCHMAKING_REPAIR_BUDGET = 0.25  # Seconds of rebalancing across lobbies after each round of joins/leaves
+
+class PreMatchmaker:
+    def __init__(self):
+        self.players = {}  # Discord ID -> (display name, tier, role priorities) for every checked-in player with a database record
+        self.lineups = []  # Provisional lobbies as [red, blue, score], teams being lists of Discord IDs in role order (score is None until solved)
+        self.bench = []  # Discord IDs of players who aren't in a provisional lobby yet (always fewer than 10)
+        self.version = 0  # Incremented on every join/leave so a repair can tell whether it worked on outdated data
+        self.repair_task = None
+
+    def reset(self):
+        self.players.clear()
+        self.lineups.clear()
+        self.bench.clear()
+        self.version += 1
+
+    # Rebuilds the provisional lobbies from scratch, e.g. for players who still have the Player role after the bot restarts
+    async def rebuild(self, members):
+        self.reset()
+        records = await fetch_player_records(str(member.id) for member in members)
+        for member in members:
+            self._add_player(member, records.get(str(member.id)))
+
+    async def player_joined(self, member: discord.Member):
+        discord_id = str(member.id)
+        if discord_id in self.players:
+            return
+        records = await fetch_player_records([discord_id])
+        self._add_player(member, records.get(discord_id))
+
+    def _add_player(self, member, player_data):
+        # player_data is the player's record from fetch_player_records()
+        discord_id = str(member.id)
+        # Players without a database record can't be matched (/matchmake will report them), and the player may have been
+        # added by another button press while the database was being read
+        if not player_data or discord_id in self.players:
+            return
+
+        # Get an out-of-date rank refreshed (at background priority) while check-in is still open, so /matchmake doesn't have to
+        # wait on Riot. The player's tier is updated through rank_changed() once the refresh finishes.
+        player_rank, priorities, riot_id, rank_updated_at = player_data
+        refresh_rank_if_stale(discord_id, riot_id, rank_updated_at)
+
+        self.players[discord_id] = (member.display_name, rank_to_tier(player_rank), priorities)
+        self.bench.append(discord_id)
+        if len(self.bench) >= 10:
+            self.lineups.append([self.bench[:5], self.bench[5:10], None])
+            del self.bench[:10]
+        self._changed()
+
+    # Keeps a checked-in player's tier in step with a refreshed rank, solving their lobby again if the tier changed
+    def rank_changed(self, discord_id, player_rank):
+        if discord_id not in self.players:
+            return
+        display_name, tier, priorities = self.players[discord_id]
+        new_tier = rank_to_tier(player_rank)
+        if new_tier == tier:
+            return
+
+        self.players[discord_id] = (display_name, new_tier, priorities)
+        for lineup in self.lineups:
+            if discord_id in lineup[0] or discord_id in lineup[1]:
+                lineup[2] = None
+        self._changed()
+
+    def player_left(self, member: discord.Member):
+        discord_id = str(member.id)
+        if discord_id not in self.players:
+            return
+
+        _, tier, _ = self.players.pop(discord_id)
+        if discord_id in self.bench:
+            self.bench.remove(discord_id)
+        else:
+            lineup = next(lineup for lineup in self.lineups if discord_id in lineup[0] or discord_id in lineup[1])
+            if self.bench:
+                # Fill the empty spot with the benched player closest in tier; the lobby gets solved again during the repair
+                replacement = min(self.bench, key=lambda other: abs(self.players[other][1] - tier))
+                self.bench.remove(replacement)
+                team = lineup[0] if discord_id in lineup[0] else lineup[1]
+                team[team.index(discord_id)] = replacement
+                lineup[2] = None
+            else:
+                self.lineups.remove(lineup)
+                self.bench.extend(other for other in lineup[0] + lineup[1] if other != discord_id)
+        self._changed()
+
+    def _changed(self):
+        self.version += 1
+        if self.repair_task is None or self.repair_task.done():
+            self.repair_task = asyncio.create_task(self._repair())
+
+    def _roster(self, discord_ids):
+        return matchmaking.Roster(
+            discord_ids=discord_ids,
+            usernames=[self.players[discord_id][0] for discord_id in discord_ids],
+            tiers=[self.players[discord_id][1] for discord_id in discord_ids],
+            priorities=[self.players[discord_id][2] for discord_id in discord_ids]
+        )
+
+    async def _repair(self):
+        # Keeps repairing until a repair finishes without any joins or leaves having happened while it ran
+        while True:
+            version = self.version
+            discord_ids = list(self.players)
+            index = {discord_id: i for i, discord_id in enumerate(discord_ids)}
+            roster = self._roster(discord_ids)
+            pairing = pairing_history.costs(discord_ids)
+
+            async def solve_if_needed(red, blue, score):
+                red, blue = [index[p] for p in red], [index[p] for p in blue]
+                if score is None:
+                    return await matchmaking_pool.solve_lobby(roster.tiers, roster.priorities, red + blue, pairing)
+                return red, blue, score
+
+            try:
+                lineups = await asyncio.gather(*(solve_if_needed(*lineup) for lineup in self.lineups))
+                lineups, _ = await matchmaking_pool.improve_lineups(lineups, roster.tiers, roster.priorities, PREMATCHMAKING_REPAIR_BUDGET, pairing)
+            except Exception as e:
+                print(f"An error occurred while updating provisional lobbies: {e}")
+                return
+
+            if self.version == version:
+                self.lineups = [[[discord_ids[i] for i in red], [discord_ids[i] for i in blue], score] for red, blue, score in lineups]
+                return
+
+    async def starting_lineups(self, roster, deadline=None):
+        """
+        Returns the provisional lobbies as (red, blue, score) tuples of indices into the given roster, rescored with the roster's
+        data, if they cover exactly the roster's players. Otherwise (or if they aren't ready) returns None.
+        A repair that is still running is waited for (for up to 5 seconds), but not past DEADLINE_RESERVE before the deadline
+        (a time from the event loop's clock), if given.
+        """
+        if self.repair_task is not None and not self.repair_task.done():
+            timeout = 5
+            if deadline is not None:
+                timeout = max(min(timeout, deadline - asyncio.get_running_loop().time() - DEADLINE_RESERVE), 0)
+            try:
+                await asyncio.wait_for(asyncio.shield(self.repair_task), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        if self.bench or set(self.players) != set(roster.discord_ids) or any(score is None for _, _, score in self.lineups):
+            return None
+
+        index = {discord_id: i for i, discord_id in enumerate(roster.discord_ids)}
+        pairing = pairing_history.costs(roster.discord_ids)
+        lineups = []
+        for red, blue, _ in self.lineups:
+            red, blue = [index[p] for p in red], [index[p] for p in blue]
+            score = matchmaking.lineup_score(roster.tiers, roster.priorities, red, blue, TIER_WEIGHT, ROLE_PREFERENCE_WEIGHT, pairing)
+            lineups.append((red, blue, score))
+        return lineups
+
+pre_matchmaker = PreMatchmaker()
+
 @tree.command(
     name='matchmake',
     description="Form teams for all players enrolled in the game",
@@ -1317,162 +2029,348 @@ async def matchmake(interaction: discord.Interaction, match_number: str, lobby_n
             if volunteer_role in user.roles:
                 volunteer_users.append(user)
 
-        # Check if the number of players is valid for matchmaking
-        if len(player_users) % 10 != 0:
+        # Teams are always posted by this point, with whatever the best lineup found so far is
+        deadline = asyncio.get_running_loop().time() + MATCHMAKING_DEADLINE
+
+        # Lobbies are numbered starting from lobby_number, e.g. 30 players with lobby_number 1 fill lobbies 1, 2 and 3
+        if not lobby_number.isdigit():
             await interaction.response.send_message(
-                "Error: The number of players must be a multiple of 10.", ephemeral=True)
+                "Error: The lobby number must be a whole number.", ephemeral=True)
             return
+        first_lobby_number = int(lobby_number)
 
-        # Retrieve player stats from the database
-        matched_players = []
-        async with aiosqlite.connect(DB_PATH) as conn:
-            for player in player_users:
-                async with conn.execute("SELECT DiscordID, PlayerRiotID, PlayerRank, PlayerTier, RolePreference FROM PlayerStats WHERE DiscordID = ?", (str(player.id),)) as cursor:
-                    player_data = await cursor.fetchone()
-                    if player_data:
-                        discord_id, riot_id, player_rank, player_tier, role_pref = player_data
-                        # Assign tier dynamically based on rank using TIER_MAPPING
-                        player_tier = TIER_MAPPING.get(player_rank.upper(), len(TIER_MAPPING) + 1)
-                        matched_players.append(Player(
-                            tier=player_tier,
-                            username=player.display_name,
-                            discord_id=discord_id,
-                            role_preference=role_pref
-                        ))
-
-        if len(matched_players) != len(player_users):
+        # Check if the number of players is valid for matchmaking
+        if not player_users:
             await interaction.response.send_message(
-                "Error: Some players are missing from the database.", ephemeral=True)
+                "Error: No players have checked in.", ephemeral=True)
             return
 
-        # Create the best teams based on matchmaking criteria
-        best_teams = await create_best_teams(matched_players)
-
-        if not best_teams:
+        if len(player_users) % 10 != 0:
             await interaction.response.send_message(
-                "Error: Unable to create balanced teams.", ephemeral=True)
+                "Error: The number of players must be a multiple of 10.", ephemeral=True)
             return
 
-        # Prepare embeds for teams and volunteers
-        embed_lobby = discord.Embed(color=discord.Color.from_rgb(255, 198, 41), title=f'Lobby {lobby_number} - Match: {match_number}')
-        embed_lobby.add_field(name='Roles', value='Top\nJungle\nMid\nBot\nSupport', inline=True)
-        embed_lobby.add_field(name='Red Team', value='\n'.join(player.username for player in best_teams[0].red_team), inline=True)
-        embed_lobby.add_field(name='Blue Team', value='\n'.join(player.username for player in best_teams[0].blue_team), inline=True)
+        # Defer right away since balancing a large event can take longer than the 3 seconds Discord allows for a response.
+        # The progress message sent below is edited as matchmaking advances, and finally replaced with the teams.
+        await interaction.response.defer(thinking=True)
+        progress_message = await interaction.followup.send(f"Loading {len(player_users)} checked-in players...", wait=True)
+
+        async def report_progress(text):
+            await progress_message.edit(content=text)
+
+        # Retrieve every checked-in player's rank and role preferences from the database, packed into a roster (the input format
+        # used by the matchmaking engine)
+        roster, missing = await load_roster(player_users)
+        if missing:
+            missing_names = ", ".join(member.display_name for member in missing)
+            await report_progress(
+                f"Error: The following checked-in players are missing from the database, so matchmaking can't continue. "
+                f"They need to use /link first:\n{missing_names}"
+            )
+            return
 
-        embed_volunteers = discord.Embed(color=discord.Color.blurple(), title=f'Volunteers - Match: {match_number}')
-        if volunteer_users:
-            embed_volunteers.add_field(name='', value='\n'.join(vol.display_name for vol in volunteer_users))
+        # Create the best teams based on matchmaking criteria, starting from the lobbies prepared during check-in if they cover
+        # exactly these players
+        starting_lineups = await pre_matchmaker.starting_lineups(roster, deadline)
+        if starting_lineups is not None:
+            result = await create_best_teams(
+                roster, progress=report_progress, starting_lineups=starting_lineups, time_budget=MATCHMAKING_REFINE_BUDGET, deadline=deadline
+            )
         else:
-            embed_volunteers.add_field(name='', value='No volunteers.')
+            await report_progress(f"Balancing {len(roster)} players into {len(roster) // 10} lobbies...")
+            result = await create_best_teams(roster, progress=report_progress, deadline=deadline)
 
-        # Send the embeds
-        await interaction.response.send_message(embeds=[embed_lobby, embed_volunteers])
+        if not result:
+            await report_progress("Error: Unable to create balanced teams.")
+            return
 
-        # Store the match and lobby information for later reference in `/win`
-        match_key = f"match_{match_number}_lobby_{lobby_number}"
-        active_matches[match_key] = {
-            'red': best_teams[0].red_team,
-            'blue': best_teams[0].blue_team
-        }
+        # Replace the progress message with the embeds for every lobby and the volunteers, and store the lobbies for `/win`
+        messages = [progress_message]
+        embeds = matchmaking_embeds(result["lobbies"], match_number, first_lobby_number, volunteer_users, coverage_footer(result))
+        entries = {}
+        await publish_lobbies(interaction, messages, embeds, result, match_number, first_lobby_number, entries)
+
+        # Keep looking for a better lineup in the background, offering it to the admin if a materially better one turns up
+        if len(result["lobbies"]) > 1 and MATCHMAKING_BACKGROUND_BUDGET > 0:
+            run_in_background(keep_improving_lineup(
+                interaction, messages, roster, result, entries, match_number, first_lobby_number, volunteer_users
+            ))
 
     except Exception as e:
         print(f'An error occurred: {e}')
-        await interaction.response.send_message(
-            "An unexpected error occurred while forming teams.", ephemeral=True
-        )
-
-async def create_best_teams(players):
-    if len(players) % 10 != 0:
-        return None
+        if interaction.response.is_done():
+            await interaction.followup.send("An unexpected error occurred while forming teams.", ephemeral=True)
+        else:
+            await interaction.response.send_message(
+                "An unexpected error occurred while forming teams.", ephemeral=True
+            )
 
-    sorted_players = sorted(players, key=lambda x: x.tier)
-    group_size = 10
-    num_groups = (len(sorted_players) + group_size - 1) // group_size
-    best_teams = []
+# Builds the embed showing one lobby's teams. note is shown under the teams, e.g. while an admin is looking at an alternative lineup.
+def lobby_embed(lobby, match_number, lobby_number, note=None):
+    embed_lobby = discord.Embed(color=discord.Color.from_rgb(255, 198, 41), title=f'Lobby {lobby_number} - Match: {match_number}', description=note)
+    embed_lobby.add_field(name='Roles', value='Top\nJungle\nMid\nBot\nSupport', inline=True)
+    embed_lobby.add_field(name='Red Team', value='\n'.join(player.username for player in lobby.red_team), inline=True)
+    embed_lobby.add_field(name='Blue Team', value='\n'.join(player.username for player in lobby.blue_team), inline=True)
+    return embed_lobby
+
+# Builds the embeds for a set of lobbies (numbered starting from first_lobby_number), followed by one listing the volunteers
+def matchmaking_embeds(best_teams, match_number, first_lobby_number, volunteer_users, footer=None):
+    embeds = [lobby_embed(lobby, match_number, lobby_number) for lobby_number, lobby in enumerate(best_teams, start=first_lobby_number)]
+
+    embed_volunteers = discord.Embed(color=discord.Color.blurple(), title=f'Volunteers - Match: {match_number}')
+    if volunteer_users:
+        embed_volunteers.add_field(name='', value='\n'.join(vol.display_name for vol in volunteer_users))
+    else:
+        embed_volunteers.add_field(name='', value='No volunteers.')
+    embeds.append(embed_volunteers)
+
+    if footer:
+        embeds[-1].set_footer(text=footer)
+    return embeds
+
+# Describes how much of the search space matchmaking covered, for the footer of the /matchmake embeds
+def coverage_footer(result):
+    text = f"Matchmaking objective: {result['objective']:.2f} (lower is better). Teams and roles within each lobby were solved exactly"
+    if result["moves_evaluated"]:
+        text += (
+            f"; {result['moves_evaluated']:,} swaps between lobbies were evaluated in {result['search_seconds']:.1f}s "
+            f"(about {result['moves_evaluated'] / result['neighborhood_size']:.0f}x the number of possible swaps)"
+        )
+    return text + "."
+
+# Posts matchmaking embeds by editing the given messages, sending follow-ups for any embeds that don't fit (Discord allows 10 per
+# message), then stores the lobbies in active_matches (and ActiveLobbies) for `/win`, recording the stored entries by match key in entries. Each
+# message gets a LineupAlternativesView for the lobbies it shows.
+async def publish_lobbies(interaction, messages, embeds, result, match_number, first_lobby_number, entries):
+    entries.clear()
+    stored = {}
+    for lobby_number, lobby in enumerate(result["lobbies"], start=first_lobby_number):
+        match_key = f"match_{match_number}_lobby_{lobby_number}"
+        active_matches[match_key] = entries[match_key] = stored[lobby_number] = {
+            'red': lobby.red_team,
+            'blue': lobby.blue_team
+        }
+    await save_active_lobbies(match_number, stored)
+
+    for i, start in enumerate(range(0, len(embeds), 10)):
+        chunk = embeds[start:start + 10]
+        lobby_numbers = range(first_lobby_number + start, first_lobby_number + min(start + 10, len(result["lobbies"])))
+        view = None
+        if lobby_numbers:
+            view = LineupAlternativesView(chunk, [
+                (lobby_number, result["alternatives"][lobby_number - first_lobby_number]) for lobby_number in lobby_numbers
+            ], entries, match_number)
+        if i < len(messages):
+            await messages[i].edit(content=None, embeds=chunk, view=view)
+        else:
+            messages.append(await interaction.followup.send(embeds=chunk, view=view or discord.utils.MISSING, wait=True))
 
-    for i in range(num_groups):
-        group = sorted_players[i * group_size: (i + 1) * group_size]
-        if len(group) == group_size:
-            teams = await create_best_teams_helper(group)
-            if teams:
-                best_teams.extend(teams)
+"""
+LineupAlternativesView lets admins cycle through the alternative lineups kept for each lobby of a /matchmake message (see
+create_best_teams()) and confirm one, which replaces that lobby's teams in active_matches for `/win`. Nothing is recomputed:
+the alternatives were already found while matchmaking. Alternatives that haven't been confirmed are marked as such in the embed.
+"""
+class LineupAlternativesView(discord.ui.View):
+    # timeout after 1800 seconds, by which point the matches have most likely started
+    def __init__(self, embeds, lobbies, entries, match_number, *, timeout = 1800):
+        super().__init__(timeout = timeout)
+        self.embeds = embeds  # The message's embeds, one per lobby in order (followed by the volunteers embed on the last message)
+        self.lobbies = lobbies  # (lobby number, list of alternative Lobby objects) for every lobby shown in the message
+        self.entries = entries  # Entries this /matchmake stored in active_matches, by match key
+        self.match_number = match_number
+        self.selected = 0  # Position in self.lobbies of the lobby the buttons act on
+        self.shown = [0] * len(lobbies)  # Alternative currently displayed for each lobby
+        self.confirmed = [0] * len(lobbies)  # Alternative stored in active_matches for each lobby
+
+        if len(lobbies) > 1:
+            self.add_item(LobbySelect(self))
+        if max(len(alternatives) for lobby_number, alternatives in lobbies) < 2:
+            for item in self.children:
+                item.disabled = True
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("Only administrators can change the lineups.", ephemeral=True)
+            return False
+        return True
 
-    return best_teams
+    def render(self, position):
+        lobby_number, alternatives = self.lobbies[position]
+        shown, confirmed = self.shown[position], self.confirmed[position]
+        note = None
+        if len(alternatives) > 1:
+            note = f"Lineup {shown + 1} of {len(alternatives)}"
+            if shown != 0:
+                difference = round(alternatives[shown].score - alternatives[0].score, 2) + 0.0  # + 0.0 turns -0.0 into 0.0
+                note += f" (score {difference:+.2f} compared to lineup 1)"
+            if shown != confirmed:
+                note += "\n**Not confirmed**: press Confirm to use this lineup for `/win`."
+        self.embeds[position] = lobby_embed(alternatives[shown], self.match_number, lobby_number, note)
+
+    async def cycle(self, interaction, step):
+        lobby_number, alternatives = self.lobbies[self.selected]
+        self.shown[self.selected] = (self.shown[self.selected] + step) % len(alternatives)
+        self.render(self.selected)
+        await interaction.response.edit_message(embeds = self.embeds, view = self)
+
+    @discord.ui.button(label = "Previous lineup", style = discord.ButtonStyle.grey)
+    async def previous_lineup(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.cycle(interaction, -1)
+
+    @discord.ui.button(label = "Next lineup", style = discord.ButtonStyle.grey)
+    async def next_lineup(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.cycle(interaction, 1)
+
+    @discord.ui.button(label = "Confirm", style = discord.ButtonStyle.green)
+    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
+        lobby_number, alternatives = self.lobbies[self.selected]
+        match_key = f"match_{self.match_number}_lobby_{lobby_number}"
+
+        # Only replace the lobby if it is still the one this /matchmake posted (it may have been matched again since)
+        if active_matches.get(match_key) is not self.entries.get(match_key):
+            await interaction.response.send_message(
+                f"Lobby {lobby_number} has been replaced since these teams were posted, so its lineup can't be changed here.", ephemeral=True)
+            return
+        # Once /win has recorded the lobby's result, a later /win for it corrects that result, so its teams have to stay as recorded
+        if 'match_id' in self.entries[match_key]:
+            await interaction.response.send_message(
+                f"A result has already been recorded for lobby {lobby_number}, so its lineup can't be changed anymore.", ephemeral=True)
+            return
 
-async def create_randomized_teams(players):
-    # Randomly shuffle players to introduce randomness in the matchmaking
-    random.shuffle(players)
-    
-    # Split players into groups of 10 to form teams
-    group_size = 10
-    num_groups = len(players) // group_size
-    teams = []
+        lobby = alternatives[self.shown[self.selected]]
+        active_matches[match_key] = self.entries[match_key] = {
+            'red': lobby.red_team,
+            'blue': lobby.blue_team
+        }
+        self.confirmed[self.selected] = self.shown[self.selected]
+        self.render(self.selected)
+        await interaction.response.edit_message(embeds = self.embeds, view = self)
+        await save_active_lobbies(self.match_number, {lobby_number: active_matches[match_key]})
+        await interaction.followup.send(f"Lineup {self.shown[self.selected] + 1} is now used for lobby {lobby_number}.", ephemeral = True)
 
-    for i in range(num_groups):
-        group = players[i * group_size: (i + 1) * group_size]
-        
-        # Generate balanced teams with added randomness
-        best_team = await create_best_teams_helper(group)
-        if best_team:
-            teams.append(best_team)
 
-    return teams
+# Chooses which lobby of a /matchmake message the LineupAlternativesView buttons act on
+class LobbySelect(discord.ui.Select):
+    def __init__(self, parent_view: LineupAlternativesView):
+        self.parent_view = parent_view
+        options = [
+            discord.SelectOption(label=f"Lobby {lobby_number}", value=str(position), default=position == 0)
+            for position, (lobby_number, alternatives) in enumerate(parent_view.lobbies)
+        ]
+        super().__init__(placeholder="Select the lobby to change", min_values=1, max_values=1, options=options)
 
+    async def callback(self, interaction: discord.Interaction):
+        self.parent_view.selected = int(self.values[0])
+        for option in self.options:
+            option.default = option.value == self.values[0]
+        await interaction.response.edit_message(view=self.parent_view)
+
+# Button offered to the admin who used /matchmake when a better lineup is found after the teams were posted
+class UpdatedLineupView(discord.ui.View):
+    # timeout after 600 seconds, by which point the matches have most likely started
+    def __init__(self, apply_update, *, timeout = 600):
+        super().__init__(timeout = timeout)
+        self.apply_update = apply_update
 
+    @discord.ui.button(label = "Use updated lineup", style = discord.ButtonStyle.green)
+    async def use_updated_lineup(self, interaction: discord.Interaction, button: discord.ui.Button):
+        button.disabled = True
+        await interaction.response.edit_message(view = self)
+        await interaction.followup.send(await self.apply_update(), ephemeral = True)
+        self.stop()
 
-async def create_best_teams_helper(players):
-    if len(players) != 10:
-        return None
+# After teams are posted, keeps searching for up to MATCHMAKING_BACKGROUND_BUDGET seconds and offers the result to the admin if it
+# improves the matchmaking objective by at least MATERIAL_IMPROVEMENT
+MATERIAL_IMPROVEMENT = 0.05
 
-    lowest_score = float('inf')
-    best_team = None
+async def keep_improving_lineup(interaction, messages, roster, result, entries, match_number, first_lobby_number, volunteer_users):
+    try:
+        improved = await create_best_teams(roster, starting_lineups=result["lineups"], time_budget=MATCHMAKING_BACKGROUND_BUDGET)
+    except Exception as e:
+        print(f"An error occurred while looking for a better lineup: {e}")
+        return
 
-    # Randomize permutations to create different results for the same set of players
-    permutations = list(itertools.permutations(players, 5))
-    random.shuffle(permutations)
+    if improved["objective"] > result["objective"] * (1 - MATERIAL_IMPROVEMENT):
+        return
 
-    for team1_players in permutations:
-        team1 = list(team1_players)
-        team2 = [player for player in players if player not in team1]
+    async def apply_update():
+        # Only replace the lobbies if they are still the ones this /matchmake posted
+        if any(active_matches.get(match_key) is not entry for match_key, entry in entries.items()):
+            return "These lobbies have changed since the updated lineup was found, so it was discarded."
+        if any('match_id' in entry for entry in entries.values()):
+            return "A result has already been recorded for one of these lobbies, so the updated lineup was discarded."
+        embeds = matchmaking_embeds(improved["lobbies"], match_number, first_lobby_number, volunteer_users, coverage_footer(improved))
+        await publish_lobbies(interaction, messages, embeds, improved, match_number, first_lobby_number, entries)
+        return "The updated lineup has been posted."
+
+    await interaction.followup.send(
+        f"A better lineup was found after the teams were posted (matchmaking objective {result['objective']:.2f} → {improved['objective']:.2f}). "
+        "Would you like to use it instead? Only do this if the matches haven't started yet.",
+        view=UpdatedLineupView(apply_update),
+        ephemeral=True
+    )
 
-        # Calculate score difference with some randomness
-        score_diff = await calculate_score_diff(Team(*team1), Team(*team2), tier_weight=TIER_WEIGHT)
+# Time kept free before a /matchmake deadline for solving the lobbies the search changed and posting the teams
+DEADLINE_RESERVE = 0.5
 
-        # Calculate team priorities with randomness
-        team1_priority = await calculate_team_priority(*team1, role_preference_weight=ROLE_PREFERENCE_WEIGHT)
-        team2_priority = await calculate_team_priority(*team2, role_preference_weight=ROLE_PREFERENCE_WEIGHT)
+"""
+create_best_teams() returns a dictionary describing the result:
+- "lobbies": a Lobby (red and blue Team) for every 10 players, ordered from the lowest to the highest average tier
+- "alternatives": for every lobby, a list of up to MATCHMAKING_ALTERNATIVES distinct Lobby options (the posted one first)
+- "lineups": the same lobbies as (red, blue, score) tuples of roster indices, which can be passed back in as starting_lineups
+- "objective": the total matchmaking objective reached (lower is better)
+- "moves_evaluated", "neighborhood_size", "search_seconds": how much searching between lobbies was done
+
+The search is "anytime": given a deadline (a time from the event loop's clock), it stops moving players between lobbies in time
+to post the best lineup found so far before the deadline passes.
+"""
+async def create_best_teams(roster, progress=None, starting_lineups=None, time_budget=None, deadline=None):
+    if len(roster) % 10 != 0:
+        return None
 
-        total_score = score_diff * TIER_WEIGHT + (team1_priority + team2_priority) * ROLE_PREFERENCE_WEIGHT
+    tiers, priorities = roster.tiers, roster.priorities
+    pairing = pairing_history.costs(roster.discord_ids)
+    if time_budget is None:
+        time_budget = MATCHMAKING_TIME_BUDGET
 
-        if total_score < lowest_score:
-            lowest_score = total_score
-            best_team = Team(team1, team2)
+    if starting_lineups is None:
+        # Start from players sorted by tier in groups of 10, with every lobby solved exactly in parallel
+        groups = matchmaking.tier_sorted_groups(tiers)
+        lineups = await asyncio.gather(*(matchmaking_pool.solve_lobby(tiers, priorities, members, pairing) for members in groups))
+    else:
+        # Start from lobbies that were already prepared (see PreMatchmaker)
+        lineups = list(starting_lineups)
 
-    return best_team
+    if deadline is not None:
+        time_budget = min(time_budget, deadline - asyncio.get_running_loop().time() - DEADLINE_RESERVE)
 
+    # With more than one lobby, the global partitioner moves players between lobbies to improve the overall balance
+    if len(lineups) > 1 and time_budget > 0 and progress:
+        await progress(f"Rebalancing players across {len(lineups)} lobbies (up to {time_budget:.1f} seconds)...")
+    lineups, stats = await matchmaking_pool.improve_lineups(lineups, tiers, priorities, time_budget, pairing)
 
+    lobbies, objective = matchmaking.finish_partition(lineups, tiers, TIER_WEIGHT)
+    print(f"Formed {len(lobbies)} lobbies for {len(roster)} players (matchmaking objective: {objective:.2f}, {stats['moves_evaluated']} swaps evaluated).")
 
-async def calculate_team_priority(top, jungle, mid, bot, support):
-    # Calculating the total priority score for the team by adding the squares of each player's role priority.
-    # The lower the number, the closer the players are to their most preferred roles.
-    priority = 0
-    priority += top.top_priority ** 2
-    priority += jungle.jungle_priority ** 2
-    priority += mid.mid_priority ** 2
-    priority += bot.bot_priority ** 2
-    priority += support.support_priority ** 2
-    return priority
+    # Keep the next best distinct lineups for every lobby (solved in parallel), so admins can switch without searching again
+    alternatives = await asyncio.gather(*(matchmaking_pool.lobby_alternatives(tiers, priorities, lineup, pairing) for lineup in lobbies))
 
+    def to_lobby(red, blue, score):
+        return Lobby(
+            red_team=Team(*(Player(roster, i) for i in red)),
+            blue_team=Team(*(Player(roster, i) for i in blue)),
+            score=score
+        )
 
-#calculates the score difference in tier for any 2 given teams (i.e. how well it's balanced with regard to tier)
-async def calculate_score_diff(team1, team2):
-    # Calculating the tier score difference for each role between two teams.
-    diff = (team1.top_laner.tier - team2.top_laner.tier) ** 2 + \
-           (team1.mid_laner.tier - team2.mid_laner.tier) ** 2 + \
-           (team1.bot_laner.tier - team2.bot_laner.tier) ** 2 + \
-           (team1.jungle.tier - team2.jungle.tier) ** 2 + \
-           (team1.support.tier - team2.support.tier) ** 2
-    return diff
+    return {
+        "lobbies": [to_lobby(*lineup) for lineup in lobbies],
+        "alternatives": [[to_lobby(*lineup) for lineup in lineups] for lineups in alternatives],
+        "lineups": lobbies,
+        "objective": objective,
+        "moves_evaluated": stats["moves_evaluated"],
+        "neighborhood_size": stats["neighborhood_size"],
+        "search_seconds": stats["seconds"],
+    }
 
 
 def has_roles(team, required_roles):
@@ -1527,27 +2425,29 @@ async def start_voting(initial_message: discord.Message):
 
     await asyncio.sleep(60)  # Wait for the final minute to end
 
-    async with await get_db_connection() as conn:
-        # Calculate MVP based on votes
-        if votes:
-            max_votes = max(votes.values())
-            mvp_candidates = [player for player, count in votes.items() if count == max_votes]
+    # Calculate MVP based on votes
+    if votes:
+        max_votes = max(votes.values())
+        mvp_candidates = [player for player, count in votes.items() if count == max_votes]
             
-            # Update MVPs in the database
+        # Update MVPs in the database
+        # MVPs are found by DiscordUsername, so usernames changed through the player cache need to be written first
+        await cached_players.flush()
+        async with db.writer() as conn:
             for mvp in mvp_candidates:
                 await conn.execute("UPDATE PlayerStats SET MVPs = MVPs + 1 WHERE DiscordUsername = ?", (mvp,))
             await conn.commit()
 
-            # Prepare MVP result message
-            if len(mvp_candidates) == 1:
-                await initial_message.channel.send(f"🎉 {mvp_candidates[0]} has been voted the MVP of this round! 🎉", ephemeral=False)
-            else:
-                mvp_list = ", ".join(mvp_candidates)
-                await initial_message.channel.send(f"🎉 The MVP(s) with the highest votes are: {mvp_list}. 🎉", ephemeral=False)
-
-            mvp_updates_today += 1
+        # Prepare MVP result message
+        if len(mvp_candidates) == 1:
+            await initial_message.channel.send(f"🎉 {mvp_candidates[0]} has been voted the MVP of this round! 🎉", ephemeral=False)
         else:
-            await initial_message.channel.send("No votes were cast. No MVP this round.", ephemeral=False)
+            mvp_list = ", ".join(mvp_candidates)
+            await initial_message.channel.send(f"🎉 The MVP(s) with the highest votes are: {mvp_list}. 🎉", ephemeral=False)
+
+        mvp_updates_today += 1
+    else:
+        await initial_message.channel.send("No votes were cast. No MVP this round.", ephemeral=False)
     
     votes.clear()
     has_voted.clear()
@@ -1564,60 +2464,58 @@ async def votemvp(interaction: discord.Interaction, player: discord.Member):
     member = interaction.user
 
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Ensure the user has linked their Riot ID
-            async with conn.execute("SELECT PlayerRiotID FROM PlayerStats WHERE DiscordID = ?", (str(member.id),)) as cursor:
-                linked_account = await cursor.fetchone()
-            if not linked_account or not linked_account[0]:
-                await interaction.response.send_message("You must link your Riot ID before participating in MVP voting. Use `/link` to link your account.", ephemeral=True)
-                return
+        # Ensure the user has linked their Riot ID
+        linked_account = await cached_players.get(str(member.id))
+        if not linked_account or not linked_account["PlayerRiotID"]:
+            await interaction.response.send_message("You must link your Riot ID before participating in MVP voting. Use `/link` to link your account.", ephemeral=True)
+            return
 
-            # Ensure voting is not exceeding the 3 MVP updates limit per day
-            if mvp_updates_today >= 3:
-                await interaction.response.send_message("The maximum number of MVP votes for today has been reached.", ephemeral=True)
-                return
+        # Ensure voting is not exceeding the 3 MVP updates limit per day
+        if mvp_updates_today >= 3:
+            await interaction.response.send_message("The maximum number of MVP votes for today has been reached.", ephemeral=True)
+            return
 
-            # Ensure the user has the Player or Volunteer role
-            if not any(role.name in ["Player", "Volunteer"] for role in member.roles):
-                await interaction.response.send_message("You do not have the necessary role to vote.", ephemeral=True)
+        # Ensure the user has the Player or Volunteer role
+        if not any(role.name in ["Player", "Volunteer"] for role in member.roles):
+            await interaction.response.send_message("You do not have the necessary role to vote.", ephemeral=True)
+            return
+
+        # Register the vote
+        votes[player.display_name] += 1
+        has_voted.add(member.id)
+
+        # Notify everyone about the vote, mentioning both parties without notifications
+        allowed_mentions = discord.AllowedMentions(users=False)
+        await interaction.response.send_message(
+            f"{member.mention} has voted for {player.mention}.",
+            allowed_mentions=allowed_mentions,
+            ephemeral=False
+        )
+
+        # If there's no voting session currently active, initiate one
+        if not voting_in_progress:
+            # Get Player and Volunteer roles
+            player_role = discord.utils.get(interaction.guild.roles, name="Player")
+            volunteer_role = discord.utils.get(interaction.guild.roles, name="Volunteer")
+            if not player_role or not volunteer_role:
+                await interaction.followup.send("Player or Volunteer roles are not configured properly.", ephemeral=True)
                 return
 
-            # Register the vote
-            votes[player.display_name] += 1
-            has_voted.add(member.id)
+            # Mention Player and Volunteer roles
+            mentions = f"{player_role.mention} {volunteer_role.mention}"
+                
+            # Set allowed_mentions to explicitly mention roles
+            allowed_mentions_roles = discord.AllowedMentions(roles=True)
 
-            # Notify everyone about the vote, mentioning both parties without notifications
-            allowed_mentions = discord.AllowedMentions(users=False)
-            await interaction.response.send_message(
-                f"{member.mention} has voted for {player.mention}.",
-                allowed_mentions=allowed_mentions,
+            # Send voting initiation message with role mentions to everyone
+            initial_message = await interaction.followup.send(
+                f"MVP voting has started! You have 5 minutes to vote using `/votemvp [username]`. {mentions}",
+                allowed_mentions=allowed_mentions_roles,
                 ephemeral=False
             )
 
-            # If there's no voting session currently active, initiate one
-            if not voting_in_progress:
-                # Get Player and Volunteer roles
-                player_role = discord.utils.get(interaction.guild.roles, name="Player")
-                volunteer_role = discord.utils.get(interaction.guild.roles, name="Volunteer")
-                if not player_role or not volunteer_role:
-                    await interaction.followup.send("Player or Volunteer roles are not configured properly.", ephemeral=True)
-                    return
-
-                # Mention Player and Volunteer roles
-                mentions = f"{player_role.mention} {volunteer_role.mention}"
-                
-                # Set allowed_mentions to explicitly mention roles
-                allowed_mentions_roles = discord.AllowedMentions(roles=True)
-
-                # Send voting initiation message with role mentions to everyone
-                initial_message = await interaction.followup.send(
-                    f"MVP voting has started! You have 5 minutes to vote using `/votemvp [username]`. {mentions}",
-                    allowed_mentions=allowed_mentions_roles,
-                    ephemeral=False
-                )
-
-                # Start the voting session loop
-                start_voting.start(initial_message)
+            # Start the voting session loop
+            start_voting.start(initial_message)
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -1662,27 +2560,28 @@ async def finish_voting(interaction):
     global voting_in_progress, mvp_updates_today, votes, has_voted
 
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            # Calculate MVP based on votes
-            if votes:
-                max_votes = max(votes.values())
-                mvp_candidates = [player for player, count in votes.items() if count == max_votes]
+        if votes:
+            max_votes = max(votes.values())
+            mvp_candidates = [player for player, count in votes.items() if count == max_votes]
                 
-                # Update MVPs in the database
+            # Update MVPs in the database
+            # MVPs are found by DiscordUsername, so usernames changed through the player cache need to be written first
+            await cached_players.flush()
+            async with db.writer() as conn:
                 for mvp in mvp_candidates:
                     await conn.execute("UPDATE PlayerStats SET MVPs = MVPs + 1 WHERE DiscordUsername = ?", (mvp,))
                 await conn.commit()
 
-                # Prepare MVP result message
-                if len(mvp_candidates) == 1:
-                    await interaction.channel.send(f"🎉 {mvp_candidates[0]} has been voted the MVP of this round! 🎉")
-                else:
-                    mvp_list = ", ".join(mvp_candidates)
-                    await interaction.channel.send(f"🎉 The MVP(s) with the highest votes are: {mvp_list}. 🎉")
-
-                mvp_updates_today += 1
+            # Prepare MVP result message
+            if len(mvp_candidates) == 1:
+                await interaction.channel.send(f"🎉 {mvp_candidates[0]} has been voted the MVP of this round! 🎉")
             else:
-                await interaction.channel.send("No votes were cast. No MVP this round.")
+                mvp_list = ", ".join(mvp_candidates)
+                await interaction.channel.send(f"🎉 The MVP(s) with the highest votes are: {mvp_list}. 🎉")
+
+            mvp_updates_today += 1
+        else:
+            await interaction.channel.send("No votes were cast. No MVP this round.")
 
     except Exception as e:
         print(f"An error occurred while finishing voting: {e}")
@@ -1736,7 +2635,8 @@ async def help_command(interaction: discord.Interaction):
         ),
         discord.Embed(
             title="Help Menu 📚",
-            description="**/win [match_number] [lobby_number] [team]** - Add a win for the specified players.",
+            description="**/win [match_number] [lobby_number] [team]** - Record the winning team of one lobby, using the lobby number shown on the teams "
+                        "posted by /matchmake. Use it again with the other team to correct the result.",
             color=0xffc629
         ),
         discord.Embed(
@@ -1761,7 +2661,24 @@ async def help_command(interaction: discord.Interaction):
         ),
         discord.Embed(
             title="Help Menu 📚",
-            description="**/matchmake [match_number]** - Form teams for all players enrolled in the game.",
+            description="**/matchmake [match_number] [lobby_number]** - Form teams for all players enrolled in the game. Every 10 players form "
+                        "another lobby, numbered starting from lobby_number. The buttons under the teams let you cycle through "
+                        "alternative lineups for a lobby and confirm one, and you may be offered a better lineup found after posting.",
+            color=0xffc629
+        ),
+        discord.Embed(
+            title="Help Menu 📚",
+            description="**/rebuildstats** - Recompute every player's match results from the recorded matches.",
+            color=0xffc629
+        ),
+        discord.Embed(
+            title="Help Menu 📚",
+            description="**/riotstatus** - Show whether the bot can currently reach the Riot API.",
+            color=0xffc629
+        ),
+        discord.Embed(
+            title="Help Menu 📚",
+            description="**/cachestatus** - Show the player cache's hit rate and pending writes.",
             color=0xffc629
         ),
         discord.Embed(
@@ -1807,12 +2724,18 @@ async def help_command(interaction: discord.Interaction):
 
 
         
-# Shutdown of aiohttp session
+# Shutdown of aiohttp session and the matchmaking process pool
 async def close_session():
-    global session
-    if session is not None:
-        await session.close()
+    if riot_client.session is not None:
+        await riot_client.close()
         print("HTTP session has been closed.")
+    if matchmaking_pool.executor is not None:
+        matchmaking_pool.close()
+        print("Matchmaking process pool has been shut down.")
+    if db.writer_connection is not None:
+        written = await cached_players.flush()
+        print(f"Player cache written to the database ({written} players changed).")
+    await db.close()
 
 # Entry point to run async setup before bot starts
 if __name__ == '__main__':
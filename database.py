@@ -0,0 +1,107 @@
+"""
+Shared SQLite connections for the bot.
+
+Opening an aiosqlite connection starts a dedicated thread and opens the database file, which the bot used to do for almost every
+command and button click. Database opens its connections once at startup instead:
+- one writer connection for everything that changes the database. SQLite only allows one writer at a time anyway, so the writer
+  is lent out to one borrower at a time, which also keeps one command's uncommitted changes out of another command's commit.
+- a small pool of reader connections for queries. With WAL journaling, readers see the last committed data and neither block
+  nor are blocked by the writer.
+
+Every connection uses synchronous=NORMAL (with WAL, a power loss can lose the last few commits but can't corrupt the database),
+keeps temporary tables and indexes in memory, waits for locks instead of failing straight away, and caches up to
+STATEMENT_CACHE_SIZE prepared statements, so the queries the bot runs over and over are only compiled once per connection.
+
+Connections are borrowed with:
+
+    async with db.reader() as conn:
+        async with conn.execute("SELECT ...") as cursor:
+            ...
+
+    async with db.writer() as conn:
+        await conn.execute("UPDATE ...")
+        await conn.commit()
+
+A borrowed connection must not be used after its block ends. Every other write waits while the writer is borrowed, so it
+shouldn't be held while waiting on anything slow (such as the Riot API), and it can't be borrowed again by code that already
+has it. Anything left uncommitted when the writer is given back is rolled back.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept by each connection (sqlite3's default is 128)
+BUSY_TIMEOUT_MS = 5000  # How long a connection waits for a lock held by another process before giving up
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+)
+
+
+class Database:
+    def __init__(self, path, readers=4):
+        self.path = path
+        self.reader_count = max(readers, 1)
+        self.writer_connection = None
+        self.write_lock = asyncio.Lock()
+        self.readers = None  # asyncio.Queue of idle reader connections
+        self.reader_connections = []
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in CONNECTION_PRAGMAS:
+            # Closing the cursor finishes the statement, which otherwise keeps the database locked
+            async with conn.execute(pragma):
+                pass
+        return conn
+
+    async def open(self):
+        # Opens the connections (only once, so it's safe to call again)
+        if self.writer_connection is not None:
+            return
+        self.writer_connection = await self._connect()
+        self.readers = asyncio.Queue()
+        try:
+            # The journal mode is stored in the database file, so setting it once applies to every connection
+            async with self.writer_connection.execute("PRAGMA journal_mode = WAL"):
+                pass
+            for _ in range(self.reader_count):
+                conn = await self._connect()
+                self.reader_connections.append(conn)
+                self.readers.put_nowait(conn)
+        except Exception:
+            await self.close()
+            raise
+
+    async def close(self):
+        if self.writer_connection is None:
+            return
+        async with self.write_lock:
+            for conn in self.reader_connections + [self.writer_connection]:
+                await conn.close()
+            self.writer_connection, self.readers, self.reader_connections = None, None, []
+
+    @asynccontextmanager
+    async def writer(self):
+        async with self.write_lock:
+            conn = self.writer_connection
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    await conn.rollback()
+
+    @asynccontextmanager
+    async def reader(self):
+        readers = self.readers
+        conn = await readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                await conn.rollback()
+            readers.put_nowait(conn)
@@ -0,0 +1,250 @@
+"""
+Local stand-in for the Riot API, for exercising the bot's Riot code paths (/link, /stats, rank refreshes, the rate limiter and
+the request caches in riot_api.py) without an API key or a network connection.
+
+It serves the three endpoints the bot uses from a fixture dataset of players:
+- account-v1 accounts/by-riot-id/{gameName}/{tagLine}
+- summoner-v4 summoners/by-puuid/{puuid}
+- league-v4 entries/by-summoner/{summonerId}
+
+Like Riot, it counts requests against application and method rate limits for each host (as seen in the Host header, so pointing
+both of the bot's base URLs at the same address gives them one shared application limit), reports those limits and counts in
+the X-App-Rate-Limit(-Count) and X-Method-Rate-Limit(-Count) headers, and answers 429 with Retry-After once a limit is used up.
+On top of that it can add latency to every response and inject random 429 (as Riot's underlying services sometimes send) and
+5xx responses. Every request is counted by endpoint and status; the totals are served at /_stats and printed on shutdown.
+
+The fixture dataset is either a JSON file (--fixtures) or generated from a seed (--players), with the same rank distribution as
+benchmark.py (see rank_distribution.py). Generated players are named Player1#NA1, Player2#NA1 and so on; --dump-fixtures writes
+the dataset out. Example:
+
+    python fake_riot_server.py --players 200 --latency 80 --jitter 40 --error-rate-5xx 0.02
+
+and in the bot's .env:
+
+    RIOT_REGIONAL_URL=http://127.0.0.1:8080
+    RIOT_PLATFORM_URL=http://127.0.0.1:8080
+"""
+import argparse
+import asyncio
+from collections import Counter
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+from rank_distribution import random_ranks
+import riot_api
+
+
+DIVISIONS = ["I", "II", "III", "IV"]
+APEX_TIERS = {"MASTER", "GRANDMASTER", "CHALLENGER"}  # Tiers without divisions
+
+# Method limits of a development key (requests:seconds), per host
+DEFAULT_METHOD_RATE_LIMITS = {
+    riot_api.ACCOUNT_BY_RIOT_ID: "1000:60",
+    riot_api.SUMMONER_BY_PUUID: "1600:60",
+    riot_api.LEAGUE_ENTRIES_BY_SUMMONER: "100:60",
+}
+
+
+def synthetic_players(count, rng):
+    # Builds `count` fixture players with random ranks, named Player1#NA1, Player2#NA1, ...
+    ranks = random_ranks(count, rng)
+    players = []
+    for i, tier in enumerate(ranks):
+        players.append({
+            "gameName": f"Player{i + 1}",
+            "tagLine": "NA1",
+            "puuid": str(uuid.UUID(int=rng.getrandbits(128))),
+            "summonerId": f"summoner-{rng.getrandbits(64):016x}",
+            "tier": tier,
+            "rank": "I" if tier in APEX_TIERS else rng.choice(DIVISIONS),
+            "leaguePoints": rng.randint(0, 99),
+            "wins": rng.randint(0, 200),
+            "losses": rng.randint(0, 200),
+        })
+    return players
+
+
+class FixedWindowLimit:
+    """
+    One rate limit (all its windows) for one host, counted the way Riot counts: each window starts with the first request after
+    the previous one ended, and requests over the limit are rejected without being counted.
+    """
+    def __init__(self, header):
+        self.header = header
+        self.windows = [[limit, seconds, 0.0, 0] for limit, seconds in riot_api.parse_rate_limits(header)]  # limit, seconds, start, count
+
+    def retry_after(self, now):
+        # Seconds until a request would be allowed (0 if it is allowed now)
+        wait = 0.0
+        for window in self.windows:
+            limit, seconds, start, count = window
+            if now >= start + seconds:
+                window[2], window[3] = now, 0
+            elif count >= limit:
+                wait = max(wait, start + seconds - now)
+        return wait
+
+    def count(self):
+        for window in self.windows:
+            window[3] += 1
+
+    def counts_header(self):
+        return ",".join(f"{count}:{seconds:g}" for _, seconds, _, count in self.windows)
+
+
+class FakeRiotServer:
+    def __init__(self, players, app_rate_limit, method_rate_limits, latency, jitter, error_rate_429, error_rate_5xx, seed):
+        self.accounts = {(player["gameName"].lower(), player["tagLine"].lower()): player for player in players}
+        self.by_puuid = {player["puuid"]: player for player in players}
+        self.by_summoner_id = {player["summonerId"]: player for player in players}
+        self.app_rate_limit = app_rate_limit
+        self.method_rate_limits = method_rate_limits
+        self.latency = latency  # Seconds
+        self.jitter = jitter  # Seconds, added on top of latency uniformly at random
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.rng = random.Random(seed)
+        self.limits = {}  # (host, method or None for the application limit) -> FixedWindowLimit
+        self.stats = Counter()  # (method, status) -> responses
+
+    def _limit(self, host, method):
+        if (host, method) not in self.limits:
+            header = self.app_rate_limit if method is None else self.method_rate_limits.get(method, "")
+            self.limits[(host, method)] = FixedWindowLimit(header)
+        return self.limits[(host, method)]
+
+    async def respond(self, request, method, lookup):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+        response = self._response(request, method, lookup)
+        self.stats[(method, response.status)] += 1
+        return response
+
+    def _response(self, request, method, lookup):
+        if not request.headers.get("X-Riot-Token"):
+            return web.json_response({"status": {"message": "Unauthorized", "status_code": 401}}, status=401)
+
+        now = time.monotonic()
+        app_limit = self._limit(request.host, None)
+        method_limit = self._limit(request.host, method)
+        headers = {"X-App-Rate-Limit": app_limit.header, "X-Method-Rate-Limit": method_limit.header}
+
+        limit_type = None
+        retry_after = app_limit.retry_after(now)
+        if retry_after:
+            limit_type = "application"
+        else:
+            retry_after = method_limit.retry_after(now)
+            if retry_after:
+                limit_type = "method"
+        if limit_type is None:
+            app_limit.count()
+            method_limit.count()
+        headers["X-App-Rate-Limit-Count"] = app_limit.counts_header()
+        headers["X-Method-Rate-Limit-Count"] = method_limit.counts_header()
+
+        if limit_type is not None:
+            headers.update({"Retry-After": str(max(1, round(retry_after))), "X-Rate-Limit-Type": limit_type})
+            return web.json_response({"status": {"message": "Rate limit exceeded", "status_code": 429}}, status=429, headers=headers)
+        if self.rng.random() < self.error_rate_429:
+            # Riot's services can also answer 429 on their own, without a limit type or Retry-After
+            return web.json_response({"status": {"message": "Rate limit exceeded", "status_code": 429}}, status=429, headers=headers)
+        if self.rng.random() < self.error_rate_5xx:
+            status = self.rng.choice([500, 502, 503, 504])
+            return web.json_response({"status": {"message": "Injected server error", "status_code": status}}, status=status, headers=headers)
+
+        data = lookup()
+        if data is None:
+            return web.json_response({"status": {"message": "Data not found", "status_code": 404}}, status=404, headers=headers)
+        return web.json_response(data, headers=headers)
+
+    async def account_by_riot_id(self, request):
+        player = self.accounts.get((request.match_info["game_name"].lower(), request.match_info["tag_line"].lower()))
+        return await self.respond(request, riot_api.ACCOUNT_BY_RIOT_ID, lambda: player and {
+            "puuid": player["puuid"], "gameName": player["gameName"], "tagLine": player["tagLine"]
+        })
+
+    async def summoner_by_puuid(self, request):
+        player = self.by_puuid.get(request.match_info["puuid"])
+        return await self.respond(request, riot_api.SUMMONER_BY_PUUID, lambda: player and {
+            "id": player["summonerId"], "puuid": player["puuid"], "profileIconId": 29, "summonerLevel": 100,
+            "revisionDate": int(time.time() * 1000)
+        })
+
+    async def league_entries(self, request):
+        player = self.by_summoner_id.get(request.match_info["summoner_id"])
+
+        def entries():
+            if player is None:
+                return None
+            if player["tier"] == "UNRANKED":
+                return []
+            return [{
+                "queueType": "RANKED_SOLO_5x5", "summonerId": player["summonerId"], "tier": player["tier"], "rank": player["rank"],
+                "leaguePoints": player["leaguePoints"], "wins": player["wins"], "losses": player["losses"]
+            }]
+        return await self.respond(request, riot_api.LEAGUE_ENTRIES_BY_SUMMONER, entries)
+
+    async def show_stats(self, request):
+        return web.json_response({f"{method} {status}": count for (method, status), count in sorted(self.stats.items())})
+
+    async def print_stats(self, app):
+        print("Responses served:")
+        for (method, status), count in sorted(self.stats.items()):
+            print(f"  {method} {status}: {count}")
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/riot/account/v1/accounts/by-riot-id/{game_name}/{tag_line}", self.account_by_riot_id)
+        app.router.add_get("/lol/summoner/v4/summoners/by-puuid/{puuid}", self.summoner_by_puuid)
+        app.router.add_get("/lol/league/v4/entries/by-summoner/{summoner_id}", self.league_entries)
+        app.router.add_get("/_stats", self.show_stats)
+        app.on_cleanup.append(self.print_stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Riot API endpoints the bot uses.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--fixtures", help="JSON file with the list of players to serve (instead of generating them)")
+    parser.add_argument("--players", type=int, default=200, help="number of players to generate")
+    parser.add_argument("--seed", type=int, default=2024, help="seed for generated players, latency and injected errors")
+    parser.add_argument("--dump-fixtures", help="write the players being served to this JSON file")
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra milliseconds, at random")
+    parser.add_argument("--app-rate-limit", default=riot_api.DEFAULT_APP_RATE_LIMIT, help="application limit per host, as requests:seconds pairs")
+    parser.add_argument("--method-rate-limit", help="limit for every method, replacing the development key's method limits")
+    parser.add_argument("--error-rate-429", type=float, default=0.0, help="share of requests answered with a service 429")
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0, help="share of requests answered with a 5xx error")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        with open(args.fixtures) as file:
+            players = json.load(file)
+    else:
+        players = synthetic_players(args.players, random.Random(args.seed))
+    if args.dump_fixtures:
+        with open(args.dump_fixtures, "w") as file:
+            json.dump(players, file, indent=2)
+        print(f"Fixtures written to {args.dump_fixtures}")
+
+    if args.method_rate_limit is not None:
+        method_rate_limits = {method: args.method_rate_limit for method in DEFAULT_METHOD_RATE_LIMITS}
+    else:
+        method_rate_limits = DEFAULT_METHOD_RATE_LIMITS
+
+    server = FakeRiotServer(
+        players, args.app_rate_limit, method_rate_limits, args.latency / 1000, args.jitter / 1000,
+        args.error_rate_429, args.error_rate_5xx, args.seed
+    )
+    print(f"Serving {len(players)} players")
+    web.run_app(server.app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
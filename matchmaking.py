@@ -0,0 +1,472 @@
+"""
+Matchmaking engine used by /matchmake.
+
+Instead of looping over every ordered 5-player permutation of a lobby (30,240 of them) and building Team objects for each one,
+this module packs a lobby's tiers and role priorities into NumPy arrays and scores every team split, together with its best
+possible role assignment, with a handful of array operations. The objective is the same one the bot has always used for balancing teams:
+
+    score = (sum over roles of the squared tier difference between the two laners) * TIER_WEIGHT
+          + (sum of every player's squared priority for the role they were given) * ROLE_PREFERENCE_WEIGHT
+
+Lower scores are better. Optionally, a repeat-pairing penalty is added for every two players in a lobby, so players who were
+recently teammates or opponents are less likely to be put together again. It is given as a "pairing" array of shape (2, n, n)
+for the n players being matched: pairing[0][i][j] is added when players i and j are teammates and pairing[1][i][j] when they
+are opponents (both symmetric, with zeros on the diagonal). Since it doesn't depend on roles, it costs a few array lookups.
+
+For events with more than one lobby, partition_players() also decides which players share a lobby,
+adding a penalty for the spread of tiers inside each lobby so that lobbies stay close in skill.
+
+Nothing in this module depends on discord.py or the database, so it can be imported on its own.
+"""
+import heapq
+import itertools
+import math
+import random
+import time
+
+import numpy as np
+
+
+ROLES = ("top", "jungle", "mid", "bot", "support")
+LOBBY_SIZE = 10
+TEAM_SIZE = 5
+
+# Every way of splitting a lobby's 10 players into two teams of 5. Red and blue are interchangeable as far as the objective is
+# concerned, so only the 126 splits that put player 0 on the red team are scored; the sides are flipped at random afterwards.
+SPLITS = np.array([split for split in itertools.combinations(range(LOBBY_SIZE), TEAM_SIZE) if 0 in split], dtype=np.intp)
+COMPLEMENTS = np.array([[i for i in range(LOBBY_SIZE) if i not in split] for split in SPLITS], dtype=np.intp)
+
+# Every order in which 5 players can be placed into the 5 roles (5! = 120). Entry [p, r] is the team member playing role r.
+ROLE_ORDERS = np.array(list(itertools.permutations(range(TEAM_SIZE))), dtype=np.intp)
+
+_ROLE_COLUMNS = np.arange(TEAM_SIZE)
+
+
+# Parse TIER_GROUPS from the .env file: groups are separated by colons and ranks within a group by commas. Tiers start at 1.
+def parse_tier_groups(tier_groups_string):
+    tier_mapping = {}
+    groups = tier_groups_string.split(':')
+    for tier_index, group in enumerate(groups, start=1):
+        ranks = group.split(',')
+        for rank in ranks:
+            tier_mapping[rank.strip().upper()] = tier_index
+    return tier_mapping
+
+
+# Layout of one roster entry: the player's tier followed by their priority (1-5) for each role, in ROLES order
+PLAYER_DTYPE = np.dtype([("tier", np.float64), ("priorities", np.float64, (TEAM_SIZE,))])
+
+
+def parse_role_preference(role_preference):
+    """
+    Converts a RolePreference value from the database (a 5-digit string such as '12345', one digit per role in ROLES order)
+    into a tuple of 5 ints. Missing or malformed values are treated as no preference ('55555').
+    """
+    role_preference = str(role_preference or "")
+    if len(role_preference) != TEAM_SIZE or not role_preference.isdigit():
+        role_preference = "5" * TEAM_SIZE
+    return tuple(int(digit) for digit in role_preference)
+
+
+class Roster:
+    """
+    Compact storage for the players being matched. Tiers and role priorities live in a single structured NumPy array (one
+    row per player) and every matchmaking function works with indices into it. Discord IDs and display names are kept in
+    plain lists alongside it, since the engine itself never needs them.
+    """
+    __slots__ = ("discord_ids", "usernames", "data")
+
+    def __init__(self, discord_ids, usernames, tiers, priorities):
+        self.discord_ids = list(discord_ids)
+        self.usernames = list(usernames)
+        self.data = np.zeros(len(self.discord_ids), dtype=PLAYER_DTYPE)
+        self.data["tier"] = np.asarray(tiers, dtype=np.float64)
+        self.data["priorities"] = np.asarray(priorities, dtype=np.float64).reshape(len(self.data), TEAM_SIZE)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def tiers(self):
+        # Float array of shape (n,)
+        return self.data["tier"]
+
+    @property
+    def priorities(self):
+        # Float array of shape (n, 5), one column per role in ROLES order
+        return self.data["priorities"]
+
+
+def _lineup_costs(tiers, priorities, red_teams, blue_teams, tier_weight, role_preference_weight, pairing=None):
+    """
+    Computes the objective for every role order of the red team against every role order of the blue team.
+    red_teams and blue_teams are (k, 5) arrays of player indices; the result has shape (k, 120, 120), where entry [s, i, j]
+    is the score of split s with the red team placed in ROLE_ORDERS[i] and the blue team placed in ROLE_ORDERS[j].
+    pairing, if given, holds repeat-pairing costs indexed like tiers (see the module docstring).
+    """
+    tiers = np.asarray(tiers, dtype=np.float64)
+    squared_priorities = np.asarray(priorities, dtype=np.float64) ** 2
+
+    red_lineups = red_teams[:, ROLE_ORDERS]  # (k, 120, 5)
+    blue_lineups = blue_teams[:, ROLE_ORDERS]
+    red_tiers = tiers[red_lineups]
+    blue_tiers = tiers[blue_lineups]
+
+    # Tier balance: sum over roles of (red tier - blue tier)^2. Expanding the square, the sums of squared tiers don't depend on
+    # the role order, which leaves one batched matrix product for the cross term.
+    costs = red_tiers @ blue_tiers.transpose(0, 2, 1)
+    costs *= -2 * tier_weight
+    costs += (tier_weight * ((tiers[red_teams] ** 2).sum(axis=1) + (tiers[blue_teams] ** 2).sum(axis=1)))[:, None, None]
+
+    # Role preference: squared priority each player has for the role they are placed in
+    costs += (role_preference_weight * squared_priorities[red_lineups, _ROLE_COLUMNS].sum(axis=2))[:, :, None]
+    costs += (role_preference_weight * squared_priorities[blue_lineups, _ROLE_COLUMNS].sum(axis=2))[:, None, :]
+
+    # Repeat pairings don't depend on the role order either, so they add one value per split
+    if pairing is not None:
+        teammates, opponents = np.asarray(pairing, dtype=np.float64)
+        repeats = teammates[red_teams[:, :, None], red_teams[:, None, :]].sum(axis=(1, 2))
+        repeats += teammates[blue_teams[:, :, None], blue_teams[:, None, :]].sum(axis=(1, 2))
+        repeats /= 2  # Every teammate pair was counted twice
+        repeats += opponents[red_teams[:, :, None], blue_teams[:, None, :]].sum(axis=(1, 2))
+        costs += repeats[:, None, None]
+    return costs
+
+
+def assign_roles(tiers, priorities, red_team, blue_team, tier_weight, role_preference_weight, rng=random, pairing=None):
+    """
+    Finds the cost-minimal assignment of players to roles for two given teams of 5.
+    Because the tier part of the objective compares the two players in each role, the best roles for one team depend on the
+    other team's roles, so both teams are solved together using the 120-entry ROLE_ORDERS table (120 x 120 candidates).
+    Args:
+    - tiers, priorities: arrays as stored in a Roster.
+    - red_team, blue_team: sequences of 5 indices into those arrays.
+    Returns:
+    - (red, blue, score), where red and blue are the same indices reordered into role order (top, jungle, mid, bot, support).
+    """
+    red_team = np.asarray(red_team, dtype=np.intp).reshape(1, TEAM_SIZE)
+    blue_team = np.asarray(blue_team, dtype=np.intp).reshape(1, TEAM_SIZE)
+    costs = _lineup_costs(tiers, priorities, red_team, blue_team, tier_weight, role_preference_weight, pairing)[0]
+
+    ties = np.flatnonzero(np.isclose(costs, costs.min()))
+    red_order, blue_order = np.unravel_index(int(rng.choice(ties)), costs.shape)
+    red = tuple(red_team[0, ROLE_ORDERS[red_order]].tolist())
+    blue = tuple(blue_team[0, ROLE_ORDERS[blue_order]].tolist())
+    return red, blue, float(costs[red_order, blue_order])
+
+
+def best_split(tiers, priorities, tier_weight, role_preference_weight, rng=random, pairing=None):
+    """
+    Finds the optimal lineup for a 10-player lobby: every team split is scored with its best possible role assignment.
+    Args:
+    - tiers, priorities: arrays for exactly 10 players, as stored in a Roster.
+    - tier_weight / role_preference_weight: TIER_WEIGHT and ROLE_PREFERENCE_WEIGHT from .env.
+    - rng: source of randomness used to break ties between equally good lineups.
+    - pairing: optional (2, 10, 10) repeat-pairing costs for the 10 players.
+    Returns:
+    - (red, blue, score), where red and blue are tuples of 5 lobby indices in role order (top, jungle, mid, bot, support).
+    """
+    costs = _lineup_costs(tiers, priorities, SPLITS, COMPLEMENTS, tier_weight, role_preference_weight, pairing)
+
+    # Pick randomly among all of the lowest-scoring lineups so re-running /matchmake with the same players can give different teams
+    ties = np.flatnonzero(np.isclose(costs, costs.min()))
+    split, red_order, blue_order = np.unravel_index(int(rng.choice(ties)), costs.shape)
+
+    red = tuple(SPLITS[split, ROLE_ORDERS[red_order]].tolist())
+    blue = tuple(COMPLEMENTS[split, ROLE_ORDERS[blue_order]].tolist())
+    if rng.random() < 0.5:
+        red, blue = blue, red
+    return red, blue, float(costs[split, red_order, blue_order])
+
+
+def lineup_components(tiers, priorities, red, blue):
+    """
+    Breaks a lineup's score down into its parts, for reporting.
+    Returns:
+    - (tier_diff, role_priority, worst_gap): the sum of squared tier differences between lane opponents, the sum of squared
+      role priorities across both teams, and the largest tier gap between any two lane opponents.
+    """
+    tiers = np.asarray(tiers, dtype=np.float64)
+    squared_priorities = np.asarray(priorities, dtype=np.float64) ** 2
+    red, blue = list(red), list(blue)
+    gaps = np.abs(tiers[red] - tiers[blue])
+    role_priority = squared_priorities[red, _ROLE_COLUMNS].sum() + squared_priorities[blue, _ROLE_COLUMNS].sum()
+    return float((gaps ** 2).sum()), float(role_priority), float(gaps.max())
+
+
+def repeat_pairing_cost(pairing, red, blue):
+    # Repeat-pairing part of a lineup's score (0 without pairing costs)
+    if pairing is None:
+        return 0.0
+    teammates, opponents = np.asarray(pairing, dtype=np.float64)
+    red, blue = list(red), list(blue)
+    return float(
+        (teammates[np.ix_(red, red)].sum() + teammates[np.ix_(blue, blue)].sum()) / 2 + opponents[np.ix_(red, blue)].sum()
+    )
+
+
+def lineup_score(tiers, priorities, red, blue, tier_weight, role_preference_weight, pairing=None):
+    # Objective value of a single lineup (red and blue given in role order), e.g. for lobbies that weren't just solved
+    tier_diff, role_priority, _ = lineup_components(tiers, priorities, red, blue)
+    return tier_diff * tier_weight + role_priority * role_preference_weight + repeat_pairing_cost(pairing, red, blue)
+
+
+def lobby_spread(lobby_tiers):
+    # Sum of squared deviations from the lobby's mean tier; 0 when all 10 players share a tier
+    lobby_tiers = np.asarray(lobby_tiers, dtype=np.float64)
+    return float(((lobby_tiers - lobby_tiers.mean()) ** 2).sum())
+
+
+def _slot_objective(slots, tiers, squared_priorities, tier_weight, role_preference_weight, pairing=None):
+    # Full objective of a slot layout (see partition_players), used to seed the incremental scoring in _anneal()
+    total = 0.0
+    for base in range(0, len(slots), LOBBY_SIZE):
+        lobby = slots[base:base + LOBBY_SIZE]
+        for role in range(TEAM_SIZE):
+            red, blue = lobby[role], lobby[role + TEAM_SIZE]
+            total += tier_weight * (tiers[red] - tiers[blue]) ** 2
+            total += role_preference_weight * (squared_priorities[red][role] + squared_priorities[blue][role])
+        total += tier_weight * lobby_spread([tiers[player] for player in lobby])
+        if pairing is not None:
+            total += repeat_pairing_cost(pairing, lobby[:TEAM_SIZE], lobby[TEAM_SIZE:])
+    return total
+
+
+def _anneal(slots, tiers, squared_priorities, tier_weight, role_preference_weight, time_budget, rng, pairing=None):
+    """
+    Simulated annealing over a slot layout: slot k holds the player in lobby k // 10, on the red team if k % 10 < 5 (blue
+    otherwise), playing role k % 5. A move swaps the players in two slots, which can move players between lobbies, between
+    teams, or between roles. Each move is scored incrementally from the few terms it touches instead of rescoring the layout.
+    pairing, if given, is the repeat-pairing costs as nested lists (teammates, opponents) for fast lookups.
+    Returns the best layout seen, its objective value, and the number of moves that were evaluated.
+    """
+    slots = list(slots)
+    num_slots = len(slots)
+    lobby_sums = [sum(tiers[player] for player in slots[base:base + LOBBY_SIZE]) for base in range(0, num_slots, LOBBY_SIZE)]
+    spread_scale = tier_weight / LOBBY_SIZE
+    teammates, opponents = pairing if pairing is not None else (None, None)
+
+    def repeats(slot, player, skip):
+        # Repeat-pairing cost of player sitting in slot, against everyone else in that lobby except the slot it is swapped with
+        base = slot - slot % LOBBY_SIZE
+        on_red = slot - base < TEAM_SIZE
+        teammate_costs, opponent_costs = teammates[player], opponents[player]
+        total = 0.0
+        for other in range(base, base + LOBBY_SIZE):
+            if other != slot and other != skip:
+                total += (teammate_costs if (other - base < TEAM_SIZE) == on_red else opponent_costs)[slots[other]]
+        return total
+
+    def swap_delta(a, b):
+        player_a, player_b = slots[a], slots[b]
+        tier_a, tier_b = tiers[player_a], tiers[player_b]
+        role_a, role_b = a % TEAM_SIZE, b % TEAM_SIZE
+
+        # Role preference of the two swapped players
+        delta = role_preference_weight * (
+            squared_priorities[player_b][role_a] + squared_priorities[player_a][role_b]
+            - squared_priorities[player_a][role_a] - squared_priorities[player_b][role_b]
+        )
+
+        # Tier difference against each slot's lane opponent (unchanged if the two players are lane opponents of each other)
+        opponent_a = a + TEAM_SIZE if a % LOBBY_SIZE < TEAM_SIZE else a - TEAM_SIZE
+        if opponent_a != b:
+            opponent_b = b + TEAM_SIZE if b % LOBBY_SIZE < TEAM_SIZE else b - TEAM_SIZE
+            versus_a, versus_b = tiers[slots[opponent_a]], tiers[slots[opponent_b]]
+            delta += tier_weight * (
+                (tier_b - versus_a) ** 2 - (tier_a - versus_a) ** 2 + (tier_a - versus_b) ** 2 - (tier_b - versus_b) ** 2
+            )
+
+        # Lobby spread. Summed over all lobbies, the squared tiers never change, so only the lobbies' tier sums matter.
+        lobby_a, lobby_b = a // LOBBY_SIZE, b // LOBBY_SIZE
+        if lobby_a != lobby_b:
+            shift = tier_b - tier_a
+            sum_a, sum_b = lobby_sums[lobby_a], lobby_sums[lobby_b]
+            delta -= spread_scale * ((sum_a + shift) ** 2 + (sum_b - shift) ** 2 - sum_a ** 2 - sum_b ** 2)
+
+        # Repeat pairings, which only change when a player moves to another team or lobby. The pair of swapped players keeps
+        # the same relationship, so it is left out.
+        if teammates is not None and (lobby_a != lobby_b or (a % LOBBY_SIZE < TEAM_SIZE) != (b % LOBBY_SIZE < TEAM_SIZE)):
+            delta += (
+                repeats(a, player_b, b) + repeats(b, player_a, a) - repeats(a, player_a, b) - repeats(b, player_b, a)
+            )
+        return delta
+
+    # Starting temperature is based on the typical cost of a worsening move, cooling geometrically to a thousandth of it
+    samples = [swap_delta(rng.randrange(num_slots), rng.randrange(num_slots)) for _ in range(500)]
+    worsening = [delta for delta in samples if delta > 0]
+    start_temperature = sum(worsening) / len(worsening) if worsening else 1.0
+    end_temperature = start_temperature * 1e-3
+
+    current = best = _slot_objective(slots, tiers, squared_priorities, tier_weight, role_preference_weight, pairing)
+    best_slots = list(slots)
+    temperature = start_temperature
+    start = time.perf_counter()
+    iteration = 0
+
+    while True:
+        if iteration % 256 == 0:
+            progress = (time.perf_counter() - start) / time_budget
+            if progress >= 1:
+                break
+            temperature = start_temperature * (end_temperature / start_temperature) ** progress
+        iteration += 1
+
+        a, b = rng.randrange(num_slots), rng.randrange(num_slots)
+        if a == b:
+            continue
+        delta = swap_delta(a, b)
+        if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+            lobby_a, lobby_b = a // LOBBY_SIZE, b // LOBBY_SIZE
+            if lobby_a != lobby_b:
+                shift = tiers[slots[b]] - tiers[slots[a]]
+                lobby_sums[lobby_a] += shift
+                lobby_sums[lobby_b] -= shift
+            slots[a], slots[b] = slots[b], slots[a]
+            current += delta
+            if current < best - 1e-9:
+                best = current
+                best_slots = list(slots)
+
+    return best_slots, best, iteration
+
+
+# The functions below make up partition_players(). Each stage is a plain module-level function taking and returning arrays,
+# lists and numbers, so the bot can also run the stages as separate jobs in a process pool (solving lobbies in parallel) without
+# blocking Discord's event loop. Jobs take an integer seed rather than a random.Random instance for the same reason.
+
+def tier_sorted_groups(tiers, rng=random):
+    # Starting lobbies: players sorted by tier (in random order within a tier) and cut into consecutive groups of 10
+    tiers = np.asarray(tiers, dtype=np.float64)
+    num_players = len(tiers)
+    if num_players == 0 or num_players % LOBBY_SIZE != 0:
+        raise ValueError(f"The number of players must be a multiple of {LOBBY_SIZE} (got {num_players}).")
+
+    order = sorted(range(num_players), key=lambda player: (tiers[player], rng.random()))
+    return [order[base:base + LOBBY_SIZE] for base in range(0, num_players, LOBBY_SIZE)]
+
+
+def _lobby_pairing(pairing, members):
+    # Repeat-pairing costs between a lobby's members only, for functions that work on a single lobby
+    return None if pairing is None else np.asarray(pairing, dtype=np.float64)[:, members[:, None], members[None, :]]
+
+
+def solve_lobby(tiers, priorities, members, tier_weight, role_preference_weight, seed=None, pairing=None):
+    """
+    Runs best_split() on 10 players picked out of a larger roster.
+    Returns:
+    - (red, blue, score), with red and blue given as indices into the full roster rather than into members.
+    """
+    members = np.asarray(members, dtype=np.intp)
+    tiers = np.asarray(tiers, dtype=np.float64)
+    priorities = np.asarray(priorities, dtype=np.float64)
+    red, blue, score = best_split(
+        tiers[members], priorities[members], tier_weight, role_preference_weight, random.Random(seed), _lobby_pairing(pairing, members)
+    )
+    return tuple(members[list(red)].tolist()), tuple(members[list(blue)].tolist()), score
+
+
+def lobby_alternatives(tiers, priorities, lineup, tier_weight, role_preference_weight, k, seed=None, pairing=None):
+    """
+    Lists up to k distinct lineups for one solved lobby, so an admin can switch to another one (for example, when two friends
+    refuse to play against each other) without running the search again. Lineups count as distinct when they split the lobby
+    into different teams; each split is given its best role assignment.
+    Args:
+    - lineup: the lobby's current (red, blue, score), with indices into the full roster as solve_lobby() returns them.
+    - k: the most lineups to return, counting the current one.
+    Returns:
+    - a list of (red, blue, score) tuples: lineup itself first, then the next best splits from the lowest score up.
+    """
+    rng = random.Random(seed)
+    red, blue, score = lineup
+    members = np.asarray(red + blue, dtype=np.intp)
+    costs = _lineup_costs(
+        np.asarray(tiers, dtype=np.float64)[members], np.asarray(priorities, dtype=np.float64)[members],
+        SPLITS, COMPLEMENTS, tier_weight, role_preference_weight, _lobby_pairing(pairing, members)
+    ).reshape(len(SPLITS), -1)
+    role_orders = costs.argmin(axis=1)
+    split_costs = costs[np.arange(len(SPLITS)), role_orders]
+
+    # SPLITS[0] is the current split (members 0-4, i.e. the current red team), so the alternatives come from the other 125
+    alternatives = [lineup]
+    for split in heapq.nsmallest(k - 1, range(1, len(SPLITS)), key=split_costs.__getitem__):
+        red_order, blue_order = divmod(int(role_orders[split]), len(ROLE_ORDERS))
+        red = tuple(members[SPLITS[split, ROLE_ORDERS[red_order]]].tolist())
+        blue = tuple(members[COMPLEMENTS[split, ROLE_ORDERS[blue_order]]].tolist())
+        if rng.random() < 0.5:
+            red, blue = blue, red
+        alternatives.append((red, blue, float(split_costs[split])))
+    return alternatives
+
+
+def improve_layout(lineups, tiers, priorities, tier_weight, role_preference_weight, time_budget, seed=None, pairing=None):
+    """
+    Anneals a set of solved lobbies (see _anneal()) for up to time_budget seconds. Since the annealing always keeps track of
+    the best layout it has seen, it can be given whatever time is left before a deadline and still return a useful result.
+    Returns:
+    - (groups, stats): groups holds the members of each lobby afterwards, as lists of 10 roster indices (lobbies still need
+      solving with solve_lobby() unless their members are unchanged). stats describes how much searching was done:
+      "moves_evaluated" (swaps scored), "neighborhood_size" (distinct swaps possible from one layout) and "seconds".
+    """
+    slots = [player for red, blue, score in lineups for player in red + blue]
+    stats = {"moves_evaluated": 0, "neighborhood_size": len(slots) * (len(slots) - 1) // 2, "seconds": 0.0}
+    if len(lineups) > 1 and time_budget > 0:
+        priorities = np.asarray(priorities, dtype=np.float64)
+        start = time.perf_counter()
+        if pairing is not None:
+            pairing = np.asarray(pairing, dtype=np.float64).tolist()
+        slots, _, stats["moves_evaluated"] = _anneal(
+            slots, np.asarray(tiers, dtype=np.float64).tolist(), (priorities ** 2).tolist(),
+            tier_weight, role_preference_weight, time_budget, random.Random(seed), pairing
+        )
+        stats["seconds"] = time.perf_counter() - start
+    return [slots[base:base + LOBBY_SIZE] for base in range(0, len(slots), LOBBY_SIZE)], stats
+
+
+def reused_lineups(lineups, groups):
+    # Matches each annealed group of players back to an already-solved lineup with the same members (None if there isn't one)
+    solved = {frozenset(red + blue): (red, blue, score) for red, blue, score in lineups}
+    return [solved.get(frozenset(members)) for members in groups]
+
+
+def finish_partition(lineups, tiers, tier_weight):
+    """
+    Orders solved lobbies from the lowest to the highest average tier and totals up the objective.
+    Returns:
+    - (lobbies, objective), as documented in partition_players().
+    """
+    tiers = np.asarray(tiers, dtype=np.float64)
+    objective = sum(score + tier_weight * lobby_spread(tiers[list(red + blue)]) for red, blue, score in lineups)
+    lobbies = sorted(lineups, key=lambda lineup: tiers[list(lineup[0] + lineup[1])].mean())
+    return lobbies, objective
+
+
+def partition_players(tiers, priorities, tier_weight, role_preference_weight, time_budget=1.0, rng=random, pairing=None):
+    """
+    Splits any multiple of 10 players into lobbies, teams and roles at the same time.
+    The objective is the sum of every lobby's best_split() score plus TIER_WEIGHT times each lobby's tier spread (see
+    lobby_spread()), which keeps players in lobbies close to their own skill level the way sorting by tier used to.
+
+    The search starts from the old approach (players sorted by tier, cut into consecutive groups of 10, each solved exactly),
+    then runs simulated annealing for up to time_budget seconds, and finally re-solves every lobby whose members changed with
+    best_split(). The result is never worse than the sorted-groups starting point.
+    Args:
+    - tiers, priorities: arrays for all players, as stored in a Roster.
+    - time_budget: seconds to spend on the annealing phase (skipped when there is only one lobby).
+    - pairing: optional repeat-pairing costs for all players (see the module docstring).
+    Returns:
+    - (lobbies, objective): lobbies is a list of (red, blue, score) tuples like best_split() returns but with indices into the
+      full player list, ordered from the lowest to the highest average tier; objective is the total objective value reached.
+    """
+    def seed():
+        return rng.getrandbits(64)
+
+    groups = tier_sorted_groups(tiers, rng)
+    lineups = [solve_lobby(tiers, priorities, members, tier_weight, role_preference_weight, seed(), pairing) for members in groups]
+
+    groups, _ = improve_layout(lineups, tiers, priorities, tier_weight, role_preference_weight, time_budget, seed(), pairing)
+    lineups = [
+        lineup or solve_lobby(tiers, priorities, members, tier_weight, role_preference_weight, seed(), pairing)
+        for members, lineup in zip(groups, reused_lineups(lineups, groups))
+    ]
+    return finish_partition(lineups, tiers, tier_weight)
@@ -0,0 +1,91 @@
+"""
+Process pool that runs the bot's CPU-bound matchmaking jobs (see matchmaking.py), so balancing a large event doesn't block the
+bot's event loop.
+
+Workers are started with "spawn" on every platform, so they don't inherit the bot's event loop, database threads or sockets. A
+spawned worker normally re-runs the parent's main script first, which for the bot would mean loading .env, building the Discord
+client and defining every command in each worker just to run a NumPy function. WorkerProcess has workers run this module as
+their main module instead, so a worker only imports this module and matchmaking.py.
+
+Engine jobs get their own seed for tie-breaking, since a random.Random can't be shared with another process. pairing is the
+repeat-pairing costs from PairingHistory.costs() in bot.py, if any.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.context import SpawnContext, SpawnProcess
+import random
+import sys
+
+import matchmaking
+
+
+class WorkerProcess(SpawnProcess):
+    def start(self):
+        # The main module a spawned process imports is read from sys.modules['__main__'] while it is being started
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = sys.modules[__name__]
+        try:
+            super().start()
+        finally:
+            sys.modules['__main__'] = main
+
+
+class WorkerContext(SpawnContext):
+    Process = WorkerProcess
+
+
+class MatchmakingPool:
+    def __init__(self, tier_weight, role_preference_weight, alternatives):
+        self.tier_weight = tier_weight
+        self.role_preference_weight = role_preference_weight
+        self.alternatives = alternatives  # Lineups kept for each lobby by lobby_alternatives(), counting the best one
+        self.executor = None
+
+    def start(self):
+        # Starts the pool (only once, so it's safe to call again). Until then, jobs run in worker threads.
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(mp_context=WorkerContext())
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    async def run(self, function, *args):
+        # Runs a matchmaking engine function in the process pool (or in a worker thread if the pool hasn't been started yet)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def solve_lobby(self, tiers, priorities, members, pairing=None):
+        # Solves one lobby exactly
+        return await self.run(
+            matchmaking.solve_lobby, tiers, priorities, members, self.tier_weight, self.role_preference_weight,
+            random.getrandbits(64), pairing
+        )
+
+    async def lobby_alternatives(self, tiers, priorities, lineup, pairing=None):
+        # Lists the best distinct lineups for a solved lobby (see matchmaking.lobby_alternatives())
+        return await self.run(
+            matchmaking.lobby_alternatives, tiers, priorities, lineup, self.tier_weight, self.role_preference_weight,
+            self.alternatives, random.getrandbits(64), pairing
+        )
+
+    async def improve_lineups(self, lineups, tiers, priorities, time_budget, pairing=None):
+        """
+        Lets the global partitioner move players between solved lobbies for up to time_budget seconds, then solves any lobby
+        whose members changed again (in parallel). Lobbies that didn't change keep their lineup.
+        Returns:
+        - (lineups, search stats)
+        """
+        groups, stats = await self.run(
+            matchmaking.improve_layout, lineups, tiers, priorities, self.tier_weight, self.role_preference_weight,
+            max(time_budget, 0), random.getrandbits(64), pairing
+        )
+
+        async def keep_or_solve(members, lineup):
+            return lineup if lineup is not None else await self.solve_lobby(tiers, priorities, members, pairing)
+
+        lineups = await asyncio.gather(*(
+            keep_or_solve(members, lineup) for members, lineup in zip(groups, matchmaking.reused_lineups(lineups, groups))
+        ))
+        return lineups, stats
@@ -0,0 +1,282 @@
+"""
+Versioned schema migrations for the bot's database, run by initialize_database() every time the bot starts.
+
+The schema version a database has reached is kept in SQLite's user_version pragma (0 for databases created before migrations
+existed). migrate() applies every migration above that version in order, each in its own transaction together with the
+version bump, so a migration is either applied completely or not at all. Migrations are also written to be idempotent (tables
+and indexes are created IF NOT EXISTS, and changes that already exist are skipped), so running one against a database that
+already has its changes is harmless.
+
+Migrations run while the bot is starting, with the database in WAL mode, so readers keep working while a migration writes.
+To change the schema, append a new migration to MIGRATIONS; never edit one that has already been released.
+"""
+import matchmaking
+
+
+# PlayerStats columns holding a player's priority (1-5) for each role, in matchmaking.ROLES order
+ROLE_PRIORITY_COLUMNS = ("TopPriority", "JunglePriority", "MidPriority", "BotPriority", "SupportPriority")
+
+
+async def _columns(conn, table):
+    async with conn.execute(f'PRAGMA table_info("{table}")') as cursor:
+        return [row[1] for row in await cursor.fetchall()]
+
+
+async def create_tables(conn):
+    # Version 1: the tables as they were before migrations existed
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS "PlayerStats" (
+            "DiscordID" TEXT NOT NULL UNIQUE,
+            "DiscordUsername" TEXT NOT NULL,
+            "PlayerRiotID" TEXT UNIQUE,
+            "Participation" NUMERIC DEFAULT 0,
+            "Wins" INTEGER DEFAULT 0,
+            "MVPs" INTEGER DEFAULT 0,
+            "ToxicityPoints" NUMERIC DEFAULT 0,
+            "GamesPlayed" INTEGER DEFAULT 0,
+            "WinRate" REAL,
+            "TotalPoints" NUMERIC DEFAULT 0,
+            "PlayerTier" INTEGER DEFAULT 0,
+            "PlayerRank" TEXT DEFAULT 'UNRANKED',
+            "RolePreference" TEXT DEFAULT '55555',
+            "RankUpdatedAt" TEXT,
+            PRIMARY KEY("DiscordID")
+)
+    ''')
+    # Databases created before RankUpdatedAt existed (when PlayerRank was last fetched from Riot) need the column added
+    if "RankUpdatedAt" not in await _columns(conn, "PlayerStats"):
+        await conn.execute('ALTER TABLE "PlayerStats" ADD COLUMN "RankUpdatedAt" TEXT')
+    # Results of matches decided with /win and who played in them, used to avoid putting the same players together again
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS "Matches" (
+            "MatchID" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "MatchNumber" TEXT NOT NULL,
+            "LobbyNumber" TEXT NOT NULL,
+            "WinningTeam" TEXT,
+            "PlayedAt" TEXT DEFAULT CURRENT_TIMESTAMP
+)
+    ''')
+    # Riot ID -> PUUID -> encrypted summoner ID resolved for each linked player
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS "RiotIdentities" (
+            "DiscordID" TEXT NOT NULL,
+            "RiotID" TEXT NOT NULL,
+            "PUUID" TEXT NOT NULL,
+            "SummonerID" TEXT,
+            "ResolvedAt" TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY("DiscordID")
+)
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS "MatchParticipants" (
+            "MatchID" INTEGER NOT NULL REFERENCES "Matches"("MatchID"),
+            "DiscordID" TEXT NOT NULL,
+            "Team" TEXT NOT NULL,
+            "Role" TEXT NOT NULL,
+            PRIMARY KEY("MatchID", "DiscordID")
+)
+    ''')
+
+
+async def type_player_stats(conn):
+    """
+    Version 2: rebuilds PlayerStats with typed columns.
+    - DiscordID becomes an INTEGER PRIMARY KEY (the table's rowid), so looking a player up is a direct rowid seek. SQLite converts
+      Discord IDs passed as strings when comparing them with the column, but values read back from it are ints.
+    - Role priorities are stored in their own INTEGER columns (ROLE_PRIORITY_COLUMNS, each 1-5). RolePreference is kept, as a
+      column generated from them, for the spreadsheet and anything else reading the 5-digit string.
+    The other columns keep their order, so code reading rows by position is unaffected.
+    """
+    if "TopPriority" in await _columns(conn, "PlayerStats"):
+        return
+
+    await conn.execute('DROP TABLE IF EXISTS "PlayerStats_new"')
+    await conn.execute(f'''
+        CREATE TABLE "PlayerStats_new" (
+            "DiscordID" INTEGER NOT NULL PRIMARY KEY,
+            "DiscordUsername" TEXT NOT NULL,
+            "PlayerRiotID" TEXT UNIQUE,
+            "Participation" NUMERIC DEFAULT 0,
+            "Wins" INTEGER DEFAULT 0,
+            "MVPs" INTEGER DEFAULT 0,
+            "ToxicityPoints" NUMERIC DEFAULT 0,
+            "GamesPlayed" INTEGER DEFAULT 0,
+            "WinRate" REAL,
+            "TotalPoints" NUMERIC DEFAULT 0,
+            "PlayerTier" INTEGER DEFAULT 0,
+            "PlayerRank" TEXT DEFAULT 'UNRANKED',
+            "RolePreference" TEXT GENERATED ALWAYS AS ({' || '.join(f'"{column}"' for column in ROLE_PRIORITY_COLUMNS)}) VIRTUAL,
+            "RankUpdatedAt" TEXT,
+            {', '.join(f'"{column}" INTEGER NOT NULL DEFAULT 5 CHECK ("{column}" BETWEEN 1 AND 5)' for column in ROLE_PRIORITY_COLUMNS)}
+)
+    ''')
+
+    copied = ("DiscordUsername", "PlayerRiotID", "Participation", "Wins", "MVPs", "ToxicityPoints", "GamesPlayed", "WinRate",
+              "TotalPoints", "PlayerTier", "PlayerRank", "RankUpdatedAt")
+    async with conn.execute(f'SELECT "DiscordID", "RolePreference", {", ".join(copied)} FROM "PlayerStats"') as cursor:
+        rows = await cursor.fetchall()
+
+    def typed(row):
+        discord_id, role_preference, *values = row
+        priorities = matchmaking.parse_role_preference(role_preference)
+        if not all(1 <= priority <= 5 for priority in priorities):
+            priorities = (5,) * len(ROLE_PRIORITY_COLUMNS)
+        return (int(discord_id), *values, *priorities)
+
+    columns = ("DiscordID",) + copied + ROLE_PRIORITY_COLUMNS
+    await conn.executemany(
+        f'INSERT INTO "PlayerStats_new" ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})',
+        [typed(row) for row in rows]
+    )
+    await conn.execute('DROP TABLE "PlayerStats"')
+    await conn.execute('ALTER TABLE "PlayerStats_new" RENAME TO "PlayerStats"')
+
+
+async def index_player_stats(conn):
+    # Version 3: indexes for the columns PlayerStats is searched or sorted by. PlayerRiotID already has one through its UNIQUE
+    # constraint; DiscordUsername is what MVP voting updates by.
+    await conn.execute('CREATE INDEX IF NOT EXISTS "PlayerStats_DiscordUsername" ON "PlayerStats" ("DiscordUsername")')
+    await conn.execute('CREATE INDEX IF NOT EXISTS "PlayerStats_PlayerTier" ON "PlayerStats" ("PlayerTier")')
+    await conn.execute('CREATE INDEX IF NOT EXISTS "PlayerStats_TotalPoints" ON "PlayerStats" ("TotalPoints")')
+
+
+async def match_ledger(conn):
+    """
+    Version 4: makes Matches and MatchParticipants an append-only ledger of results and maintains per-player aggregates from it.
+    - Ledger rows can't be deleted, and the only change allowed is setting a match's WinningTeam (when /win is used again to
+      correct it). Every such correction is recorded in MatchCorrections.
+    - PlayerMatchTotals holds each player's matches in the ledger, how many of them they won, and when they last played. Triggers
+      keep it up to date as participants are inserted and winners corrected, and apply the same change to PlayerStats.Wins
+      (and WinRate), so correcting a result fixes the players' stats too. It's filled from the matches already recorded;
+      PlayerStats.Wins already counts those.
+    - ActiveLobbies keeps the teams of every lobby posted by /matchmake, so /win still works for them after the bot restarts.
+    """
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS "PlayerMatchTotals" (
+            "DiscordID" INTEGER NOT NULL PRIMARY KEY,
+            "MatchesPlayed" INTEGER NOT NULL DEFAULT 0,
+            "MatchWins" INTEGER NOT NULL DEFAULT 0,
+            "LastPlayedAt" TEXT
+)
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS "MatchCorrections" (
+            "CorrectionID" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "MatchID" INTEGER NOT NULL REFERENCES "Matches"("MatchID"),
+            "PreviousWinningTeam" TEXT,
+            "WinningTeam" TEXT,
+            "CorrectedAt" TEXT DEFAULT CURRENT_TIMESTAMP
+)
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS "ActiveLobbies" (
+            "MatchNumber" TEXT NOT NULL,
+            "LobbyNumber" TEXT NOT NULL,
+            "Team" TEXT NOT NULL,
+            "Role" TEXT NOT NULL,
+            "DiscordID" TEXT NOT NULL,
+            "DiscordUsername" TEXT NOT NULL,
+            "MatchID" INTEGER REFERENCES "Matches"("MatchID"),
+            PRIMARY KEY("MatchNumber", "LobbyNumber", "Team", "Role")
+)
+    ''')
+    await conn.execute('CREATE INDEX IF NOT EXISTS "MatchParticipants_DiscordID" ON "MatchParticipants" ("DiscordID")')
+
+    if not await conn.execute_fetchall('SELECT 1 FROM "PlayerMatchTotals" LIMIT 1'):
+        await conn.execute(f'INSERT INTO "PlayerMatchTotals" {LEDGER_TOTALS}')
+
+    # Only results can change, and only through WinningTeam
+    for name, event in (
+        ("Matches_AppendOnlyDelete", 'BEFORE DELETE ON "Matches"'),
+        ("Matches_AppendOnlyUpdate", 'BEFORE UPDATE OF "MatchID", "MatchNumber", "LobbyNumber", "PlayedAt" ON "Matches"'),
+        ("MatchParticipants_AppendOnlyDelete", 'BEFORE DELETE ON "MatchParticipants"'),
+        ("MatchParticipants_AppendOnlyUpdate", 'BEFORE UPDATE ON "MatchParticipants"'),
+    ):
+        await conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS "{name}" {event}
+            BEGIN
+                SELECT RAISE(ABORT, 'the match ledger is append-only');
+            END
+        ''')
+
+    # A participant's result counts as soon as they're recorded (/win inserts the match with its winner first)
+    await conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS "MatchParticipants_Totals" AFTER INSERT ON "MatchParticipants"
+        BEGIN
+            INSERT INTO "PlayerMatchTotals" ("DiscordID", "MatchesPlayed", "MatchWins", "LastPlayedAt")
+            SELECT NEW."DiscordID", 1, NEW."Team" IS "WinningTeam", "PlayedAt" FROM "Matches" WHERE "MatchID" = NEW."MatchID"
+            ON CONFLICT("DiscordID") DO UPDATE SET
+                "MatchesPlayed" = "MatchesPlayed" + 1,
+                "MatchWins" = "MatchWins" + excluded."MatchWins",
+                "LastPlayedAt" = max(coalesce("LastPlayedAt", ''), excluded."LastPlayedAt");
+            {_add_wins('NEW."DiscordID"', 'NEW."Team" IS (SELECT "WinningTeam" FROM "Matches" WHERE "MatchID" = NEW."MatchID")')}
+        END
+    ''')
+
+    # Moves the win from the old winners to the new ones when /win corrects a result
+    def change(table):
+        return (f'(SELECT (p."Team" IS NEW."WinningTeam") - (p."Team" IS OLD."WinningTeam") FROM "MatchParticipants" p '
+                f'WHERE p."MatchID" = NEW."MatchID" AND p."DiscordID" = "{table}"."DiscordID")')
+    participants = '(SELECT "DiscordID" FROM "MatchParticipants" WHERE "MatchID" = NEW."MatchID")'
+    await conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS "Matches_Corrected" AFTER UPDATE OF "WinningTeam" ON "Matches"
+        WHEN OLD."WinningTeam" IS NOT NEW."WinningTeam"
+        BEGIN
+            INSERT INTO "MatchCorrections" ("MatchID", "PreviousWinningTeam", "WinningTeam")
+            VALUES (NEW."MatchID", OLD."WinningTeam", NEW."WinningTeam");
+            UPDATE "PlayerMatchTotals" SET "MatchWins" = "MatchWins" + {change("PlayerMatchTotals")} WHERE "DiscordID" IN {participants};
+            {_add_wins(participants, change("PlayerStats"), "IN")}
+        END
+    ''')
+
+
+# Every player's aggregates computed from the ledger, in PlayerMatchTotals' column order
+LEDGER_TOTALS = '''
+    SELECT p."DiscordID", count(*), sum(p."Team" IS m."WinningTeam"), max(m."PlayedAt")
+    FROM "MatchParticipants" p JOIN "Matches" m ON m."MatchID" = p."MatchID"
+    GROUP BY p."DiscordID"
+'''
+
+
+def _win_rate(wins_added):
+    # WinRate (0-1, as /stats expects) after adding wins_added to Wins in the same UPDATE
+    return f'CASE WHEN "GamesPlayed" > 0 THEN CAST("Wins" + {wins_added} AS REAL) / "GamesPlayed" END'
+
+
+def _add_wins(discord_id, wins, operator="="):
+    # Statement adding wins (an SQL expression) to PlayerStats.Wins for the players matching "DiscordID" {operator} {discord_id}
+    return (f'UPDATE "PlayerStats" SET "Wins" = "Wins" + ({wins}), "WinRate" = {_win_rate(f"({wins})")} '
+            f'WHERE "DiscordID" {operator} {discord_id};')
+
+
+# Migration i (counting from 1) brings a database to schema version i
+MIGRATIONS = [
+    create_tables,
+    type_player_stats,
+    index_player_stats,
+    match_ledger,
+]
+
+
+async def schema_version(conn):
+    async with conn.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def migrate(conn):
+    # Applies every migration the database doesn't have yet. conn must not have a transaction open.
+    version = await schema_version(conn)
+    if version > len(MIGRATIONS):
+        print(f"Warning: the database is at schema version {version}, newer than this version of the bot knows ({len(MIGRATIONS)}).")
+        return
+
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        await conn.execute("BEGIN")
+        try:
+            await migration(conn)
+            await conn.execute(f"PRAGMA user_version = {target}")
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+        print(f"Database migrated to schema version {target} ({migration.__name__}).")
@@ -0,0 +1,171 @@
+"""
+In-memory cache of the PlayerStats columns the bot reads on almost every interaction.
+
+Check-ins, sit-outs, /stats, /rolepreference, MVP voting and /matchmake's roster all look up the same few small rows by
+Discord ID, so PlayerCache keeps those columns (CACHED_COLUMNS) for up to `capacity` players in memory and answers lookups from
+there. It is filled when the bot starts, with the most recently active players first, and players missing from it are loaded
+in IN (...) queries of up to IDS_PER_QUERY Discord IDs. When it is full, the least recently used player is evicted.
+
+Changes to those columns go through the cache too: write() updates the cached player straight away and marks the values dirty,
+and flush() writes every dirty value to the database in one transaction, one executemany() per set of changed columns. The bot
+flushes on a short interval and when it shuts down, and before running queries that need the database to be up to date (e.g.
+ones that search by DiscordUsername). Code that changes these columns in the database directly (such as /link) must call
+forget() afterwards, so the player is loaded again; values written through the cache and not flushed yet are kept, and win
+over what was written directly, since they only touch the columns they were written for. Code that deletes a player's row
+calls forget(drop_writes=True) instead.
+
+Stats columns (Wins, Participation, ...) are not cached: they are only changed by set-based UPDATEs and the match ledger's
+triggers, and read by commands that show them.
+"""
+from collections import OrderedDict, defaultdict
+
+import migrations
+
+
+CACHED_COLUMNS = ("DiscordUsername", "PlayerRiotID", "PlayerRank", "RankUpdatedAt") + migrations.ROLE_PRIORITY_COLUMNS
+WRITABLE_COLUMNS = CACHED_COLUMNS + ("PlayerTier",)  # PlayerTier isn't read from the cache, but is written along with PlayerRank
+IDS_PER_QUERY = 500
+
+
+class PlayerCache:
+    def __init__(self, db, capacity=10000):
+        self.db = db
+        self.capacity = max(capacity, 1)
+        self.players = OrderedDict()  # Discord ID -> {column: value} for every cached column, least recently used first
+        self.dirty = {}  # Discord ID -> {column: value} written through the cache since the last flush
+        self.flushing = {}  # Values being written by the flush in progress
+        self.generation = 0  # Changes whenever the database may hold newer values than a load that was running has read
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    def _remember(self, discord_id, player):
+        self.players[discord_id] = player
+        self.players.move_to_end(discord_id)
+        while len(self.players) > self.capacity:
+            self.players.popitem(last=False)
+            self.evictions += 1
+
+    def _pending(self, discord_id):
+        # Values written through the cache for a player that may not be in the database yet
+        return {**self.flushing.get(discord_id, {}), **self.dirty.get(discord_id, {})}
+
+    async def _select(self, conn, where, parameters):
+        columns = ", ".join(CACHED_COLUMNS)
+        async with conn.execute(f"SELECT DiscordID, {columns} FROM PlayerStats {where}", parameters) as cursor:
+            return {str(discord_id): {**dict(zip(CACHED_COLUMNS, values)), **self._pending(str(discord_id))}
+                    for discord_id, *values in await cursor.fetchall()}
+
+    async def load(self):
+        # Fills the cache with the players whose ranks were looked up most recently
+        generation = self.generation
+        async with self.db.reader() as conn:
+            players = await self._select(conn, "ORDER BY RankUpdatedAt DESC LIMIT ?", (self.capacity,))
+        if generation == self.generation:
+            for discord_id, player in reversed(players.items()):
+                if discord_id not in self.players:
+                    self._remember(discord_id, player)
+        print(f"Loaded {len(players)} players into the player cache.")
+
+    async def get_many(self, discord_ids):
+        """
+        Looks players up, from the cache where possible.
+        Args:
+        - discord_ids: Discord IDs (str).
+        Returns:
+        - {Discord ID: {column: value}} for every player found, with a value for each of CACHED_COLUMNS. The dicts are copies.
+        """
+        found, missing = {}, []
+        for discord_id in dict.fromkeys(discord_ids):
+            player = self.players.get(discord_id)
+            if player is None:
+                missing.append(discord_id)
+                continue
+            self.players.move_to_end(discord_id)
+            found[discord_id] = dict(player)
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        if missing:
+            generation = self.generation
+            loaded = {}
+            async with self.db.reader() as conn:
+                for base in range(0, len(missing), IDS_PER_QUERY):
+                    chunk = missing[base:base + IDS_PER_QUERY]
+                    loaded.update(await self._select(conn, f"WHERE DiscordID IN ({', '.join('?' for _ in chunk)})", chunk))
+            for discord_id, player in loaded.items():
+                # A flush or forget() while loading may have made what was read out of date, so it's only returned then
+                if generation == self.generation and discord_id not in self.players:
+                    self._remember(discord_id, player)
+                found[discord_id] = dict(self.players.get(discord_id, player))
+        return found
+
+    async def get(self, discord_id):
+        # Returns one player's {column: value}, or None if they aren't in the database
+        return (await self.get_many([discord_id])).get(discord_id)
+
+    def write(self, discord_id, values):
+        # Changes some of a player's WRITABLE_COLUMNS ({column: value}); they reach the database at the next flush()
+        if any(column not in WRITABLE_COLUMNS for column in values):
+            raise ValueError(f"Columns not written through the player cache in {values}")
+        self.dirty.setdefault(discord_id, {}).update(values)
+        player = self.players.get(discord_id)
+        if player is not None:
+            player.update((column, value) for column, value in values.items() if column in CACHED_COLUMNS)
+
+    def forget(self, discord_id, drop_writes=False):
+        """
+        Drops a player whose row was changed or deleted in the database directly, so they're loaded again on the next lookup.
+        Values written through the cache but not flushed yet are kept (and applied over the reloaded row) unless drop_writes is
+        set, which is only for rows that were deleted.
+        """
+        self.players.pop(discord_id, None)
+        if drop_writes:
+            self.dirty.pop(discord_id, None)
+        self.generation += 1
+
+    async def flush(self):
+        # Writes every dirty value to the database in one transaction. Returns the number of players written.
+        if not self.dirty:
+            return 0
+        self.flushing, self.dirty = self.dirty, {}
+        groups = defaultdict(list)  # Changed columns -> parameters of every player with those columns changed
+        for discord_id, values in self.flushing.items():
+            columns = tuple(sorted(values))
+            groups[columns].append([values[column] for column in columns] + [discord_id])
+
+        try:
+            async with self.db.writer() as conn:
+                for columns, rows in groups.items():
+                    await conn.executemany(
+                        f"UPDATE PlayerStats SET {', '.join(f'{column} = ?' for column in columns)} WHERE DiscordID = ?", rows
+                    )
+                await conn.commit()
+        except BaseException:
+            # Keep the values for the next flush, unless they were written again since
+            for discord_id, values in self.flushing.items():
+                self.dirty[discord_id] = {**values, **self.dirty.get(discord_id, {})}
+            raise
+        finally:
+            written, self.flushing = len(self.flushing), {}
+            self.generation += 1
+
+        self.flushes += 1
+        self.rows_flushed += written
+        return written
+
+    def status(self):
+        lookups = self.hits + self.misses
+        return {
+            "players": len(self.players),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+            "dirty": len(self.dirty),
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+        }
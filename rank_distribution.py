@@ -0,0 +1,24 @@
+"""
+Rank distribution shared by the developer tools that generate synthetic players (benchmark.py and fake_riot_server.py), kept
+in its own module so neither has to import the other (or NumPy and the matchmaking engine) to use it.
+"""
+
+# Approximate share of players at each rank (solo/duo queue ladder plus players with no rank this season)
+RANK_DISTRIBUTION = {
+    "UNRANKED": 0.15,
+    "IRON": 0.07,
+    "BRONZE": 0.17,
+    "SILVER": 0.17,
+    "GOLD": 0.16,
+    "PLATINUM": 0.12,
+    "EMERALD": 0.10,
+    "DIAMOND": 0.05,
+    "MASTER": 0.008,
+    "GRANDMASTER": 0.0015,
+    "CHALLENGER": 0.0005,
+}
+
+
+def random_ranks(count, rng):
+    # Draws `count` ranks (e.g. "GOLD") from RANK_DISTRIBUTION using a random.Random
+    return rng.choices(list(RANK_DISTRIBUTION), weights=list(RANK_DISTRIBUTION.values()), k=count)
@@ -0,0 +1,469 @@
+"""
+Client-side rate limiting for the Riot Games API.
+
+Riot limits every API key per region host (e.g. americas.api.riotgames.com and na1.api.riotgames.com are limited separately) with
+"application" limits covering all requests, plus "method" limits for each endpoint. Every limit is a list of windows, sent in
+the X-App-Rate-Limit and X-Method-Rate-Limit response headers as "requests:seconds" pairs (e.g. "20:1,100:120" allows 20 requests
+per second and 100 per 2 minutes), with X-App-Rate-Limit-Count and X-Method-Rate-Limit-Count saying how much of each window has
+been used. Going over a limit gets a 429 response.
+
+RateLimiter keeps a token bucket for each of those windows and only lets a request start once every bucket it belongs to has a
+token left, so requests go out as fast as the limits allow without ever reaching a 429. Requests waiting for a token are
+queued by priority, so commands somebody is waiting on (INTERACTIVE) always go ahead of background refreshes (BACKGROUND).
+
+RiotClient is the bot's single client for the Riot API: one pooled HTTP session and one RateLimiter shared by every request,
+with a method for each endpoint the bot uses. Identical requests made at the same time (e.g. several /stats calls for the same
+player) share one in-flight request, and 404 responses are remembered for a short while so repeated lookups of a Riot ID that
+doesn't exist (e.g. a typo in /link) don't reach Riot at all. Each host also has a CircuitBreaker, so that during a Riot outage
+requests fail straight away instead of every command waiting through its own retries.
+
+Nothing in this module depends on discord.py or the database.
+"""
+import asyncio
+from collections import deque
+import heapq
+import itertools
+import math
+import random
+import time
+from urllib.parse import quote, urlsplit
+
+import aiohttp
+
+
+# Request priorities (lower values are sent first)
+INTERACTIVE = 0  # Commands a user is waiting on, such as /stats and /link
+BACKGROUND = 10  # Work nobody is waiting on, such as rank refreshes
+
+# Names of the Riot API methods the bot uses, which method rate limits are kept under
+ACCOUNT_BY_RIOT_ID = "account-v1.getByRiotId"
+SUMMONER_BY_PUUID = "summoner-v4.getByPUUID"
+LEAGUE_ENTRIES_BY_SUMMONER = "league-v4.getLeagueEntriesForSummoner"
+
+# Application limits of a development key, used for a region until Riot's response headers give the real ones
+DEFAULT_APP_RATE_LIMIT = "20:1,100:120"
+
+# Window used to record requests for a limit that isn't known yet, so they still count once Riot's headers give the limit
+UNKNOWN_LIMIT_WINDOW = (math.inf, 600.0)
+
+# Seconds added to every window, to allow for the time between a request leaving the bot and Riot counting it
+WINDOW_MARGIN = 0.1
+
+
+def parse_rate_limits(header):
+    # Parses a rate limit header such as "20:1,100:120" into [(20, 1.0), (100, 120.0)] (requests, window length in seconds).
+    # Malformed entries are skipped, so one bad header can't make every request fail.
+    limits = []
+    for pair in (header or "").split(","):
+        if ":" in pair:
+            requests, seconds = pair.split(":", 1)
+            try:
+                limits.append((int(requests), float(seconds)))
+            except ValueError:
+                continue
+    return limits
+
+
+class RateLimitWindow:
+    """
+    Token bucket for one rate limit window: `limit` tokens, where each request takes one and the token only comes back `seconds`
+    after it was taken. Riot's windows are fixed rather than sliding, so handing tokens back any sooner (such as refilling at a
+    steady rate) could allow two full bursts within one of Riot's windows.
+    """
+    __slots__ = ("limit", "seconds", "taken")
+
+    def __init__(self, limit, seconds, taken=()):
+        self.limit = limit
+        self.seconds = seconds
+        self.taken = deque(taken)  # time.monotonic() at which each token in use was taken, oldest first
+
+    def _release(self, now):
+        while self.taken and self.taken[0] + self.seconds + WINDOW_MARGIN <= now:
+            self.taken.popleft()
+
+    def wait_time(self, now):
+        # Seconds until a token is available (0 if one is available now)
+        self._release(now)
+        if len(self.taken) < self.limit:
+            return 0.0
+        return self.taken[len(self.taken) - self.limit] + self.seconds + WINDOW_MARGIN - now
+
+    def take(self, now):
+        self.taken.append(now)
+
+    def sync(self, count, now):
+        # Riot counted `count` requests in this window. If that's more than the bot knows about (e.g. requests made before the
+        # bot restarted), the extra tokens are treated as taken just now.
+        self._release(now)
+        for _ in range(count - len(self.taken)):
+            self.taken.append(now)
+
+
+class RateLimitBucket:
+    # All windows of one rate limit (the application limit of a region, or one method's limit in a region)
+    def __init__(self, limits=()):
+        self.windows = [RateLimitWindow(limit, seconds) for limit, seconds in limits]
+        self.blocked_until = 0.0  # Set when Riot answers 429 anyway, from the Retry-After header
+
+    def wait_time(self, now):
+        return max([self.blocked_until - now, 0.0] + [window.wait_time(now) for window in self.windows])
+
+    def take(self, now):
+        for window in self.windows:
+            window.take(now)
+
+    def update(self, limits_header, counts_header, now):
+        # Applies the limits and counts from a response's headers
+        limits = parse_rate_limits(limits_header)
+        if limits and limits != [(window.limit, window.seconds) for window in self.windows]:
+            # New windows start from the requests already recorded, so switching limits can't free up tokens early
+            taken = max((window.taken for window in self.windows), key=len, default=())
+            self.windows = [RateLimitWindow(limit, seconds, taken) for limit, seconds in limits]
+
+        counts = {seconds: count for count, seconds in parse_rate_limits(counts_header)}
+        for window in self.windows:
+            if window.seconds in counts:
+                window.sync(counts[window.seconds], now)
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class RateLimiter:
+    """
+    Schedules Riot API requests so they stay within Riot's rate limits. Every request is made as:
+
+        await rate_limiter.acquire(url, method, priority)
+        ... make the request ...
+        rate_limiter.observe(url, method, response.status, response.headers)
+
+    acquire() waits until the request can be sent, and observe() keeps the limits and counts in step with Riot's headers.
+    Each region host has its own queue, served by a dispatcher task that starts the most urgent request whose method still has
+    tokens left, as soon as the host's application limit allows it.
+    """
+    def __init__(self, default_app_rate_limit=DEFAULT_APP_RATE_LIMIT):
+        self.default_app_limits = parse_rate_limits(default_app_rate_limit)
+        self.app_buckets = {}  # host -> RateLimitBucket
+        self.method_buckets = {}  # (host, method) -> RateLimitBucket
+        self.queues = {}  # host -> heap of (priority, sequence, method, future, url) for requests waiting to be sent
+        self.wakeups = {}  # host -> asyncio.Event set whenever the host's dispatcher should look at its queue again
+        self.dispatchers = {}  # host -> dispatcher task
+        self.sequence = itertools.count()  # Keeps requests with the same priority in the order they were made
+
+    def _app_bucket(self, host):
+        if host not in self.app_buckets:
+            self.app_buckets[host] = RateLimitBucket(self.default_app_limits)
+        return self.app_buckets[host]
+
+    def _method_bucket(self, host, method):
+        if (host, method) not in self.method_buckets:
+            # Method limits aren't known until Riot's first response for the method
+            self.method_buckets[host, method] = RateLimitBucket([UNKNOWN_LIMIT_WINDOW])
+        return self.method_buckets[host, method]
+
+    async def acquire(self, url, method, priority=INTERACTIVE):
+        host = urlsplit(url).netloc
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queues.setdefault(host, []), (priority, next(self.sequence), method, future, url))
+        self._wake(host)
+        await future
+
+    def prioritize(self, url, priority):
+        # Moves requests for url that are still waiting up to `priority`, if that is more urgent (e.g. a user is now waiting on
+        # a background request)
+        host = urlsplit(url).netloc
+        queue = self.queues.get(host, [])
+        raised = False
+        for i, (queued_priority, sequence, method, future, queued_url) in enumerate(queue):
+            if queued_url == url and priority < queued_priority:
+                queue[i] = (priority, sequence, method, future, queued_url)
+                raised = True
+        if raised:
+            heapq.heapify(queue)
+            self._wake(host)
+
+    def observe(self, url, method, status, headers):
+        host = urlsplit(url).netloc
+        now = time.monotonic()
+        app_bucket, method_bucket = self._app_bucket(host), self._method_bucket(host, method)
+        app_bucket.update(headers.get("X-App-Rate-Limit"), headers.get("X-App-Rate-Limit-Count"), now)
+        method_bucket.update(headers.get("X-Method-Rate-Limit"), headers.get("X-Method-Rate-Limit-Count"), now)
+
+        if status == 429:
+            # Only an application limit holds up the whole region; method and service limits only hold up that method
+            try:
+                retry_after = float(headers.get("Retry-After", 1))
+            except ValueError:
+                retry_after = 1.0
+            bucket = app_bucket if headers.get("X-Rate-Limit-Type") == "application" else method_bucket
+            bucket.block(retry_after, now)
+
+        if self.queues.get(host):
+            self._wake(host)
+
+    def _wake(self, host):
+        self.wakeups.setdefault(host, asyncio.Event()).set()
+        dispatcher = self.dispatchers.get(host)
+        if dispatcher is None or dispatcher.done():
+            self.dispatchers[host] = asyncio.create_task(self._dispatch(host))
+
+    async def _dispatch(self, host):
+        queue, wakeup, app_bucket = self.queues[host], self.wakeups[host], self._app_bucket(host)
+        while queue:
+            wakeup.clear()
+            now = time.monotonic()
+            delay = app_bucket.wait_time(now)
+
+            if delay <= 0:
+                # Start the most urgent request whose method has a token left. Each method has its own limits, so a request
+                # waiting for its method doesn't hold up requests for other methods.
+                delay = math.inf
+                for entry in sorted(queue):
+                    priority, sequence, method, future, _ = entry
+                    method_bucket = self._method_bucket(host, method)
+                    method_delay = 0.0 if future.done() else method_bucket.wait_time(now)
+                    if method_delay <= 0:
+                        queue.remove(entry)
+                        heapq.heapify(queue)
+                        if not future.done():  # Requests whose caller gave up (cancelled) don't use any tokens
+                            app_bucket.take(now)
+                            method_bucket.take(now)
+                            future.set_result(None)
+                        delay = 0.0
+                        break
+                    delay = min(delay, method_delay)
+
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=None if delay == math.inf else delay)
+                except asyncio.TimeoutError:
+                    pass
+
+
+class RiotAPIError(Exception):
+    # Raised when the Riot API can't be reached, or answers with an error other than 404, after retrying
+    pass
+
+
+class CircuitOpenError(RiotAPIError):
+    # Raised without making a request while a host's circuit breaker is open
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one Riot API host. It starts closed (requests go through). After failure_threshold failures in a row
+    (connection errors, timeouts and 5xx responses) it opens, and requests to the host fail straight away with CircuitOpenError.
+    Once the open period is over it is half-open: a single request is let through as a probe, and the breaker closes if the
+    probe gets an answer or opens again if it fails. Each time it opens again without closing in between, the open period
+    doubles (up to max_open_seconds), with jitter so the bot doesn't probe at exactly regular intervals.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, open_seconds=30.0, max_open_seconds=600.0):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.consecutive_opens = 0  # Times opened since the breaker was last closed, which sets the open period
+        self.open_until = 0.0  # time.monotonic() at which an open breaker becomes half-open
+        self.probing = False  # Whether the half-open probe request is in flight
+        self.successes = self.failures = self.rejected = self.times_opened = 0
+
+    def allow(self, now):
+        # Whether a request may be made now (in which case it has to be followed by succeeded(), failed() or abandoned()). The
+        # request is the probe if the breaker is half-open once this returns True.
+        if self.state == self.OPEN and now >= self.open_until:
+            self.state = self.HALF_OPEN
+        if self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self.probing):
+            self.probing = self.state == self.HALF_OPEN
+            return True
+        self.rejected += 1
+        return False
+
+    def succeeded(self):
+        self.successes += 1
+        self.state = self.CLOSED
+        self.consecutive_failures = self.consecutive_opens = 0
+        self.probing = False
+
+    def failed(self, now, probe=False):
+        self.failures += 1
+        self.consecutive_failures += 1
+        # Requests already in flight when the breaker opened only count as failures: only the probe opens it again
+        if (self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold) or (self.state == self.HALF_OPEN and probe):
+            self.consecutive_opens += 1
+            self.times_opened += 1
+            open_seconds = min(self.max_open_seconds, self.open_seconds * 2 ** (self.consecutive_opens - 1))
+            self.state = self.OPEN
+            self.open_until = now + random.uniform(open_seconds / 2, open_seconds)
+        if probe:
+            self.probing = False
+
+    def abandoned(self, probe=False):
+        # The request was cancelled before it got an answer, so if it was the probe another request can be the probe
+        if probe:
+            self.probing = False
+
+    def status(self, now):
+        return {
+            "state": self.state if self.state != self.OPEN or now < self.open_until else self.HALF_OPEN,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in": max(self.open_until - now, 0.0) if self.state == self.OPEN else 0.0,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+        }
+
+
+class RiotClient:
+    """
+    Client for every Riot API request the bot makes. It owns a single aiohttp session whose connector keeps connections alive
+    between requests (at most connections_per_host open connections to each region host), caches DNS lookups and verifies TLS
+    certificates, and it sends every request through its RateLimiter.
+
+    Each endpoint method returns Riot's JSON response, or None if Riot answered 404 (not found), and raises RiotAPIError if
+    the request fails after MAX_ATTEMPTS attempts. start() has to be awaited (inside the event loop) before making requests.
+
+    Requests for a URL that is already being requested wait for that request instead of sending their own, and get the same
+    result (or error). The shared request is sent with the most urgent priority of the callers waiting on it. URLs Riot answered 404 for return None without a request for not_found_ttl seconds.
+    Responses are shared between callers, so they must not be modified.
+
+    Failed attempts are retried after a random delay of up to RETRY_DELAY * 2 ** attempt seconds (exponential backoff with
+    jitter), unless the host's CircuitBreaker has opened in the meantime.
+    """
+    MAX_ATTEMPTS = 3
+    RETRY_DELAY = 1  # Base of the delay between attempts after a connection error, timeout or server error
+    FAILURE_THRESHOLD = 5  # Failures in a row after which a host's circuit breaker opens
+    OPEN_SECONDS = 30.0  # How long a circuit breaker stays open the first time, doubling each time it reopens
+
+    def __init__(self, api_key, app_rate_limit=DEFAULT_APP_RATE_LIMIT, connections_per_host=10, not_found_ttl=60,
+                 regional_url="https://americas.api.riotgames.com", platform_url="https://na1.api.riotgames.com"):
+        self.api_key = api_key
+        self.rate_limiter = RateLimiter(app_rate_limit)
+        self.connections_per_host = connections_per_host
+        self.not_found_ttl = not_found_ttl
+        self.regional_url = regional_url  # Riot account endpoints (account-v1)
+        self.platform_url = platform_url  # League of Legends endpoints for the bot's server (summoner-v4, league-v4)
+        self.session = None
+        self.in_flight = {}  # URL -> task of the request currently being made for it
+        self.priorities = {}  # URL -> most urgent priority of the callers waiting on its in-flight request
+        self.not_found = {}  # URL -> time (time.monotonic()) until which it is known to be a 404
+        self.breakers = {}  # host -> CircuitBreaker
+
+    def breaker(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(self.FAILURE_THRESHOLD, self.OPEN_SECONDS)
+        return self.breakers[host]
+
+    def status(self):
+        # Circuit breaker state and counters of each host the bot has made requests to
+        now = time.monotonic()
+        return {host: breaker.status(now) for host, breaker in self.breakers.items()}
+
+    async def start(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.connections_per_host,
+                ttl_dns_cache=300,  # Cache DNS resolution for 5 minutes
+                keepalive_timeout=60  # Keep idle connections open for a minute so bursts of requests reuse them
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector, headers={"X-Riot-Token": self.api_key or ""}, timeout=aiohttp.ClientTimeout(total=10)
+            )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def account_by_riot_id(self, game_name, tag_line, priority=INTERACTIVE):
+        # account-v1: {"puuid", "gameName", "tagLine"} for a Riot ID
+        url = f"{self.regional_url}/riot/account/v1/accounts/by-riot-id/{quote(game_name, safe='')}/{quote(tag_line, safe='')}"
+        return await self._get(url, ACCOUNT_BY_RIOT_ID, priority)
+
+    async def summoner_by_puuid(self, puuid, priority=INTERACTIVE):
+        # summoner-v4: the player's summoner, whose encrypted summoner ID is "id"
+        url = f"{self.platform_url}/lol/summoner/v4/summoners/by-puuid/{quote(puuid, safe='')}"
+        return await self._get(url, SUMMONER_BY_PUUID, priority)
+
+    async def league_entries(self, summoner_id, priority=INTERACTIVE):
+        # league-v4: a list with the player's entry for each ranked queue they have a rank in
+        url = f"{self.platform_url}/lol/league/v4/entries/by-summoner/{quote(summoner_id, safe='')}"
+        return await self._get(url, LEAGUE_ENTRIES_BY_SUMMONER, priority)
+
+    async def _get(self, url, method, priority):
+        expires = self.not_found.get(url)
+        if expires is not None:
+            if time.monotonic() < expires:
+                return None
+            del self.not_found[url]
+
+        request = self.in_flight.get(url)
+        if request is None:
+            self.priorities[url] = priority
+            request = asyncio.ensure_future(self._request(url, method))
+            self.in_flight[url] = request
+            request.add_done_callback(lambda _: self._finished(url))
+        elif priority < self.priorities[url]:
+            # E.g. /stats for a player whose rank a background refresh is already looking up mustn't wait behind the refresh
+            self.priorities[url] = priority
+            self.rate_limiter.prioritize(url, priority)
+        # Shielded so a caller being cancelled (e.g. a timed out interaction) doesn't cancel the request for everyone else
+        return await asyncio.shield(request)
+
+    def _finished(self, url):
+        self.in_flight.pop(url, None)
+        self.priorities.pop(url, None)
+
+    def _remember_not_found(self, url):
+        now = time.monotonic()
+        # Forget expired entries first so typos don't accumulate forever
+        for expired in [known for known, expires in self.not_found.items() if expires <= now]:
+            del self.not_found[expired]
+        self.not_found[url] = now + self.not_found_ttl
+
+    async def _request(self, url, method):
+        breaker = self.breaker(url)
+        for attempt in range(self.MAX_ATTEMPTS):
+            if not breaker.allow(time.monotonic()):
+                raise CircuitOpenError(f"The Riot API at {urlsplit(url).netloc} is unavailable; not calling {method}.")
+            probe = breaker.state == breaker.HALF_OPEN
+            try:
+                await self.rate_limiter.acquire(url, method, self.priorities[url])
+                async with self.session.get(url) as response:
+                    self.rate_limiter.observe(url, method, response.status, response.headers)
+                    if response.status < 500:
+                        breaker.succeeded()  # Riot answered, even if the answer is an error
+                    else:
+                        breaker.failed(time.monotonic(), probe)
+                    if response.status == 200:
+                        return await response.json()
+                    if response.status == 404:
+                        if self.not_found_ttl > 0:
+                            self._remember_not_found(url)
+                        return None
+                    if response.status == 429:
+                        # The rate limiter holds back the next attempt for as long as Riot asked
+                        print(f"Rate limit reached. Retrying after {response.headers.get('Retry-After', 1)} seconds.")
+                        continue
+                    if response.status < 500:
+                        # Bad requests and API key problems won't be fixed by retrying
+                        raise RiotAPIError(f"Riot API error {response.status} for {method}: {await response.text()}")
+                    print(f"Riot API error {response.status} for {method} (attempt {attempt + 1}/{self.MAX_ATTEMPTS})")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                breaker.failed(time.monotonic(), probe)
+                print(f"Error connecting to the Riot API for {method} (attempt {attempt + 1}/{self.MAX_ATTEMPTS}): {e!r}")
+            except asyncio.CancelledError:
+                breaker.abandoned(probe)
+                raise
+
+            if attempt < self.MAX_ATTEMPTS - 1:
+                await asyncio.sleep(random.uniform(0, self.RETRY_DELAY * 2 ** attempt))
+
+        raise RiotAPIError(f"All {self.MAX_ATTEMPTS} attempts to call {method} failed.")
@@ -0,0 +1,61 @@
+import itertools
+import random
+
+import numpy as np
+
+import matchmaking
+
+
+TIER_WEIGHT = 0.7
+ROLE_PREFERENCE_WEIGHT = 0.3
+
+
+def brute_force_best_score(tiers, priorities):
+    # Tries every team split and every role order of both teams
+    best = float("inf")
+    for red in itertools.combinations(range(matchmaking.LOBBY_SIZE), matchmaking.TEAM_SIZE):
+        if 0 not in red:
+            continue  # The same split with the sides swapped
+        blue = [player for player in range(matchmaking.LOBBY_SIZE) if player not in red]
+        red_orders = [([tiers[p] for p in order], sum(priorities[p][role] ** 2 for role, p in enumerate(order)))
+                      for order in itertools.permutations(red)]
+        blue_orders = [([tiers[p] for p in order], sum(priorities[p][role] ** 2 for role, p in enumerate(order)))
+                       for order in itertools.permutations(blue)]
+        for red_tiers, red_priority in red_orders:
+            for blue_tiers, blue_priority in blue_orders:
+                tier_diff = sum((a - b) ** 2 for a, b in zip(red_tiers, blue_tiers))
+                best = min(best, tier_diff * TIER_WEIGHT + (red_priority + blue_priority) * ROLE_PREFERENCE_WEIGHT)
+    return best
+
+
+def random_lobby(rng):
+    tiers = [rng.randint(1, 6) for _ in range(matchmaking.LOBBY_SIZE)]
+    priorities = [tuple(rng.randint(1, 5) for _ in matchmaking.ROLES) for _ in range(matchmaking.LOBBY_SIZE)]
+    return tiers, priorities
+
+
+def test_best_split_matches_brute_force():
+    tiers, priorities = random_lobby(random.Random(7))
+    red, blue, score = matchmaking.best_split(
+        np.array(tiers, dtype=float), np.array(priorities, dtype=float), TIER_WEIGHT, ROLE_PREFERENCE_WEIGHT, random.Random(1)
+    )
+
+    assert sorted(red + blue) == list(range(matchmaking.LOBBY_SIZE))
+    assert np.isclose(score, brute_force_best_score(tiers, priorities))
+    assert np.isclose(score, matchmaking.lineup_score(tiers, priorities, red, blue, TIER_WEIGHT, ROLE_PREFERENCE_WEIGHT))
+
+
+def test_best_split_score_includes_repeat_pairings():
+    rng = random.Random(11)
+    tiers, priorities = random_lobby(rng)
+    pairing = np.zeros((2, matchmaking.LOBBY_SIZE, matchmaking.LOBBY_SIZE))
+    for kind, a, b in ((0, 0, 1), (0, 2, 3), (1, 4, 5)):
+        pairing[kind, a, b] = pairing[kind, b, a] = 3.0
+
+    tier_array, priority_array = np.array(tiers, dtype=float), np.array(priorities, dtype=float)
+    red, blue, score = matchmaking.best_split(tier_array, priority_array, TIER_WEIGHT, ROLE_PREFERENCE_WEIGHT, rng, pairing)
+    assert np.isclose(score, matchmaking.lineup_score(tiers, priorities, red, blue, TIER_WEIGHT, ROLE_PREFERENCE_WEIGHT, pairing))
+
+    # The best lineup ignoring repeat pairings can't beat it once its repeat pairings are counted
+    red, blue, _ = matchmaking.best_split(tier_array, priority_array, TIER_WEIGHT, ROLE_PREFERENCE_WEIGHT, rng)
+    assert score <= matchmaking.lineup_score(tiers, priorities, red, blue, TIER_WEIGHT, ROLE_PREFERENCE_WEIGHT, pairing) + 1e-9
@@ -0,0 +1,116 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import database
+import matchmaking
+import migrations
+
+
+def run(tmp_path, test):
+    # Runs test(db) against a freshly migrated database
+    async def main():
+        db = database.Database(str(tmp_path / "test.db"), readers=1)
+        await db.open()
+        try:
+            async with db.writer() as conn:
+                await migrations.migrate(conn)
+            await test(db)
+        finally:
+            await db.close()
+    asyncio.run(main())
+
+
+async def schema(conn):
+    return await conn.execute_fetchall("SELECT type, name, sql FROM sqlite_master ORDER BY type, name")
+
+
+async def add_players(conn, count, games_played=4):
+    await conn.executemany(
+        "INSERT INTO PlayerStats (DiscordID, DiscordUsername, GamesPlayed) VALUES (?, ?, ?)",
+        [(i, f"Player{i}", games_played) for i in range(count)]
+    )
+
+
+async def record_match(conn, winning_team):
+    # Players 0-4 play red and 5-9 blue
+    cursor = await conn.execute("INSERT INTO Matches (MatchNumber, LobbyNumber, WinningTeam) VALUES ('1', '1', ?)", (winning_team,))
+    await conn.executemany(
+        "INSERT INTO MatchParticipants (MatchID, DiscordID, Team, Role) VALUES (?, ?, ?, ?)",
+        [(cursor.lastrowid, str(i), "red" if i < 5 else "blue", matchmaking.ROLES[i % 5]) for i in range(10)]
+    )
+    return cursor.lastrowid
+
+
+async def wins(conn):
+    return {discord_id: (wins, win_rate) for discord_id, wins, win_rate in
+            await conn.execute_fetchall("SELECT DiscordID, Wins, WinRate FROM PlayerStats ORDER BY DiscordID")}
+
+
+def test_migrations_are_idempotent(tmp_path):
+    async def test(db):
+        async with db.writer() as conn:
+            before = await schema(conn)
+            assert await migrations.schema_version(conn) == len(migrations.MIGRATIONS)
+
+            # Running migrate() again is a no-op, and so is applying every migration again by hand
+            await migrations.migrate(conn)
+            for migration in migrations.MIGRATIONS:
+                await conn.execute("BEGIN")
+                await migration(conn)
+                await conn.commit()
+
+            assert await schema(conn) == before
+            assert await migrations.schema_version(conn) == len(migrations.MIGRATIONS)
+    run(tmp_path, test)
+
+
+def test_ledger_triggers_count_wins_and_corrections(tmp_path):
+    async def test(db):
+        async with db.writer() as conn:
+            await add_players(conn, 10)
+            match_id = await record_match(conn, "red")
+            await conn.commit()
+
+            stats = await wins(conn)
+            assert [stats[i] for i in range(10)] == [(1, 0.25)] * 5 + [(0, 0.0)] * 5
+            totals = dict(await conn.execute_fetchall("SELECT DiscordID, MatchWins FROM PlayerMatchTotals"))
+            assert totals == {i: int(i < 5) for i in range(10)}
+
+            # Correcting the result moves the win to the other team and is logged
+            await conn.execute("UPDATE Matches SET WinningTeam = 'blue' WHERE MatchID = ?", (match_id,))
+            await conn.commit()
+
+            stats = await wins(conn)
+            assert [stats[i] for i in range(10)] == [(0, 0.0)] * 5 + [(1, 0.25)] * 5
+            totals = dict(await conn.execute_fetchall("SELECT DiscordID, MatchWins FROM PlayerMatchTotals"))
+            assert totals == {i: int(i >= 5) for i in range(10)}
+            assert await conn.execute_fetchall("SELECT MatchID, PreviousWinningTeam, WinningTeam FROM MatchCorrections") == [
+                (match_id, "red", "blue")
+            ]
+
+            # Setting the same winner again changes nothing
+            await conn.execute("UPDATE Matches SET WinningTeam = 'blue' WHERE MatchID = ?", (match_id,))
+            await conn.commit()
+            assert (await wins(conn))[5] == (1, 0.25)
+            assert len(await conn.execute_fetchall("SELECT * FROM MatchCorrections")) == 1
+    run(tmp_path, test)
+
+
+@pytest.mark.parametrize("statement", [
+    "DELETE FROM Matches",
+    "DELETE FROM MatchParticipants",
+    "UPDATE MatchParticipants SET Team = 'red'",
+    "UPDATE Matches SET LobbyNumber = '2'",
+])
+def test_ledger_is_append_only(tmp_path, statement):
+    async def test(db):
+        async with db.writer() as conn:
+            await add_players(conn, 10)
+            await record_match(conn, "red")
+            await conn.commit()
+            with pytest.raises(sqlite3.IntegrityError):
+                await conn.execute(statement)
+            await conn.rollback()
+    run(tmp_path, test)
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import database
+import migrations
+import player_cache
+
+
+def run(tmp_path, test):
+    # Runs test(db, cache) against a migrated database holding players 1 and 2
+    async def main():
+        db = database.Database(str(tmp_path / "test.db"), readers=1)
+        await db.open()
+        try:
+            async with db.writer() as conn:
+                await migrations.migrate(conn)
+                await conn.executemany(
+                    "INSERT INTO PlayerStats (DiscordID, DiscordUsername) VALUES (?, ?)", [(1, "Player1"), (2, "Player2")]
+                )
+                await conn.commit()
+            await test(db, player_cache.PlayerCache(db))
+        finally:
+            await db.close()
+    asyncio.run(main())
+
+
+async def stored(db, discord_id, column):
+    async with db.reader() as conn:
+        return (await conn.execute_fetchall(f"SELECT {column} FROM PlayerStats WHERE DiscordID = ?", (discord_id,)))[0][0]
+
+
+def test_flush_writes_dirty_values_in_one_go(tmp_path):
+    async def test(db, cache):
+        await cache.load()
+        cache.write("1", {"TopPriority": 1, "MidPriority": 2})
+        cache.write("2", {"PlayerRank": "GOLD", "PlayerTier": 3})
+        cache.write("1", {"TopPriority": 3})
+
+        assert (await cache.get("1"))["TopPriority"] == 3  # Reads see writes before they're flushed
+        assert await stored(db, 1, "TopPriority") == 5
+
+        assert await cache.flush() == 2
+        assert await stored(db, 1, "RolePreference") == "35255"
+        assert await stored(db, 2, "PlayerRank") == "GOLD"
+        assert await stored(db, 2, "PlayerTier") == 3
+        assert cache.dirty == {} and await cache.flush() == 0
+    run(tmp_path, test)
+
+
+def test_forget_keeps_unflushed_writes(tmp_path):
+    async def test(db, cache):
+        await cache.get("1")
+        cache.write("1", {"JunglePriority": 1})
+
+        # A direct change to another column, as /link makes
+        async with db.writer() as conn:
+            await conn.execute("UPDATE PlayerStats SET PlayerRiotID = 'Name#NA1' WHERE DiscordID = 1")
+            await conn.commit()
+        cache.forget("1")
+
+        player = await cache.get("1")
+        assert player["PlayerRiotID"] == "Name#NA1"
+        assert player["JunglePriority"] == 1
+        await cache.flush()
+        assert await stored(db, 1, "RolePreference") == "51555"
+        assert await stored(db, 1, "PlayerRiotID") == "Name#NA1"
+    run(tmp_path, test)
+
+
+def test_forget_drop_writes_discards_unflushed_writes(tmp_path):
+    async def test(db, cache):
+        cache.write("2", {"SupportPriority": 1})
+        async with db.writer() as conn:
+            await conn.execute("DELETE FROM PlayerStats WHERE DiscordID = 2")
+            await conn.commit()
+        cache.forget("2", drop_writes=True)
+
+        assert await cache.get("2") is None
+        assert await cache.flush() == 0
+    run(tmp_path, test)
+
+
+def test_failed_flush_keeps_values_for_the_next_one(tmp_path):
+    async def test(db, cache):
+        cache.write("1", {"BotPriority": 2})
+        await db.close()  # Makes the flush fail
+        with pytest.raises(Exception):
+            await cache.flush()
+        assert cache.dirty == {"1": {"BotPriority": 2}}
+
+        await db.open()
+        assert await cache.flush() == 1
+        assert await stored(db, 1, "BotPriority") == 2
+    run(tmp_path, test)
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+import riot_api
+
+
+def open_breaker(breaker, now=0.0):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow(now)
+        breaker.failed(now)
+
+
+def test_breaker_opens_after_threshold_failures_in_a_row():
+    breaker = riot_api.CircuitBreaker(failure_threshold=3, open_seconds=10)
+    for _ in range(2):
+        assert breaker.allow(0)
+        breaker.failed(0)
+    assert breaker.allow(0)
+    breaker.succeeded()  # An answer resets the count
+    for _ in range(2):
+        assert breaker.allow(0)
+        breaker.failed(0)
+    assert breaker.state == breaker.CLOSED
+
+    assert breaker.allow(0)
+    breaker.failed(0)
+    assert breaker.state == breaker.OPEN
+    assert 5 <= breaker.open_until <= 10
+    assert not breaker.allow(1)
+    assert breaker.rejected == 1
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = riot_api.CircuitBreaker(failure_threshold=1, open_seconds=10)
+    open_breaker(breaker)
+
+    assert breaker.allow(10)
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow(10)  # Only the probe
+
+    breaker.succeeded()
+    assert breaker.state == breaker.CLOSED
+    assert breaker.allow(10) and breaker.allow(10)
+
+
+def test_failed_probe_reopens_for_twice_as_long():
+    breaker = riot_api.CircuitBreaker(failure_threshold=1, open_seconds=10)
+    open_breaker(breaker)
+
+    assert breaker.allow(10)
+    breaker.failed(10, probe=True)
+    assert breaker.state == breaker.OPEN
+    assert 20 <= breaker.open_until <= 30
+    assert breaker.times_opened == 2
+
+
+def test_stale_failures_dont_reopen_the_breaker():
+    breaker = riot_api.CircuitBreaker(failure_threshold=1, open_seconds=10)
+    assert breaker.allow(0) and breaker.allow(0)  # The second request is still in flight when the first one fails
+    breaker.failed(0)
+    open_until = breaker.open_until
+
+    breaker.failed(1)  # The in-flight request fails while the breaker is open
+    assert breaker.state == breaker.OPEN and breaker.open_until == open_until
+
+    assert breaker.allow(10)
+    breaker.failed(10)  # Another request started before the breaker opened fails while the probe is out
+    assert breaker.state == breaker.HALF_OPEN and breaker.probing
+    assert breaker.times_opened == 1
+
+
+def test_abandoned_probe_frees_the_probe_slot():
+    breaker = riot_api.CircuitBreaker(failure_threshold=1, open_seconds=10)
+    open_breaker(breaker)
+
+    assert breaker.allow(10)
+    breaker.abandoned(probe=True)
+    assert breaker.allow(10)
+
+
+@pytest.mark.parametrize("header, limits", [
+    ("20:1,100:120", [(20, 1.0), (100, 120.0)]),
+    ("", []),
+    (None, []),
+    ("20:1,abc:5,:,100:x", [(20, 1.0)]),
+])
+def test_parse_rate_limits(header, limits):
+    assert riot_api.parse_rate_limits(header) == limits
+
+
+def test_prioritize_moves_a_waiting_request_ahead():
+    async def main():
+        rate_limiter = riot_api.RateLimiter("1:60")
+        sent = []
+
+        async def request(path, priority):
+            await rate_limiter.acquire(f"https://riot.test/{path}", "method", priority)
+            sent.append(path)
+
+        first = asyncio.create_task(request("first", riot_api.BACKGROUND))
+        await first  # Uses up the application limit
+        waiting = [asyncio.create_task(request(path, riot_api.BACKGROUND)) for path in ("a", "b", "c")]
+        await asyncio.sleep(0)
+        rate_limiter.prioritize("https://riot.test/c", riot_api.INTERACTIVE)
+
+        queue = rate_limiter.queues["riot.test"]
+        assert min(queue)[4] == "https://riot.test/c"
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        rate_limiter.dispatchers["riot.test"].cancel()
+    asyncio.run(main())